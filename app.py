@@ -1,97 +1,351 @@
-from flask import Flask, render_template, request, url_for, send_file
-from io import BytesIO
-from services.pdf_service import extract_pdf_sentences_with_ocr_fallback
-from create_embeddings.create_embeddings_sentences import create_embeddings
-from semantic_search.semantic_search import run_semantic_search
+import json
+import os
+import threading
+from flask import Flask, render_template, request, url_for, send_file, Response, stream_with_context, jsonify, redirect, session
+from services.job_queue import get_job_queue, QueueFull, JOB_WORKERS
+from services.document_store import get_document_store
+from services.result_cache import pdf_hash
+from paths import SAVE_PATH
+from services import metrics, warmup
+# The pipeline, the embedding model and the vector index are imported inside
+# the routes that use them, so importing this module stays cheap.
+
+# Seconds clients are asked to wait when the job queue is full
+JOB_RETRY_AFTER = 10
+# /upload_stream runs the pipeline in the request: at most this many at once,
+# further streams get 503 + Retry-After like a full job queue
+MAX_STREAMS = int(os.environ.get("MAX_STREAMS", JOB_WORKERS))
+# Seconds /search clients are asked to wait while the index is re-encoded
+REINDEX_RETRY_AFTER = 30
+# Documents a session can open in the viewer (most recent uploads)
+SESSION_MAX_DOCUMENTS = 20
+# Session signing key used when FLASK_SECRET_KEY is not set
+SECRET_KEY_FILE = os.path.join(os.path.dirname(SAVE_PATH), "secret_key")
+
+
+def _secret_key():
+    """
+    FLASK_SECRET_KEY, or a key generated once and kept in SECRET_KEY_FILE, so
+    every worker process and every restart signs sessions the same way.
+    """
+    key = os.environ.get("FLASK_SECRET_KEY")
+    if key:
+        return key
+    if not os.path.exists(SECRET_KEY_FILE):
+        os.makedirs(os.path.dirname(SECRET_KEY_FILE) or ".", exist_ok=True)
+        tmp_path = f"{SECRET_KEY_FILE}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(os.urandom(32).hex())
+        os.chmod(tmp_path, 0o600)
+        try:
+            # link() fails if another worker created the file first
+            os.link(tmp_path, SECRET_KEY_FILE)
+        except FileExistsError:
+            pass
+        finally:
+            os.remove(tmp_path)
+    with open(SECRET_KEY_FILE) as f:
+        return f.read().strip()
+
+
+_stream_slots = threading.BoundedSemaphore(MAX_STREAMS)
 
 app = Flask(__name__)
+# Sessions remember which documents a browser uploaded
+app.secret_key = _secret_key()
+
+
+if warmup.STARTUP_MODE == "eager":
+    warmup.warm_up()
+
+metrics.gauge("jobs_pending", lambda: get_job_queue().pending())
+
+
+@app.before_request
+def _start_warmup():
+    if warmup.STARTUP_MODE == "background":
+        warmup.start_background_warmup()
+
+
+@app.before_request
+def _start_job_workers():
+    # On the first request rather than at import (debug reloader, cheap
+    # imports); jobs left queued or running by a previous run resume then
+    get_job_queue().start()
 
-pdf_storage = {}
+
+def _flag(name):
+    """True for ?name=1 (or a form field of that name set to 1)."""
+    return request.values.get(name) == "1"
+
+
+def _profile_requested():
+    return metrics.PROFILING_ENABLED and _flag("profile")
+
+
+def _busy_response(message, retry_after, wants_json=True):
+    """503 asking the client to retry later (full job queue / stream slots)."""
+    if wants_json:
+        response = jsonify({"status": "error", "message": message})
+    else:
+        response = Response(render_template("index.html", rows=[], error=message))
+    response.status_code = 503
+    response.headers["Retry-After"] = str(retry_after)
+    return response
+
+
+def _store_upload(pdf_file):
+    """
+    Read an uploaded PDF into the document store and attach it to the
+    session. The session holds one reference to each of its documents.
+    """
+    pdf_bytes = pdf_file.read()
+    store = get_document_store()
+    previous = session.get("documents", [])
+    doc_id = store.put(pdf_bytes, pdf_file.filename,
+                       reference=pdf_hash(pdf_bytes) not in previous)
+    documents = [d for d in previous if d != doc_id] + [doc_id]
+    for dropped in documents[:-SESSION_MAX_DOCUMENTS]:
+        store.release(dropped)
+    session["documents"] = documents[-SESSION_MAX_DOCUMENTS:]
+    return pdf_bytes, doc_id
 
 @app.route("/", methods=["GET"])
 def index():
-    return render_template("index.html", rows=[])
+    job_id = request.args.get("job")
+    if not job_id:
+        return render_template("index.html", rows=[])
+
+    # Server-rendered job page for form posts; refreshes until the job ends
+    job = get_job_queue().get(job_id)
+    if job is None:
+        return render_template("index.html", rows=[], error=f"Unknown job: {job_id}"), 404
+    if job["status"] == "failed":
+        return render_template("index.html", rows=[], error=job["error"])
+    if job["status"] != "done":
+        return render_template("index.html", rows=[], job=job)
+
+    results = [r for r in get_job_queue().results(job_id) or [] if r.get("keywords")]
+    if not results:
+        return render_template(
+            "index.html",
+            rows=[],
+            error="No ESG related content found in this document. "
+                  "Next steps: verify file and manually review."
+        )
+    doc_id = request.args.get("doc")
+    viewer_url = url_for("pdf_viewer", doc_id=doc_id) if doc_id else url_for("pdf_viewer")
+    return render_template("index.html", rows=results, auto_open_pdf=viewer_url)
 
 @app.route("/upload", methods=["POST"])
 def upload_pdf():
+    """Queue a PDF for processing and return its job id right away."""
     pdf_file = request.files.get("pdf_file")
     if not pdf_file:
         return "No file uploaded", 400
 
-    pdf_bytes = pdf_file.read()
-    pdf_storage["file"] = pdf_bytes
-    pdf_storage["filename"] = pdf_file.filename
+    pdf_bytes, doc_id = _store_upload(pdf_file)
 
+    wants_json = request.accept_mimetypes.best == "application/json"
     try:
-        print(f"📄 Processing PDF: {pdf_file.filename}")
-        extracted_sentences = extract_pdf_sentences_with_ocr_fallback(pdf_bytes)
-        
-        if not extracted_sentences:
-            print("⚠️ No sentences extracted from PDF")
-            return render_template("index.html", rows=[], error="No text could be extracted from the PDF")
-
-        print(f"✅ Extracted {len(extracted_sentences)} pages")
-        total_sentences = sum(len(page.get('sentences', [])) for page in extracted_sentences)
-        print(f"✅ Total sentences: {total_sentences}")
-
-        print("🔄 Creating embeddings...")
-        embeddings_result = create_embeddings(extracted_sentences)
-        
-        if not embeddings_result:
-            print("⚠️ No embeddings created")
-            return render_template("index.html", rows=[], error="Failed to create embeddings")
-
-        print(f"✅ Created {len(embeddings_result)} embeddings")
-
-        print("🔍 Running semantic search...")
-        search_results = run_semantic_search(embeddings_result)
-
-        # Handle structured errors from semantic search
-        if isinstance(search_results, dict) and search_results.get("status") == "error":
-            return render_template(
-                "index.html",
-                rows=[],
-                error=search_results.get("message", "Unknown error during semantic search")
-            )
-
-        # Filter only results with keyword matches
-        results = [r for r in search_results if r.get("keywords")]
-        print(f"🎯 Found {len(results)} results with keyword matches")
-
-        # Handle case where no ESG matches were found
-        if not results:
-            return render_template(
-                "index.html",
-                rows=[],
-                error="No ESG related content found in this document. "
-                      "Next steps: verify file and manually review."
-            )
-
-        viewer_url = url_for("pdf_viewer")
-        return render_template("index.html", rows=results, auto_open_pdf=viewer_url)
-
-    except Exception as e:
-        print(f"❌ Error processing PDF: {e}")
-        import traceback
-        traceback.print_exc()
-        return render_template("index.html", rows=[], error=f"Error processing PDF: {str(e)}")
+        job_id = get_job_queue().submit(pdf_bytes, pdf_file.filename,
+                                        profile=_profile_requested())
+    except QueueFull as e:
+        print(f"⚠️ Upload rejected, job queue full: {e}")
+        return _busy_response("The server is busy processing other documents. "
+                              "Please retry shortly.", JOB_RETRY_AFTER, wants_json)
+
+    print(f"📥 Queued PDF {pdf_file.filename} as job {job_id[:8]}")
+    if wants_json:
+        body = {"job_id": job_id, "doc_id": doc_id,
+                "status_url": url_for("job_status", job_id=job_id),
+                "results_url": url_for("job_results", job_id=job_id),
+                "viewer_url": url_for("pdf_viewer", doc_id=doc_id)}
+        if _profile_requested():
+            body["profile_url"] = url_for("job_profile", job_id=job_id)
+        return jsonify(body), 202
+    return redirect(url_for("index", job=job_id, doc=doc_id), code=303)
+
+@app.route("/jobs/<job_id>", methods=["GET"])
+def job_status(job_id):
+    job = get_job_queue().get(job_id)
+    if job is None:
+        return jsonify({"status": "error", "message": f"Unknown job: {job_id}"}), 404
+    return jsonify(job)
+
+@app.route("/jobs/<job_id>/results", methods=["GET"])
+def job_results(job_id):
+    queue = get_job_queue()
+    job = queue.get(job_id)
+    if job is None:
+        return jsonify({"status": "error", "message": f"Unknown job: {job_id}"}), 404
+    if job["status"] == "failed":
+        return jsonify({"status": "error", "message": job["error"]}), 422
+    if job["status"] != "done":
+        return jsonify(job), 202
+    results = [r for r in queue.results(job_id) or [] if r.get("keywords")]
+    body = {"job_id": job_id, "results": results}
+    if _flag("timings"):
+        body["timings"] = job["timings"]
+    return jsonify(body)
+
+@app.route("/jobs/<job_id>/profile", methods=["GET"])
+def job_profile(job_id):
+    """Profiler report of a job uploaded with profile=1 (PROFILING_ENABLED)."""
+    report = get_job_queue().profile_report(job_id)
+    if report is None:
+        return jsonify({"status": "error", "message": f"No profile for job: {job_id}"}), 404
+    return Response(report, mimetype="text/plain")
+
+@app.route("/upload_stream", methods=["POST"])
+def upload_pdf_stream():
+    """Same pipeline as /upload, streamed page by page as NDJSON events."""
+    pdf_file = request.files.get("pdf_file")
+    if not pdf_file:
+        return "No file uploaded", 400
+
+    if not _stream_slots.acquire(blocking=False):
+        print(f"⚠️ Stream rejected, {MAX_STREAMS} streams already running")
+        return _busy_response("The server is busy processing other documents. "
+                              "Please retry shortly.", JOB_RETRY_AFTER)
+    try:
+        pdf_bytes, doc_id = _store_upload(pdf_file)
+        viewer_url = url_for("pdf_viewer", doc_id=doc_id)
+        from services.pipeline import stream_pipeline
+    except Exception:
+        _stream_slots.release()
+        raise
+    with_timings = _flag("timings")
+
+    def generate():
+        print(f"📄 Streaming PDF: {pdf_file.filename}")
+        yield json.dumps({"event": "start", "viewer_url": viewer_url}) + "\n"
+        try:
+            with metrics.collect_timings() as timings:
+                for event in stream_pipeline(pdf_bytes, pdf_file.filename):
+                    if with_timings and event.get("event") == "done":
+                        event = dict(event, timings=timings)
+                    yield json.dumps(event, ensure_ascii=False) + "\n"
+        except Exception as e:
+            print(f"❌ Error processing PDF: {e}")
+            import traceback
+            traceback.print_exc()
+            yield json.dumps({"event": "error", "message": f"Error processing PDF: {str(e)}"}) + "\n"
+
+    response = Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+    # Called by the server once the response is done, even when the client
+    # disconnects before the body is read
+    response.call_on_close(_stream_slots.release)
+    return response
+
+@app.route("/search", methods=["GET"])
+def search_corpus():
+    """Free-text semantic search across every indexed document."""
+    query = request.args.get("q", "").strip()
+    if not query:
+        return jsonify({"status": "error", "message": "Missing query parameter q"}), 400
+    k = min(max(request.args.get("k", 10, type=int), 1), 100)
+
+    from create_embeddings.create_embeddings_sentences import encode_query
+    from semantic_search.vector_index import IndexModelMismatch, get_vector_index
+    report = None
+    try:
+        with metrics.collect_timings() as timings:
+            if _profile_requested():
+                with metrics.profile() as report:
+                    results = _search_index(get_vector_index(), encode_query, query, k)
+            else:
+                results = _search_index(get_vector_index(), encode_query, query, k)
+    except IndexModelMismatch as e:
+        # The encoder changed (ENCODER_BACKEND, encoder server): re-encode
+        # the corpus in the background rather than compare across models
+        from create_embeddings.encoder import current_model_id
+        from services.pipeline import reindex_search_index
+        print(f"⚠️ {e}; re-encoding the search index")
+        reindex_search_index(current_model_id())
+        response = jsonify({"status": "error",
+                            "message": "The search index is being rebuilt for the current "
+                                       "model. Please retry shortly."})
+        response.status_code = 503
+        response.headers["Retry-After"] = str(REINDEX_RETRY_AFTER)
+        return response
+    body = {"query": query, "k": k, "results": results}
+    if _flag("timings"):
+        body["timings"] = timings
+    if report is not None:
+        body["profile"] = report.report
+    return jsonify(body)
+
+
+def _search_index(index, encode_query, query, k):
+    from create_embeddings.encoder import current_model_id
+    with metrics.span("encode_query"):
+        vector = encode_query(query)
+    with metrics.span("index_search"):
+        return index.search(vector, k=k, model=current_model_id())
+
+@app.route("/metrics", methods=["GET"])
+def prometheus_metrics():
+    """Prometheus scrape endpoint (this process's counters and timings)."""
+    return Response(metrics.render_prometheus(),
+                    mimetype="text/plain; version=0.0.4")
+
+@app.route("/documents", methods=["GET"])
+def list_documents():
+    from semantic_search.vector_index import get_vector_index
+    return jsonify({"documents": get_vector_index().documents()})
+
+@app.route("/documents/<doc_id>", methods=["DELETE"])
+def delete_document(doc_id):
+    """
+    Remove a document from this session. The stored PDF and its /search
+    entries go once no other session still holds the same document.
+    """
+    documents = session.get("documents", [])
+    if doc_id not in documents:
+        return jsonify({"status": "error", "message": f"Unknown document: {doc_id}"}), 404
+    session["documents"] = [d for d in documents if d != doc_id]
+    remaining = get_document_store().release(doc_id, remove_unused=True)
+    removed = 0
+    if not remaining:
+        from semantic_search.vector_index import get_vector_index
+        removed = get_vector_index().remove_document(doc_id)
+    return jsonify({"doc_id": doc_id, "removed_sentences": removed,
+                    "shared": bool(remaining)})
+
+@app.route("/ready", methods=["GET"])
+def ready():
+    """Readiness probe: 200 once the model, keyword matrix and tokenizer are loaded."""
+    state = warmup.readiness()
+    return jsonify(state), 200 if state["ready"] else 503
 
 @app.route("/pdf_viewer")
-def pdf_viewer():
-    if "file" not in pdf_storage:
+@app.route("/pdf_viewer/<doc_id>")
+def pdf_viewer(doc_id=None):
+    documents = session.get("documents", [])
+    if doc_id is None and documents:
+        doc_id = documents[-1]
+    if doc_id not in documents:
         return "No PDF uploaded", 404
 
-    return render_template("viewer.html", pdf_url=url_for("serve_pdf"))
+    return render_template("viewer.html", pdf_url=url_for("serve_pdf", doc_id=doc_id))
 
-@app.route("/serve_pdf")
-def serve_pdf():
-    if "file" not in pdf_storage:
+@app.route("/serve_pdf/<doc_id>")
+def serve_pdf(doc_id):
+    if doc_id not in session.get("documents", []):
+        return "No PDF uploaded", 404
+    found = get_document_store().open(doc_id)
+    if found is None:
         return "No PDF uploaded", 404
 
+    # Served from a real path: supports Range requests so pdf.js can load
+    # pages lazily, and conditional requests for repeat loads
+    path, filename = found
     return send_file(
-        BytesIO(pdf_storage["file"]),
-        download_name=pdf_storage["filename"],
-        mimetype="application/pdf"
+        path,
+        download_name=filename or f"{doc_id}.pdf",
+        mimetype="application/pdf",
+        conditional=True
     )
 
 if __name__ == "__main__":
@@ -0,0 +1,336 @@
+# batch.py
+# Bulk mode: process every PDF under a directory without the web app.
+#
+#   python batch.py reports/ [--out data/batch] [--workers 8]
+#                            [--encoder server|local] [--retry-failed]
+#
+# Documents are spread over a process pool; the workers share one copy of
+# the model through the encoder server (a running one, or one started in
+# this process). Each document goes through the same pipeline as /upload
+# (and fills the same result cache); its matches are written to
+#   <out>/results/<hash[:2]>/<hash>.json.gz
+# and recorded in <out>/manifest.sqlite, so an interrupted run picks up
+# where it stopped and documents already processed (by content hash, under
+# any file name) are skipped.
+import argparse
+import hashlib
+import multiprocessing
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import AuthenticationError
+from paths import SAVE_PATH
+
+# ---------------- CONFIG ----------------
+BATCH_DIR = os.path.join(os.path.dirname(SAVE_PATH), "batch")
+BATCH_WORKERS = int(os.environ.get("BATCH_WORKERS", os.cpu_count() or 1))
+# Documents queued per worker ahead of the one it is processing
+QUEUE_AHEAD = 2
+# Seconds to wait for a freshly started encoder server to load its model
+ENCODER_START_TIMEOUT = 300
+HASH_CHUNK = 1024 * 1024
+
+DONE, FAILED = "done", "failed"
+
+
+class BatchManifest:
+    """
+    Checkpoint of a batch run in SQLite:
+      documents  content hash -> outcome, counts and output file
+      files      path, size and mtime -> content hash, so unchanged files
+                 are not hashed again on resume
+    Only the parent process writes to it.
+    """
+
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS documents ("
+            " doc_hash TEXT PRIMARY KEY, path TEXT, status TEXT NOT NULL,"
+            " pages INTEGER, sentences INTEGER, matches INTEGER,"
+            " seconds REAL, output TEXT, error TEXT, finished REAL)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            " path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER,"
+            " doc_hash TEXT NOT NULL)")
+        self._conn.commit()
+
+    def known_hash(self, path, stat):
+        row = self._conn.execute(
+            "SELECT doc_hash FROM files WHERE path = ? AND size = ? AND mtime_ns = ?",
+            (path, stat.st_size, stat.st_mtime_ns)).fetchone()
+        return row[0] if row else None
+
+    def remember_hash(self, path, stat, doc_hash):
+        self._conn.execute(
+            "INSERT OR REPLACE INTO files (path, size, mtime_ns, doc_hash)"
+            " VALUES (?, ?, ?, ?)", (path, stat.st_size, stat.st_mtime_ns, doc_hash))
+        self._conn.commit()
+
+    def status(self, doc_hash):
+        row = self._conn.execute("SELECT status FROM documents WHERE doc_hash = ?",
+                                 (doc_hash,)).fetchone()
+        return row[0] if row else None
+
+    def record(self, doc_hash, path, outcome):
+        self._conn.execute(
+            "INSERT OR REPLACE INTO documents (doc_hash, path, status, pages,"
+            " sentences, matches, seconds, output, error, finished)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (doc_hash, path, outcome["status"], outcome.get("pages"),
+             outcome.get("sentences"), outcome.get("matches"),
+             outcome.get("seconds"), outcome.get("output"),
+             outcome.get("error"), time.time()))
+        self._conn.commit()
+
+    def close(self):
+        self._conn.close()
+
+
+def find_pdfs(input_dir):
+    """Every *.pdf below input_dir, in a stable order."""
+    found = []
+    for root, dirs, files in os.walk(input_dir):
+        dirs.sort()
+        found.extend(os.path.join(root, name) for name in sorted(files)
+                     if name.lower().endswith(".pdf"))
+    return found
+
+
+def file_hash(path):
+    """Same digest as result_cache.pdf_hash, without holding the file in memory."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def output_path(out_dir, doc_hash):
+    return os.path.join(out_dir, "results", doc_hash[:2], f"{doc_hash}.json.gz")
+
+
+# ---------------- WORKER ----------------
+def _exit_with_parent(parent_pid):
+    # A killed batch run must not leave its workers behind
+    while os.getppid() == parent_pid:
+        time.sleep(1)
+    os._exit(1)
+
+
+def _init_worker(parent_pid):
+    # Pool workers must not write the shared /search index concurrently,
+    # nor race each other on the single last-run embeddings/results files
+    from services import pipeline
+    pipeline.INDEX_DOCUMENTS = False
+    pipeline.WRITE_ARTIFACTS = False
+    threading.Thread(target=_exit_with_parent, args=(parent_pid,),
+                     daemon=True).start()
+
+
+def process_file(path, doc_hash, out_path):
+    """
+    Extraction -> embedding -> search for one PDF, through
+    pipeline.process_document like an upload. Matches go to out_path;
+    returns the outcome recorded in the manifest. sentences counts the
+    sentences encoded, and is None when the results came from the cache.
+    """
+    import fitz
+    from services.persistence import write_json_gz
+    from services.pipeline import process_document
+
+    start = time.perf_counter()
+    with open(path, "rb") as f:
+        pdf_bytes = f.read()
+
+    encoded = {}
+
+    def progress(stage, done=None, total=None):
+        if stage == "embed":
+            encoded["sentences"] = total
+
+    results = process_document(pdf_bytes, os.path.basename(path), progress=progress)
+    if isinstance(results, dict):
+        return {"status": FAILED, "error": results.get("message", "Unknown error"),
+                "seconds": time.perf_counter() - start}
+    results = [r for r in results if r.get("keywords")]
+    with fitz.open(stream=pdf_bytes, filetype="pdf") as doc:
+        pages = doc.page_count
+
+    write_json_gz(out_path, {"doc_hash": doc_hash,
+                             "filename": os.path.basename(path),
+                             "pages": pages, "results": results})
+    return {"status": DONE, "pages": pages, "sentences": encoded.get("sentences"),
+            "matches": len(results), "output": out_path,
+            "seconds": time.perf_counter() - start}
+
+
+# ---------------- ENCODER ----------------
+def start_shared_encoder():
+    """
+    Point pool workers at one encoder server: a running one when it
+    answers, otherwise one served from a thread of this process.
+    The server's listener removes its socket when this process exits.
+    """
+    from create_embeddings import encoder
+    if os.path.exists(encoder.ENCODER_SOCKET):
+        try:
+            encoder.EncoderClient().ping()
+            print(f"🔌 Using shared encoder server at {encoder.ENCODER_SOCKET}")
+            os.environ["ENCODER_MODE"] = "remote"
+            return
+        except (OSError, EOFError, AuthenticationError):
+            pass
+
+    from create_embeddings.encoder_server import EncoderServer
+    address = os.path.join(tempfile.gettempdir(), f"docintel-batch-{os.getpid()}.sock")
+    thread = threading.Thread(target=EncoderServer(address=address).serve_forever,
+                              daemon=True, name="encoder-server")
+    thread.start()
+    deadline = time.monotonic() + ENCODER_START_TIMEOUT
+    while not os.path.exists(address):
+        if not thread.is_alive() or time.monotonic() > deadline:
+            raise RuntimeError("Encoder server failed to start")
+        time.sleep(0.1)
+    os.environ["ENCODER_SOCKET"] = address
+    os.environ["ENCODER_MODE"] = "remote"
+
+
+# ---------------- RUN ----------------
+def _format_eta(seconds):
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600}h{seconds % 3600 // 60:02d}m"
+    return f"{seconds // 60}m{seconds % 60:02d}s"
+
+
+def run_batch(input_dir, out_dir=BATCH_DIR, workers=BATCH_WORKERS,
+              encoder="server", retry_failed=False):
+    """Process every PDF under input_dir; returns the run's counters."""
+    paths = find_pdfs(input_dir)
+    manifest = BatchManifest(os.path.join(out_dir, "manifest.sqlite"))
+    print(f"📂 Found {len(paths)} PDFs in {input_dir}")
+
+    # Workers are spawned after this, so they inherit the settings: one
+    # extraction process each, since the pool already runs one per core
+    os.environ["EXTRACTION_WORKERS"] = "1"
+    if encoder == "local":
+        os.environ["ENCODER_MODE"] = "local"
+
+    counts = {"processed": 0, "skipped": 0, "failed": 0, "pages": 0}
+    handled = 0
+    in_flight = {}          # future -> (doc_hash, path)
+    start = time.perf_counter()
+
+    def next_tasks():
+        """(path, doc_hash) for every file that still needs processing."""
+        nonlocal handled
+        for path in paths:
+            stat = os.stat(path)
+            doc_hash = manifest.known_hash(path, stat)
+            if doc_hash is None:
+                doc_hash = file_hash(path)
+                manifest.remember_hash(path, stat, doc_hash)
+            status = manifest.status(doc_hash)
+            pending = any(h == doc_hash for h, _ in in_flight.values())
+            if status == DONE or (status == FAILED and not retry_failed) or pending:
+                counts["skipped"] += 1
+                handled += 1
+                continue
+            yield path, doc_hash
+
+    def start_pool():
+        # Only once there is work: a fully resumed run loads no model
+        if encoder == "server":
+            start_shared_encoder()
+        return ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                   initargs=(os.getpid(),),
+                                   mp_context=multiprocessing.get_context("spawn"))
+
+    def report(path, outcome):
+        elapsed = time.perf_counter() - start
+        rate = counts["processed"] / elapsed if elapsed else 0.0
+        remaining = len(paths) - handled
+        eta = _format_eta(remaining / rate) if rate else "?"
+        name = os.path.basename(path)
+        if outcome["status"] == DONE:
+            detail = f"{outcome['pages']} pages, {outcome['matches']} matches"
+        else:
+            detail = f"failed: {outcome['error']}"
+        print(f"📦 [{handled}/{len(paths)}] {name}: {detail} ({outcome['seconds']:.1f}s)"
+              f" | {rate:.2f} docs/s, {counts['pages'] / elapsed:.1f} pages/s, ETA {eta}")
+
+    tasks = next_tasks()
+    pool = None
+    try:
+        exhausted = False
+        while True:
+            while not exhausted and len(in_flight) < workers * QUEUE_AHEAD:
+                task = next(tasks, None)
+                if task is None:
+                    exhausted = True
+                    break
+                path, doc_hash = task
+                pool = pool or start_pool()
+                future = pool.submit(process_file, path, doc_hash,
+                                     output_path(out_dir, doc_hash))
+                in_flight[future] = (doc_hash, path)
+            if not in_flight:
+                break
+
+            finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in finished:
+                doc_hash, path = in_flight.pop(future)
+                try:
+                    outcome = future.result()
+                except BrokenProcessPool:
+                    raise
+                except Exception as e:
+                    outcome = {"status": FAILED, "error": str(e), "seconds": 0.0}
+                manifest.record(doc_hash, path, outcome)
+                handled += 1
+                if outcome["status"] == DONE:
+                    counts["processed"] += 1
+                    counts["pages"] += outcome["pages"]
+                else:
+                    counts["failed"] += 1
+                report(path, outcome)
+    except BrokenProcessPool:
+        print("❌ A worker process died; rerun the same command to resume")
+        raise
+    finally:
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+        manifest.close()
+
+    elapsed = time.perf_counter() - start
+    print(f"✅ Batch complete in {_format_eta(elapsed)}: {counts['processed']} processed,"
+          f" {counts['skipped']} skipped, {counts['failed']} failed"
+          f" ({counts['processed'] / elapsed:.2f} docs/s,"
+          f" {counts['pages'] / elapsed:.1f} pages/s)")
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Process a directory of PDFs in bulk.")
+    parser.add_argument("input_dir")
+    parser.add_argument("--out", default=BATCH_DIR,
+                        help="results and checkpoint directory")
+    parser.add_argument("--workers", type=int, default=BATCH_WORKERS)
+    parser.add_argument("--encoder", choices=("server", "local"), default="server",
+                        help="server: one shared model (default); local: one per worker")
+    parser.add_argument("--retry-failed", action="store_true",
+                        help="process documents that failed in an earlier run again")
+    args = parser.parse_args()
+    run_batch(args.input_dir, args.out, max(1, args.workers), args.encoder,
+              args.retry_failed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+# bench_import_time.py
+# Tracks cold-start cost: wall time of `import app` in a fresh interpreter,
+# the slowest modules from `python -X importtime`, and (optionally) the
+# warm-up that loads tokenizer, keyword matrix and model.
+#
+#   python benchmarks/bench_import_time.py [--runs 5] [--top 15]
+#                                          [--warmup] [--max-seconds 1.5]
+import sys, os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import argparse
+import statistics
+import subprocess
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Modules that must not be imported by `import app` alone
+HEAVY_MODULES = ["torch", "sentence_transformers", "fitz", "nltk",
+                 "pytesseract", "faiss"]
+
+
+def _run_python(code, *flags):
+    env = dict(os.environ, STARTUP_MODE="lazy")
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [REPO_ROOT, env.get("PYTHONPATH")]))
+    start = time.perf_counter()
+    proc = subprocess.run([sys.executable, *flags, "-c", code], cwd=REPO_ROOT,
+                          env=env, capture_output=True, text=True)
+    elapsed = time.perf_counter() - start
+    if proc.returncode != 0:
+        sys.exit(f"❌ Failed to run {code!r}:\n{proc.stderr}")
+    return elapsed, proc.stdout, proc.stderr
+
+
+def import_wall_times(runs):
+    baseline = [_run_python("pass")[0] for _ in range(runs)]
+    with_app = [_run_python("import app")[0] for _ in range(runs)]
+    return statistics.median(with_app) - statistics.median(baseline)
+
+
+def slowest_imports(top):
+    """(cumulative seconds, module) pairs from -X importtime."""
+    _, _, stderr = _run_python("import app", "-X", "importtime")
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        # "import time:   self_us |   cumulative_us | [indent]module"
+        _, cumulative_us, name = line.split("|")
+        rows.append((int(cumulative_us) / 1e6, name.strip()))
+    rows.sort(reverse=True)
+    return rows[:top]
+
+
+def heavy_modules_loaded():
+    code = ("import sys, app; print(','.join(m for m in %r if m in sys.modules))"
+            % HEAVY_MODULES)
+    _, stdout, _ = _run_python(code)
+    return [m for m in stdout.strip().split(",") if m]
+
+
+def warmup_seconds():
+    code = ("import time, json; from services import warmup; "
+            "start = time.perf_counter(); warmup.warm_up(); "
+            "print(json.dumps({'total': time.perf_counter() - start, **warmup.readiness()['warmup_seconds']}))")
+    _, stdout, _ = _run_python(code)
+    return stdout.strip().splitlines()[-1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold-start benchmark for app.py")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--warmup", action="store_true",
+                        help="also time services.warmup.warm_up()")
+    parser.add_argument("--max-seconds", type=float, default=None,
+                        help="exit non-zero when `import app` is slower than this")
+    args = parser.parse_args()
+
+    seconds = import_wall_times(args.runs)
+    print(f"⏱️ import app: {seconds * 1000:.0f} ms (median of {args.runs}, interpreter start excluded)")
+
+    print("\n🐢 Slowest imports (cumulative):")
+    for cumulative, name in slowest_imports(args.top):
+        print(f"  {cumulative * 1000:8.1f} ms  {name}")
+
+    heavy = heavy_modules_loaded()
+    if heavy:
+        print(f"\n⚠️ Heavy modules imported at start-up: {', '.join(heavy)}")
+    else:
+        print("\n✅ No heavy modules imported at start-up")
+
+    if args.warmup:
+        print(f"\n🔥 Warm-up seconds: {warmup_seconds()}")
+
+    if args.max_seconds is not None and seconds > args.max_seconds:
+        sys.exit(f"❌ import app took {seconds:.2f}s (limit {args.max_seconds:.2f}s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,367 @@
+# bench_pipeline.py
+# End-to-end and per-stage benchmark on synthetic PDFs generated with
+# PyMuPDF: "digital" (text layer only), "scanned" (page images only) and
+# "mixed" (text plus an embedded scanned table). Every scenario runs in a
+# fresh process and records extraction (with OCR / Tesseract time), encoding
+# and matching throughput, peak RSS and net allocated blocks. Results are
+# compared with benchmarks/baseline.json; a regression beyond --tolerance,
+# or a missing baseline, exits non-zero. The committed baseline was recorded
+# with the hashing stub encoder (--encoder stub); re-record it on the
+# reference machine with --update-baseline.
+#
+# Runs offline: caches are disabled, nothing is written under data/, and a
+# hashing stub replaces the sentence-transformer when its weights are not
+# available (--encoder stub forces it). Scanned/mixed scenarios need the
+# tesseract binary and are skipped without it.
+#
+#   python benchmarks/bench_pipeline.py [--kinds digital scanned mixed]
+#                                       [--pages 10 100 1000] [--repeat 3]
+#                                       [--update-baseline] [--tolerance 0.25]
+import sys, os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Measure the work itself, not cache lookups
+os.environ["RESULT_CACHE"] = "0"
+os.environ["EMBEDDING_CACHE"] = "0"
+os.environ["OCR_CACHE"] = "0"
+
+import argparse
+import gc
+import json
+import multiprocessing
+import platform
+import random
+import resource
+import shutil
+import tempfile
+import time
+import tracemalloc
+import zlib
+import fitz
+import numpy as np
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+SEED = 1234
+LINES_PER_PAGE = 40
+SCAN_DPI = 150
+# Per-stage throughput metrics compared against the baseline (higher is better)
+THROUGHPUT_METRICS = ("extract_pages_per_s", "encode_sentences_per_s",
+                      "search_sentences_per_s", "total_pages_per_s")
+
+WORDS = ("carbon emissions scope water energy board governance diversity "
+         "supplier audit waste recycling renewable disclosure targets climate "
+         "employees safety community investment risk report revenue fiscal "
+         "quarter segment operating margin customers products markets").split()
+
+
+# ---------------- SYNTHETIC PDFS ----------------
+def _sentence(rng):
+    words = [rng.choice(WORDS) for _ in range(rng.randint(5, 12))]
+    return " ".join(words).capitalize() + "."
+
+
+def _draw_text_page(page, rng, top, bottom):
+    y = top
+    while y < bottom:
+        page.insert_text((54, y), _sentence(rng), fontsize=10)
+        y += (bottom - top) / LINES_PER_PAGE
+
+
+def _scan_of(rng, width, height):
+    """A grayscale page image (no text layer) of freshly drawn text."""
+    src = fitz.open()
+    page = src.new_page(width=width, height=height)
+    _draw_text_page(page, rng, 36, height - 36)
+    return page.get_pixmap(dpi=SCAN_DPI, colorspace=fitz.csGRAY).tobytes("png")
+
+
+def make_pdf(kind, pages, seed=SEED):
+    """Deterministic synthetic PDF bytes of the given kind."""
+    rng = random.Random(f"{seed}:{kind}:{pages}")
+    doc = fitz.open()
+    for n in range(pages):
+        page = doc.new_page(width=612, height=792)
+        if kind == "digital":
+            _draw_text_page(page, rng, 72, 740)
+        elif kind == "scanned":
+            page.insert_image(page.rect, stream=_scan_of(rng, 612, 792))
+        elif kind == "mixed":
+            _draw_text_page(page, rng, 72, 420)
+            page.insert_image(fitz.Rect(54, 440, 558, 740),
+                              stream=_scan_of(rng, 504, 300))
+        else:
+            raise ValueError(f"Unknown PDF kind: {kind}")
+        if kind != "scanned":
+            page.insert_text((300, 770), str(n + 1), fontsize=8)
+    return doc.tobytes()
+
+
+# ---------------- STUB ENCODER ----------------
+class HashingEncoder:
+    """
+    Model-free stand-in with the encoder interface: hashed word counts,
+    L2-normalized. Keeps the pipeline's data flow and array sizes, not its
+    compute cost or match quality.
+    """
+
+    def __init__(self, dim):
+        self.dim = dim
+        self.model_id = "hashing-stub"
+
+    def is_loaded(self):
+        return True
+
+    def encode(self, texts, batch_size=256, show_progress_bar=False):
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for i, text in enumerate(texts):
+            for word in text.lower().split():
+                vectors[i, zlib.crc32(word.encode("utf-8")) % self.dim] += 1.0
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.clip(norms, 1e-12, None)
+
+
+def _setup_encoder(kind):
+    """Install the encoder to benchmark; returns (name, keyword store)."""
+    from create_embeddings import encoder as encoder_module
+    from semantic_search.keyword_store import KeywordStore, read_keyword_variants
+
+    if kind in ("auto", "model"):
+        os.environ.setdefault("HF_HUB_OFFLINE", "1")
+        try:
+            encoder_module.get_encoder().encode(["warm-up"])
+            from semantic_search.keyword_store import get_keyword_store
+            return encoder_module.current_model_id(), get_keyword_store()
+        except Exception as e:
+            if kind == "model":
+                raise
+            print(f"⚠️ Model unavailable ({e}); using the hashing stub encoder")
+
+    stub = HashingEncoder(encoder_module.EMBEDDING_DIM)
+    encoder_module._encoder = stub
+    # Stub vectors must never reach the on-disk keyword store
+    terms, variants = read_keyword_variants()
+    matrix = stub.encode(variants)
+    return "stub", KeywordStore(matrix, terms, variants, "bench-stub", "stub")
+
+
+# ---------------- MEASUREMENT ----------------
+def _peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS, kilobytes elsewhere
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+class _Stage:
+    """Wall time and net allocated blocks (plus traced peak) of one stage."""
+
+    def __init__(self, trace_malloc):
+        self.trace_malloc = trace_malloc
+
+    def __enter__(self):
+        gc.collect()
+        if self.trace_malloc:
+            tracemalloc.start()
+        self.blocks = sys.getallocatedblocks()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.seconds = time.perf_counter() - self.start
+        self.alloc_blocks = sys.getallocatedblocks() - self.blocks
+        self.traced_peak_mb = None
+        if self.trace_malloc:
+            self.traced_peak_mb = tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+            tracemalloc.stop()
+
+
+def _timed(fn, totals, name):
+    """Wrap fn so its cumulative run time accumulates in totals[name]."""
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            totals[name] += time.perf_counter() - start
+    return wrapper
+
+
+def _run_stages(pdf_bytes, keyword_store, workers, trace_malloc):
+    """Extract -> encode -> match once; returns (stages, sentences, matches)."""
+    from services import pdf_service
+    from create_embeddings.create_embeddings_sentences import create_embeddings
+    from semantic_search.semantic_search import match_sentences
+    from services.persistence import persist_async
+
+    with _Stage(trace_malloc) as extract:
+        batch = pdf_service.extract_pdf_sentences_with_ocr_fallback(
+            pdf_bytes, workers=workers, as_batch=True)
+    sentences = len(batch)
+    with tempfile.TemporaryDirectory() as tmp:
+        with _Stage(trace_malloc) as encode:
+            batch = create_embeddings(batch, save_path=os.path.join(tmp, "bench.json"),
+                                      export_json=False)
+        # The artifact is written by the single background writer; drain it
+        # before its temp dir goes away
+        persist_async(lambda: None).result()
+    with _Stage(trace_malloc) as search:
+        results = match_sentences(batch.select(batch.valid_mask()), keyword_store)
+    return {"extract": extract, "encode": encode, "search": search}, sentences, len(results)
+
+
+def run_scenario(kind, pages, encoder_kind, workers, trace_malloc, repeat=1):
+    """
+    One scenario in the current (fresh) process; returns its metrics.
+    A one-page warm-up run absorbs first-call costs (imports, tokenizer);
+    with repeat > 1 each stage reports its fastest run.
+    """
+    from services import pdf_service
+
+    encoder_name, keyword_store = _setup_encoder(encoder_kind)
+    pdf_bytes = make_pdf(kind, pages)
+    pdf_service._ensure_nltk_dependencies()
+    _run_stages(make_pdf(kind, 1, seed=SEED + 1), keyword_store, workers, False)
+
+    # OCR timing is only visible when pages are extracted in this process
+    ocr = {"ocr": 0.0, "tesseract": 0.0}
+    pdf_service._ocr_words = _timed(pdf_service._ocr_words, ocr, "ocr")
+    pdf_service._tesseract_words = _timed(pdf_service._tesseract_words, ocr, "tesseract")
+
+    best = {}
+    for _ in range(repeat):
+        stages, sentences, matches = _run_stages(pdf_bytes, keyword_store,
+                                                 workers, trace_malloc)
+        for name, stage in stages.items():
+            if name not in best or stage.seconds < best[name].seconds:
+                best[name] = stage
+
+    metrics = {"kind": kind, "pages": pages, "encoder": encoder_name,
+               "workers": workers, "repeat": repeat}
+    for name, stage in best.items():
+        metrics[f"{name}_s"] = round(stage.seconds, 4)
+        metrics[f"{name}_alloc_blocks"] = stage.alloc_blocks
+        if stage.traced_peak_mb is not None:
+            metrics[f"{name}_traced_peak_mb"] = round(stage.traced_peak_mb, 1)
+    if workers <= 1:
+        metrics["ocr_s"] = round(ocr["ocr"] / repeat, 4)
+        metrics["tesseract_s"] = round(ocr["tesseract"] / repeat, 4)
+    total_s = sum(stage.seconds for stage in best.values())
+    metrics.update({
+        "sentences": sentences,
+        "matches": matches,
+        "extract_pages_per_s": round(pages / best["extract"].seconds, 2),
+        "encode_sentences_per_s": round(sentences / max(best["encode"].seconds, 1e-9), 1),
+        "search_sentences_per_s": round(sentences / max(best["search"].seconds, 1e-9), 1),
+        "total_pages_per_s": round(pages / total_s, 2),
+        "peak_rss_mb": round(_peak_rss_mb(), 1),
+    })
+    return metrics
+
+
+def _run_isolated(*args):
+    """Run a scenario in a fresh process so peak RSS is its own."""
+    ctx = multiprocessing.get_context("spawn")
+    with ctx.Pool(1) as pool:
+        return pool.apply(run_scenario, args)
+
+
+# ---------------- BASELINE ----------------
+def _environment():
+    return {"python": platform.python_version(), "machine": platform.machine(),
+            "cpus": os.cpu_count(), "pymupdf": fitz.VersionBind}
+
+
+def compare(results, baseline, tolerance):
+    """Regression messages for results that are worse than the baseline."""
+    failures = []
+    previous = {f"{r['kind']}-{r['pages']}": r for r in baseline.get("results", [])}
+    for r in results:
+        key = f"{r['kind']}-{r['pages']}"
+        base = previous.get(key)
+        if base is None:
+            print(f"ℹ️ {key}: not in baseline")
+            continue
+        for metric in THROUGHPUT_METRICS:
+            if metric.startswith("encode") and base.get("encoder") != r["encoder"]:
+                continue  # different encoders are not comparable
+            if base.get(metric) and r[metric] < base[metric] * (1 - tolerance):
+                failures.append(f"{key} {metric}: {r[metric]} < baseline {base[metric]}")
+        if base.get("peak_rss_mb") and r["peak_rss_mb"] > base["peak_rss_mb"] * (1 + tolerance):
+            failures.append(f"{key} peak_rss_mb: {r['peak_rss_mb']} > "
+                            f"baseline {base['peak_rss_mb']}")
+    return failures
+
+
+def _print_result(r):
+    ocr = f", OCR {r['ocr_s']:.2f}s (Tesseract {r['tesseract_s']:.2f}s)" if r.get("ocr_s") else ""
+    print(f"⏱️ {r['kind']:>7} x {r['pages']:<5} extract {r['extract_pages_per_s']:8.1f} pages/s{ocr}")
+    print(f"   encode {r['encode_sentences_per_s']:10.1f} sentences/s ({r['encoder']}), "
+          f"search {r['search_sentences_per_s']:10.1f} sentences/s")
+    print(f"   total {r['total_pages_per_s']:8.1f} pages/s, {r['sentences']} sentences, "
+          f"{r['matches']} matched, peak RSS {r['peak_rss_mb']:.0f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pipeline benchmark suite")
+    parser.add_argument("--kinds", nargs="+", default=["digital", "scanned", "mixed"],
+                        choices=["digital", "scanned", "mixed"])
+    parser.add_argument("--pages", type=int, nargs="+", default=[10, 100])
+    parser.add_argument("--encoder", default="auto", choices=["auto", "model", "stub"])
+    parser.add_argument("--workers", type=int, default=1,
+                        help="extraction processes (OCR time is reported for 1)")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="runs per scenario; each stage reports its fastest")
+    parser.add_argument("--trace-malloc", action="store_true",
+                        help="also record tracemalloc peaks (slows every stage)")
+    parser.add_argument("--baseline", default=BASELINE_FILE)
+    parser.add_argument("--update-baseline", "--save-baseline", action="store_true",
+                        dest="update_baseline",
+                        help="write these results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="allowed relative slowdown / RSS growth")
+    parser.add_argument("--output", help="also write results as JSON here")
+    args = parser.parse_args()
+
+    from paths import TESSERACT_CMD
+    has_tesseract = bool(shutil.which(TESSERACT_CMD) or os.path.exists(TESSERACT_CMD))
+
+    results = []
+    for kind in args.kinds:
+        if kind != "digital" and not has_tesseract:
+            print(f"⚠️ Tesseract not found at {TESSERACT_CMD}; skipping {kind} PDFs")
+            continue
+        for pages in args.pages:
+            print(f"🚀 {kind} x {pages} pages")
+            result = _run_isolated(kind, pages, args.encoder, args.workers,
+                                   args.trace_malloc, args.repeat)
+            _print_result(result)
+            results.append(result)
+
+    report = {"environment": _environment(), "results": results}
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+    if args.update_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+            f.write("\n")
+        print(f"💾 Baseline written to {args.baseline}")
+        return
+    if not os.path.exists(args.baseline):
+        sys.exit(f"❌ No baseline at {args.baseline}; run with --update-baseline to create one")
+
+    with open(args.baseline, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    if baseline.get("environment") != report["environment"]:
+        print(f"⚠️ Baseline recorded on {baseline.get('environment')}, "
+              f"now {report['environment']}")
+    failures = compare(results, baseline, args.tolerance)
+    if failures:
+        for failure in failures:
+            print(f"❌ {failure}")
+        sys.exit(f"❌ {len(failures)} regression(s) beyond {args.tolerance:.0%}")
+    print(f"✅ No regressions beyond {args.tolerance:.0%} against {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
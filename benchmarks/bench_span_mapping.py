@@ -0,0 +1,111 @@
+# bench_span_mapping.py
+# Span -> sentence mapping on dense multi-column pages: the previous
+# per-sentence rescan of every span against the one-pass offset index with
+# bisection now used by pdf_service._split_block_into_sentences.
+#
+#   python benchmarks/bench_span_mapping.py [--pages 5] [--columns 3]
+#                                           [--lines 120] [--repeat 5]
+import sys, os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import argparse
+import random
+import time
+import fitz
+from services import pdf_service
+from services.pdf_service import (_extract_blocks_from_page, _merge_bboxes,
+                                  _split_block_into_sentences)
+
+WORDS = ("carbon emissions scope water energy board governance diversity "
+         "supplier audit waste recycling renewable disclosure targets climate "
+         "employees safety community investment risk report").split()
+
+
+def _legacy_map_spans_to_sentence(block_text, sentence_text, sentence_start, spans):
+    """The mapping before the offset index: rescans all spans per sentence."""
+    sentence_end = sentence_start + len(sentence_text)
+    span_positions = []
+    char_pos = 0
+    for span in spans:
+        span_start_pos = block_text.find(span["text"], char_pos)
+        if span_start_pos != -1:
+            span_positions.append((span, span_start_pos,
+                                   span_start_pos + len(span["text"])))
+            char_pos = span_start_pos + len(span["text"])
+    return [span for span, start, end in span_positions
+            if end > sentence_start and start < sentence_end]
+
+
+def _legacy_split_block_into_sentences(block):
+    block_text = block["text"]
+    result_sentences = []
+    char_offset = 0
+    for sentence in pdf_service.sent_tokenize(block_text):
+        sentence_text = sentence.strip()
+        if not sentence_text:
+            continue
+        sentence_start = block_text.find(sentence_text, char_offset)
+        if sentence_start == -1:
+            sentence_start = char_offset
+        spans = _legacy_map_spans_to_sentence(block_text, sentence_text,
+                                              sentence_start, block["spans"])
+        if spans:
+            result_sentences.append({"text": sentence_text,
+                                     "bbox": _merge_bboxes(spans)})
+        char_offset = sentence_start + len(sentence_text)
+    return result_sentences
+
+
+def make_dense_pdf(pages, columns, lines, seed=0):
+    """Pages of narrow columns with short sentences: many spans per block."""
+    rng = random.Random(seed)
+    doc = fitz.open()
+    for _ in range(pages):
+        page = doc.new_page(width=612, height=max(792, 40 + lines * 7))
+        column_width = (612 - 72) / columns
+        for c in range(columns):
+            x = 36 + c * column_width
+            for n in range(lines):
+                words = " ".join(rng.choice(WORDS) for _ in range(rng.randint(3, 6)))
+                page.insert_text((x, 40 + n * 7), words.capitalize() + ".", fontsize=6)
+    return doc
+
+
+def _time(fn, blocks, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        out = [fn(block) for block in blocks]
+        best = min(best, time.perf_counter() - start)
+    return best, out
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Span mapping micro-benchmark")
+    parser.add_argument("--pages", type=int, default=5)
+    parser.add_argument("--columns", type=int, default=3)
+    parser.add_argument("--lines", type=int, default=120)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    pdf_service._ensure_nltk_dependencies()
+    doc = make_dense_pdf(args.pages, args.columns, args.lines)
+    blocks = [block for page in doc
+              for block in _extract_blocks_from_page(page, 10.0, 20.0)]
+    spans = sum(len(b["spans"]) for b in blocks)
+    print(f"📄 {args.pages} pages, {len(blocks)} blocks, {spans} spans")
+
+    legacy_s, legacy_out = _time(_legacy_split_block_into_sentences, blocks, args.repeat)
+    indexed_s, indexed_out = _time(_split_block_into_sentences, blocks, args.repeat)
+    sentences = sum(len(out) for out in indexed_out)
+
+    print(f"⏱️ legacy rescan:  {legacy_s * 1000:8.1f} ms")
+    print(f"⏱️ offset index:   {indexed_s * 1000:8.1f} ms  "
+          f"({legacy_s / indexed_s:.1f}x, {sentences} sentences)")
+    if legacy_out != indexed_out:
+        sys.exit("❌ Sentence/bbox output differs from the legacy mapping")
+    print("✅ Identical sentences and bboxes")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+# check_encoder_accuracy.py
+# Compares an embedding backend against the fp32 baseline stored in
+# data/semantic_search_results.json: the baseline sentences are re-encoded,
+# matched against the keyword matrix, and the (sentence, keyword variant)
+# pairs are compared with the recorded ones. Also reports single-core
+# throughput of the backend and of fp32 torch.
+#
+#   python benchmarks/check_encoder_accuracy.py --backend onnx-int8
+#                                               [--min-recall 0.95]
+import sys, os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import argparse
+import json
+import time
+import numpy as np
+from paths import SAVE_PATH
+from services.sentence_batch import SentenceBatch
+from semantic_search.keyword_store import get_keyword_store
+from semantic_search.semantic_search import match_sentences
+
+BATCH_SIZE = 64
+
+
+def _pairs(results):
+    return {(r["sentence"], k["variant"]): k["similarity"]
+            for r in results for k in r["keywords"]}
+
+
+def _encode_timed(encoder, texts):
+    encoder.encode(texts[:BATCH_SIZE], batch_size=BATCH_SIZE)  # load + warm up
+    start = time.perf_counter()
+    vectors = encoder.encode(texts, batch_size=BATCH_SIZE)
+    return vectors, len(texts) / (time.perf_counter() - start)
+
+
+def _single_thread():
+    # Per-core numbers: one thread for torch, ONNX Runtime and BLAS
+    os.environ.setdefault("ONNX_INTRA_OP_THREADS", "1")
+    os.environ.setdefault("OMP_NUM_THREADS", "1")
+    try:
+        import torch
+        torch.set_num_threads(1)
+    except ImportError:
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Embedding backend accuracy check")
+    parser.add_argument("--backend", default="onnx-int8",
+                        choices=["torch", "onnx", "onnx-int8"])
+    parser.add_argument("--baseline", default=SAVE_PATH,
+                        help="fp32 search results to compare against")
+    parser.add_argument("--min-recall", type=float, default=None,
+                        help="exit non-zero when match recall is below this")
+    args = parser.parse_args()
+
+    _single_thread()
+    from create_embeddings.encoder import create_local_encoder
+
+    with open(args.baseline, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    batch = SentenceBatch.from_pages([{"page_num": r["page_num"], "sentences": [r]}
+                                      for r in baseline])
+    print(f"📊 {len(batch)} baseline sentences, "
+          f"{sum(len(r['keywords']) for r in baseline)} keyword matches")
+
+    vectors, rate = _encode_timed(create_local_encoder(args.backend), batch.texts)
+    print(f"⏱️ {args.backend}: {rate:.1f} sentences/s on one core")
+    if args.backend != "torch":
+        reference, reference_rate = _encode_timed(create_local_encoder("torch"),
+                                                  batch.texts)
+        cosine = np.sum(vectors * reference, axis=1)
+        print(f"⏱️ torch fp32: {reference_rate:.1f} sentences/s on one core "
+              f"({rate / reference_rate:.2f}x speed-up)")
+        print(f"📐 Cosine to fp32 embeddings: mean {cosine.mean():.4f}, "
+              f"min {cosine.min():.4f}")
+
+    results = match_sentences(batch.with_embeddings(vectors, normalized=True),
+                              get_keyword_store())
+    expected, found = _pairs(baseline), _pairs(results)
+    common = expected.keys() & found.keys()
+    recall = len(common) / max(len(expected), 1)
+    precision = len(common) / max(len(found), 1)
+    drift = np.abs([expected[p] - found[p] for p in common]) if common else np.zeros(1)
+    lost = {s for s, _ in expected} - {s for s, _ in found}
+
+    print(f"🎯 Match recall {recall:.4f}, precision {precision:.4f} "
+          f"({len(expected) - len(common)} missing, {len(found) - len(common)} extra)")
+    print(f"📐 Similarity drift on shared matches: mean {drift.mean():.4f}, "
+          f"max {drift.max():.4f}")
+    print(f"⚠️ Sentences that lost every match: {len(lost)}")
+
+    if args.min_recall is not None and recall < args.min_recall:
+        sys.exit(f"❌ Recall {recall:.4f} below {args.min_recall}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+# check_prefilter_recall.py
+# Measures what the pre-encoding prefilter (semantic_search/prefilter.py)
+# costs in recall and saves in encoder work. With sample reports, every
+# extracted sentence is encoded and matched (the full pipeline); recall is
+# the share of those matches whose sentence survives the filter. Without
+# PDFs, the matched sentences in data/semantic_search_results.json are used
+# (recall only, as unmatched sentences are not recorded there).
+#
+#   python benchmarks/check_prefilter_recall.py --pdf reports/*.pdf
+#                                               [--stem-chars 4 5 6]
+#                                               [--min-hits 1 2]
+#                                               [--min-recall 0.99]
+import sys, os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import argparse
+import json
+import time
+from paths import SAVE_PATH
+from services.sentence_batch import SentenceBatch
+from semantic_search.keyword_store import get_keyword_store
+from semantic_search.prefilter import MIN_HITS, STEM_CHARS, Prefilter
+from semantic_search.semantic_search import match_sentences
+
+
+def _full_pipeline_matches(pdf_paths, keyword_store):
+    """(texts, [(sentence index, variant)]) over every sample report."""
+    from services.pdf_service import extract_pdf_sentences_with_ocr_fallback
+    from create_embeddings.encoder import get_encoder
+
+    texts, pairs = [], []
+    for path in pdf_paths:
+        with open(path, "rb") as f:
+            pages = extract_pdf_sentences_with_ocr_fallback(f.read())
+        batch = SentenceBatch.from_pages(pages)
+        batch = batch.select(batch.nonempty_mask())
+        start = time.perf_counter()
+        batch = batch.with_embeddings(get_encoder().encode(batch.texts),
+                                      normalized=True)
+        encode_s = time.perf_counter() - start
+        # Results carry text and page, not the row: map them back
+        row_of = {(t, p): len(texts) + i
+                  for i, (t, p) in enumerate(zip(batch.texts, batch.page_nums.tolist()))}
+        for r in match_sentences(batch.select(batch.valid_mask()), keyword_store):
+            pairs.extend((row_of[(r["sentence"], r["page_num"])], k["variant"])
+                         for k in r["keywords"])
+        texts.extend(batch.texts)
+        print(f"📄 {os.path.basename(path)}: {len(batch)} sentences, "
+              f"encoded in {encode_s:.1f}s")
+    return texts, pairs
+
+
+def _baseline_matches(baseline_path):
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    texts = [r["sentence"] for r in baseline]
+    pairs = [(i, k["variant"]) for i, r in enumerate(baseline) for k in r["keywords"]]
+    return texts, pairs
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prefilter recall check")
+    parser.add_argument("--pdf", nargs="*", default=[],
+                        help="sample reports to run the full pipeline on")
+    parser.add_argument("--baseline", default=SAVE_PATH,
+                        help="search results to use when no PDFs are given")
+    parser.add_argument("--stem-chars", type=int, nargs="+", default=[STEM_CHARS])
+    parser.add_argument("--min-hits", type=int, nargs="+", default=[MIN_HITS])
+    parser.add_argument("--min-recall", type=float, default=None,
+                        help="exit non-zero when match recall of the default "
+                             "settings is below this")
+    args = parser.parse_args()
+
+    keyword_store = get_keyword_store()
+    if args.pdf:
+        texts, pairs = _full_pipeline_matches(args.pdf, keyword_store)
+    else:
+        texts, pairs = _baseline_matches(args.baseline)
+    matched_rows = {row for row, _ in pairs}
+    print(f"📊 {len(texts)} sentences, {len(matched_rows)} matched, "
+          f"{len(pairs)} keyword matches")
+
+    default_recall = None
+    for stem_chars in args.stem_chars:
+        for min_hits in args.min_hits:
+            prefilter = Prefilter(keyword_store.variants, stem_chars=stem_chars,
+                                  min_hits=min_hits)
+            start = time.perf_counter()
+            keep = prefilter.candidate_mask(texts)
+            filter_ms = (time.perf_counter() - start) * 1000
+            recall = sum(keep[row] for row, _ in pairs) / max(len(pairs), 1)
+            sentence_recall = sum(keep[row] for row in matched_rows) / max(len(matched_rows), 1)
+            skipped = 1 - keep.mean() if len(texts) else 0.0
+            print(f"🧹 {prefilter.settings()}: match recall {recall:.4f}, "
+                  f"sentence recall {sentence_recall:.4f}, "
+                  f"skipped {skipped:.1%}{'' if args.pdf else ' (matched only)'}, "
+                  f"{filter_ms:.1f} ms")
+            if stem_chars == STEM_CHARS and min_hits == MIN_HITS:
+                default_recall = recall
+
+    if (args.min_recall is not None and default_recall is not None
+            and default_recall < args.min_recall):
+        sys.exit(f"❌ Recall {default_recall:.4f} below {args.min_recall}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+import os
+import numpy as np
+
+# ------------------ CONFIG ------------------
+# Padded tokens per model call (batch size x longest sequence in the batch).
+# Bounds activation memory regardless of how sentence lengths are mixed.
+TOKEN_BUDGET = int(os.environ.get("ENCODE_TOKEN_BUDGET", 16384))
+
+
+def plan_token_batches(lengths, token_budget=TOKEN_BUDGET, max_batch_size=None):
+    """
+    Group texts into batches by token budget instead of count.
+    lengths: token count per text. Texts are sorted by length, so each batch
+    holds similar lengths and pads little; a batch grows while
+    rows x longest row stays within token_budget (a single over-budget text
+    still gets its own batch).
+    Returns a list of index arrays into the original order.
+    """
+    lengths = np.asarray(lengths, dtype=np.int64)
+    order = np.argsort(lengths, kind="stable")
+    batches = []
+    start = 0
+    while start < order.size:
+        stop = start + 1
+        # Sorted ascending: the last row of a batch is its longest
+        while (stop < order.size
+               and (stop - start + 1) * lengths[order[stop]] <= token_budget
+               and (max_batch_size is None or stop - start < max_batch_size)):
+            stop += 1
+        batches.append(order[start:stop])
+        start = stop
+    return batches
+
+
+def padding_efficiency(lengths, batches):
+    """Real tokens / padded tokens over a batch plan (1.0 = no padding)."""
+    lengths = np.asarray(lengths, dtype=np.int64)
+    real = int(lengths.sum())
+    padded = sum(len(b) * int(lengths[b].max()) for b in batches if len(b))
+    return real / padded if padded else 1.0
+
+
+def encode_in_token_batches(encode_rows, lengths, dim,
+                            token_budget=TOKEN_BUDGET, max_batch_size=None):
+    """
+    Run encode_rows(index_array) -> (len(index_array), dim) over a
+    token-budget plan and scatter the rows back into the original order.
+    """
+    vectors = np.zeros((len(lengths), dim), dtype=np.float32)
+    batches = plan_token_batches(lengths, token_budget, max_batch_size)
+    for rows in batches:
+        vectors[rows] = encode_rows(rows)
+    if len(batches) > 1:
+        print(f"📐 {len(lengths)} texts in {len(batches)} token-budget batches, "
+              f"padding efficiency {padding_efficiency(lengths, batches):.0%}")
+    return vectors
@@ -1,66 +1,77 @@
 # create_embeddings_keywords.py
-import json
-import os
-from sentence_transformers import SentenceTransformer
-from paths import KEYWORDS_FILE, OUTPUT_FILE
+import sys, os
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+import time
+import numpy as np
+from paths import KEYWORDS_FILE
+from create_embeddings.encoder import current_model_id, get_encoder
+from semantic_search.keyword_store import (EMBEDDING_DIM, MATRIX_FILE,
+                                           keywords_fingerprint,
+                                           read_keyword_store,
+                                           read_keyword_variants,
+                                           write_keyword_store)
 
 # ------------------ CONFIG ------------------
 keywords_file = KEYWORDS_FILE
-output_file = OUTPUT_FILE
+output_file = MATRIX_FILE
 BATCH_SIZE = 1000  # adjust if needed
-DEVICE = "cpu"     # use "cuda" if GPU is available
 
-# ------------------ LOAD MODEL ------------------
-model = SentenceTransformer("all-MiniLM-L6-v2", device=DEVICE)
 
 def process_batch(batch):
-    """Process a batch of keyword variants and return embeddings in same format"""
-    vectors = model.encode(
-        batch,
-        convert_to_numpy=True,
-        normalize_embeddings=True,
-        show_progress_bar=False
-    ).tolist()
-    return vectors
+    """Process a batch of keyword variants and return float32 embeddings"""
+    # Shared with sentence encoding (in-process model or encoder server)
+    return get_encoder().encode(batch)
+
+
+def _reusable_vectors():
+    """variant -> unit vector from the current store, if built by this model."""
+    store = read_keyword_store()
+    if store is None or store.model != current_model_id():
+        return {}
+    return {variant: store.matrix[i] for i, variant in enumerate(store.variants)}
 
-def create_keyword_embeddings():
-    # Load keywords
-    with open(keywords_file, "r", encoding="utf-8") as f:
-        keywords_data = json.load(f)
 
-    
-    all_variants = []
-    variant_mapping = {} 
-    for kw in keywords_data["keywords"]:
-        for variant in kw["variants"]:
-            all_variants.append(variant)
-            variant_mapping[variant] = kw["term"]
+def create_keyword_embeddings(keywords_file=keywords_file, incremental=True):
+    """
+    Build the keyword store for keywords_file. With incremental, variants
+    whose text is already in the current store keep their vector; only
+    added or edited variants are encoded, and removed ones are dropped.
+    """
+    start = time.perf_counter()
+    fingerprint = keywords_fingerprint(keywords_file)
+    terms, all_variants = read_keyword_variants(keywords_file)
 
-   
-    batches = [all_variants[i:i+BATCH_SIZE] for i in range(0, len(all_variants), BATCH_SIZE)]
-    all_embeddings = []
+    # Rows that are not reused and whose batch fails stay zero and are
+    # dropped by the store
+    all_embeddings = np.zeros((len(all_variants), EMBEDDING_DIM), dtype=np.float32)
+    previous = _reusable_vectors() if incremental else {}
+    missing = []
+    for i, variant in enumerate(all_variants):
+        if variant in previous:
+            all_embeddings[i] = previous[variant]
+        else:
+            missing.append(i)
+    removed = len(set(previous) - set(all_variants))
 
-    for i, batch in enumerate(batches):
+    batches = [missing[i:i+BATCH_SIZE] for i in range(0, len(missing), BATCH_SIZE)]
+    for i, rows in enumerate(batches):
         try:
-            vectors = process_batch(batch)
-            for variant, vec in zip(batch, vectors):
-                all_embeddings.append({
-                    "term": variant_mapping[variant],
-                    "variant": variant,
-                    "embedding": vec
-                })
+            all_embeddings[rows] = process_batch([all_variants[r] for r in rows])
             print(f"Processed batch {i+1}/{len(batches)}")
         except Exception as e:
             print(f"Error in batch {i+1}: {e}")
             break
 
-    
-    os.makedirs(os.path.dirname(output_file), exist_ok=True)
-    with open(output_file, "w", encoding="utf-8") as f:
-        json.dump(all_embeddings, f, ensure_ascii=False, indent=2)
+    saved = write_keyword_store(terms, all_variants, all_embeddings, fingerprint,
+                                model=current_model_id())
 
-    print(f"✅ Saved {len(all_embeddings)} keyword embeddings to {output_file}")
-    return all_embeddings
+    print(f"🔄 Keyword store: {len(all_variants) - len(missing)} reused, "
+          f"{len(missing)} encoded, {removed} removed "
+          f"({(time.perf_counter() - start) * 1000:.0f} ms)")
+    print(f"✅ Saved {saved} keyword embeddings to {output_file}")
+    return saved
 
 
-create_keyword_embeddings()
+if __name__ == "__main__":
+    create_keyword_embeddings(incremental="--full" not in sys.argv[1:])
@@ -4,132 +4,235 @@ sys.path.append(os.path.dirname(os.path.dirname(__file__)))
 from paths import SAVE_PATH_SENTENCES
 
 
-import json
 import os
 import numpy as np
-from sentence_transformers import SentenceTransformer
+from create_embeddings.encoder import (EMBEDDING_DIM, EncoderSwitched,
+                                      current_model_id, get_encoder)
+from create_embeddings.embedding_cache import encode_with_cache
+from services import metrics
+from services.persistence import persist_async, save_sentence_artifact, write_json
+from services.sentence_batch import SentenceBatch
 # from paths import SAVE_PATH_SENTENCES
 
-# ------------------ LOAD MODEL ------------------
-model = SentenceTransformer("all-MiniLM-L6-v2", device="cpu")
+# ------------------ CONFIG ------------------
+# The model id / EMBEDDING_DIM come from create_embeddings.encoder;
+# the model itself is loaded on first use, or shared through the encoder
+# server. ENCODER_BACKEND there selects torch, onnx or onnx-int8.
+# Sentences buffered before an encode call in the streaming pipeline
+MICRO_BATCH_SIZE = 64
+# Full embeddings go to a binary .npz next to SAVE_PATH_SENTENCES; the
+# (much larger) JSON dump is only written when explicitly requested.
+EXPORT_JSON = os.environ.get("EXPORT_EMBEDDINGS_JSON", "0") == "1"
 
-def create_embeddings(sentences_data, save_path=SAVE_PATH_SENTENCES):
-    """
-    sentences_data: List of pages with sentences (output from pdf_service.extract_to_json)
-    Returns: List of embeddings with metadata and saves to JSON.
-    Handles empty texts, missing bboxes, or empty pages gracefully.
-    """
-    # Pre-allocate and extract all data in one pass
+
+def _collect_sentences(sentences_data):
+    """Flatten pages into legacy sentence records (original bbox lists kept)."""
     all_sentences = []
-    valid_indices = []
-    valid_texts = []
-    
     for page in sentences_data or []:
         for sentence in page.get("sentences", []) or []:
             text = sentence.get("text", "")
             if not isinstance(text, str):
                 text = str(text) if text is not None else ""
-            
-            sentence_data = {
+
+            all_sentences.append({
                 "page_num": page.get("page_num", -1),
                 "text": text,
                 "bbox": sentence.get("bbox", [])
-            }
-            all_sentences.append(sentence_data)
-            
-            # Only add non-empty texts for embedding
-            if text.strip():
-                valid_indices.append(len(all_sentences) - 1)
-                valid_texts.append(text)
-
-    if not all_sentences:
-        print("⚠️ No sentences found in input data.")
-        os.makedirs(os.path.dirname(save_path), exist_ok=True)
-        with open(save_path, "w", encoding="utf-8") as f:
-            json.dump([], f, ensure_ascii=False, indent=2)
-        return []
-
-    print(f"📊 Processing {len(all_sentences)} sentences ({len(valid_texts)} non-empty)")
-    os.makedirs(os.path.dirname(save_path), exist_ok=True)
-
-    # Initialize all embeddings with zeros
-    embedding_dim = 384
-    all_embeddings_data = []
-    
-    for sentence in all_sentences:
-        all_embeddings_data.append({
-            "page_num": sentence["page_num"],
-            "text": sentence["text"],
-            "bbox": sentence["bbox"],
-            "embedding": [0.0] * embedding_dim
-        })
-
-    # Process all valid texts at once if we have any
-    if valid_texts:
-        try:
-            print("🔄 Encoding all valid texts at once...")
-            
-            # Encode all at once with optimized settings
-            vectors = model.encode(
-                valid_texts,
-                convert_to_numpy=True,
-                normalize_embeddings=True,
-                show_progress_bar=True,
-                batch_size=512,  # Larger batch size for better efficiency
-                convert_to_tensor=False
-            )
-            
-            # Ensure correct shape
-            if len(vectors.shape) == 1:
-                vectors = vectors.reshape(1, -1)
-            
-            # Assign embeddings to valid indices
-            for i, sentence_idx in enumerate(valid_indices):
-                all_embeddings_data[sentence_idx]["embedding"] = vectors[i].tolist()
-                
-            print(f"✅ Successfully encoded {len(valid_texts)} sentences")
-            
-        except Exception as e:
-            print(f"⚠️ Error during encoding: {e}")
-            print("Falling back to batch processing...")
-            
-            # Fallback to batch processing if single encoding fails
-            BATCH_SIZE = 1000  # Larger batches for fallback
-            
-            for i in range(0, len(valid_texts), BATCH_SIZE):
-                batch_texts = valid_texts[i:i + BATCH_SIZE]
-                batch_indices = valid_indices[i:i + BATCH_SIZE]
-                
-                try:
-                    print(f"🔄 Processing fallback batch {i//BATCH_SIZE + 1}/{(len(valid_texts) + BATCH_SIZE - 1)//BATCH_SIZE}")
-                    
-                    batch_vectors = model.encode(
-                        batch_texts,
-                        convert_to_numpy=True,
-                        normalize_embeddings=True,
-                        show_progress_bar=False,
-                        batch_size=256
-                    )
-                    
-                    if len(batch_vectors.shape) == 1:
-                        batch_vectors = batch_vectors.reshape(1, -1)
-                    
-                    for j, sentence_idx in enumerate(batch_indices):
-                        all_embeddings_data[sentence_idx]["embedding"] = batch_vectors[j].tolist()
-                        
-                except Exception as batch_e:
-                    print(f"⚠️ Error in fallback batch {i//BATCH_SIZE + 1}: {batch_e}")
-                    # Keep zero embeddings for failed batches
-                    continue
+            })
+    return all_sentences
 
-    # Save results
+
+def _encode_uncached(valid_texts, show_progress_bar=True):
+    """
+    Encode texts into normalized float32 vectors (one row per text).
+    Rows of batches that fail even in the fallback path stay zero.
+    """
+    vectors = np.zeros((len(valid_texts), EMBEDDING_DIM), dtype=np.float32)
+    if not valid_texts:
+        return vectors
+    with metrics.span("encode"):
+        _encode_into(vectors, valid_texts, show_progress_bar)
+    metrics.inc("sentences_encoded_total", len(valid_texts))
+    return vectors
+
+
+def _encode_into(vectors, valid_texts, show_progress_bar):
+    """Fill vectors in place; one encode call, batch fallback on failure."""
+    # One encoder throughout: the caller keyed the cache on its model id
+    encoder = get_encoder()
     try:
-        with open(save_path, "w", encoding="utf-8") as f:
-            json.dump(all_embeddings_data, f, ensure_ascii=False, indent=2)
-        print(f"💾 Results saved to: {save_path}")
+        # Encode all at once; the encoder sorts by length and batches by
+        # token budget (ENCODE_TOKEN_BUDGET), capped at batch_size texts
+        encoded = encoder.encode(
+            valid_texts,
+            show_progress_bar=show_progress_bar,
+            batch_size=512
+        )
+        vectors[:] = encoded.reshape(len(valid_texts), -1)
+
+    except EncoderSwitched:
+        # Batch fallback would keep calling the replaced encoder
+        raise
     except Exception as e:
-        print(f"⚠️ Error saving file: {e}")
+        print(f"⚠️ Error during encoding: {e}")
+        print("Falling back to batch processing...")
+
+        # Fallback to batch processing if single encoding fails
+        BATCH_SIZE = 1000  # Larger batches for fallback
+
+        for i in range(0, len(valid_texts), BATCH_SIZE):
+            batch_texts = valid_texts[i:i + BATCH_SIZE]
+
+            try:
+                print(f"🔄 Processing fallback batch {i//BATCH_SIZE + 1}/{(len(valid_texts) + BATCH_SIZE - 1)//BATCH_SIZE}")
+
+                batch_vectors = encoder.encode(batch_texts, batch_size=256)
+                vectors[i:i + len(batch_texts)] = batch_vectors.reshape(len(batch_texts), -1)
+
+            except Exception as batch_e:
+                print(f"⚠️ Error in fallback batch {i//BATCH_SIZE + 1}: {batch_e}")
+                # Keep zero embeddings for failed batches
+                continue
+
+
+def _encode_texts(valid_texts, show_progress_bar=True):
+    """
+    Encode texts, running the model only for embedding-cache misses. When
+    the encoder is switched midway, the lookup starts over under the new
+    encoder's model id.
+    """
+    def encode_fn(texts):
+        return _encode_uncached(texts, show_progress_bar=show_progress_bar)
+
+    try:
+        return encode_with_cache(valid_texts, current_model_id(), encode_fn,
+                                 EMBEDDING_DIM)
+    except EncoderSwitched as e:
+        print(f"⚠️ {e}; re-encoding {len(valid_texts)} texts")
+        return encode_with_cache(valid_texts, current_model_id(), encode_fn,
+                                 EMBEDDING_DIM)
+
+
+def _embed_matrix(texts, valid_indices, show_progress_bar=True):
+    """N x EMBEDDING_DIM float32 matrix, zero rows for empty texts."""
+    vectors = np.zeros((len(texts), EMBEDDING_DIM), dtype=np.float32)
+    if len(valid_indices):
+        vectors[valid_indices] = _encode_texts(
+            [texts[i] for i in valid_indices],
+            show_progress_bar=show_progress_bar)
+    return vectors
+
+
+def encode_texts(texts):
+    """Unit-norm float32 rows for a list of non-empty texts."""
+    return _encode_texts(list(texts), show_progress_bar=False)
+
+
+def encode_query(text):
+    """Unit-norm float32 vector for a single free-text query."""
+    return _encode_texts([text], show_progress_bar=False)[0]
+
+
+def _records_from_matrix(all_sentences, vectors):
+    """Legacy dict format: attach an "embedding" list to every sentence record."""
+    return [{
+        "page_num": sentence["page_num"],
+        "text": sentence["text"],
+        "bbox": sentence["bbox"],
+        "embedding": vector
+    } for sentence, vector in zip(all_sentences, vectors.tolist())]
+
+
+def artifact_path(save_path):
+    return os.path.splitext(save_path)[0] + ".npz"
+
+
+def _persist_embeddings(batch, save_path, export_json):
+    """Queue the binary artifact (and optional JSON export) for writing."""
+    persist_async(save_sentence_artifact, artifact_path(save_path),
+                  batch.texts, batch.page_nums, batch.bboxes, batch.embeddings)
+    print(f"💾 Saving results to: {artifact_path(save_path)}")
+    if export_json:
+        persist_async(write_json, save_path, batch.to_records(), indent=2)
+        print(f"💾 Exporting JSON to: {save_path}")
+
+
+def create_embeddings(sentences_data, save_path=SAVE_PATH_SENTENCES,
+                      export_json=None, persist=True):
+    """
+    sentences_data: SentenceBatch, or list of pages with sentences (output
+    from pdf_service.extract_pdf_sentences_with_ocr_fallback)
+    Returns: SentenceBatch with embeddings for SentenceBatch input, otherwise
+    the legacy list of embedding dicts. Unless persist is False, saves a
+    binary .npz artifact (and the JSON dump when export_json /
+    EXPORT_EMBEDDINGS_JSON is set) in the background.
+    Handles empty texts, missing bboxes, or empty pages gracefully.
+    """
+    if export_json is None:
+        export_json = EXPORT_JSON
+    as_batch = isinstance(sentences_data, SentenceBatch)
+    batch = sentences_data if as_batch else SentenceBatch.from_pages(sentences_data)
+
+    if not len(batch):
+        print("⚠️ No sentences found in input data.")
+        if persist:
+            _persist_embeddings(
+                batch.with_embeddings(np.zeros((0, EMBEDDING_DIM), dtype=np.float32)),
+                save_path, export_json)
+        return batch if as_batch else []
+
+    valid_indices = np.flatnonzero(batch.nonempty_mask())
+    print(f"📊 Processing {len(batch)} sentences ({len(valid_indices)} non-empty)")
+
+    if len(valid_indices):
+        print("🔄 Encoding all valid texts at once...")
+    # The model normalizes its output, so rows are unit-norm (or zero)
+    batch = batch.with_embeddings(_embed_matrix(batch.texts, valid_indices),
+                                  normalized=True)
+    if len(valid_indices):
+        print(f"✅ Successfully encoded {len(valid_indices)} sentences")
+
+    # Save results
+    if persist:
+        _persist_embeddings(batch, save_path, export_json)
 
     print("✅ All sentence embeddings complete!")
-    print(f"📊 Total embeddings created: {len(all_embeddings_data)}")
-    return all_embeddings_data
\ No newline at end of file
+    print(f"📊 Total embeddings created: {len(batch)}")
+    if as_batch:
+        return batch
+    all_sentences = _collect_sentences(sentences_data)
+    return _records_from_matrix(all_sentences, batch.embeddings)
+
+
+def iter_embeddings(pages, micro_batch_size=MICRO_BATCH_SIZE):
+    """
+    Streaming variant of create_embeddings.
+    pages: iterable of {"page_num", "sentences"} (e.g. pdf_service.iter_pdf_pages)
+    Buffers pages until micro_batch_size sentences are pending, encodes them in
+    one call, then yields (page_num, SentenceBatch with embeddings) per page in
+    order. Nothing is written to disk.
+    """
+    pending = []
+    pending_count = 0
+
+    def _flush():
+        batch = SentenceBatch.from_pages(pending)
+        batch = batch.with_embeddings(_embed_matrix(
+            batch.texts, np.flatnonzero(batch.nonempty_mask()),
+            show_progress_bar=False), normalized=True)
+        offset = 0
+        for page in pending:
+            count = len(page.get("sentences", []) or [])
+            yield page.get("page_num", -1), batch.select(np.arange(offset, offset + count))
+            offset += count
+
+    for page in pages:
+        pending.append(page)
+        pending_count += len(page.get("sentences", []) or [])
+        if pending_count >= micro_batch_size:
+            yield from _flush()
+            pending = []
+            pending_count = 0
+
+    if pending:
+        yield from _flush()
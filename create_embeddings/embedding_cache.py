@@ -0,0 +1,84 @@
+import hashlib
+import os
+import numpy as np
+from paths import SAVE_PATH_SENTENCES
+from services import metrics
+from services.sqlite_cache import SQLiteCache
+
+# ------------------ CONFIG ------------------
+CACHE_FILE = os.path.join(os.path.dirname(SAVE_PATH_SENTENCES), "cache",
+                          "sentence_embeddings.sqlite")
+CACHE_MAX_BYTES = int(os.environ.get("EMBEDDING_CACHE_MAX_BYTES",
+                                     512 * 1024 * 1024))
+CACHE_ENABLED = os.environ.get("EMBEDDING_CACHE", "1") != "0"
+
+_cache = None
+
+
+def get_embedding_cache():
+    """Process-wide cache, or None when disabled."""
+    global _cache
+    if not CACHE_ENABLED:
+        return None
+    if _cache is None:
+        _cache = SQLiteCache(CACHE_FILE, CACHE_MAX_BYTES)
+    return _cache
+
+
+def normalize_text(text):
+    """Collapse whitespace; the tokenizer ignores it, so vectors are identical."""
+    return " ".join(text.split())
+
+
+def cache_key(text, model_name):
+    payload = f"{model_name}\0{normalize_text(text)}".encode("utf-8")
+    return hashlib.sha256(payload).hexdigest()
+
+
+def encode_with_cache(texts, model_name, encode_fn, dim):
+    """
+    Return float32 vectors for texts, calling encode_fn only for texts whose
+    (model, normalized text) key is not cached. Duplicate texts are encoded
+    once. Zero rows (failed encodes) are never written to the cache.
+    """
+    vectors = np.zeros((len(texts), dim), dtype=np.float32)
+    if not texts:
+        return vectors
+
+    cache = get_embedding_cache()
+    keys = [cache_key(t, model_name) for t in texts]
+    try:
+        cached = cache.get_many(keys) if cache is not None else {}
+    except Exception as e:
+        print(f"⚠️ Embedding cache unavailable: {e}")
+        cache, cached = None, {}
+
+    # First occurrence of every missing key gets encoded
+    miss_rows = {}
+    for i, key in enumerate(keys):
+        if key in cached:
+            vectors[i] = np.frombuffer(cached[key], dtype=np.float32)
+        elif key not in miss_rows:
+            miss_rows[key] = i
+
+    if miss_rows:
+        miss_keys = list(miss_rows)
+        encoded = encode_fn([texts[miss_rows[k]] for k in miss_keys])
+        row_of = {key: j for j, key in enumerate(miss_keys)}
+        for i, key in enumerate(keys):
+            if key in row_of:
+                vectors[i] = encoded[row_of[key]]
+        if cache is not None:
+            fresh = {key: np.ascontiguousarray(encoded[j], dtype=np.float32).tobytes()
+                     for key, j in row_of.items() if np.any(encoded[j])}
+            try:
+                cache.put_many(fresh)
+            except Exception as e:
+                print(f"⚠️ Could not write embedding cache: {e}")
+
+    hits = sum(1 for key in keys if key in cached)
+    if cache is not None:
+        metrics.inc("cache_hits_total", hits, cache="embedding")
+        metrics.inc("cache_misses_total", len(miss_rows), cache="embedding")
+    print(f"🗄️ Embedding cache: {hits} hits, {len(miss_rows)} texts encoded")
+    return vectors
@@ -0,0 +1,237 @@
+import os
+import tempfile
+import threading
+import numpy as np
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client
+from create_embeddings.batching import encode_in_token_batches
+
+# ------------------ CONFIG ------------------
+MODEL_NAME = "all-MiniLM-L6-v2"
+EMBEDDING_DIM = 384
+DEVICE = "cpu"
+# Inference backend: "torch" (sentence-transformers, fp32), "onnx" (ONNX
+# Runtime, fp32) or "onnx-int8" (ONNX Runtime, dynamically quantized)
+ENCODER_BACKEND = os.environ.get("ENCODER_BACKEND", "torch")
+
+
+def model_id_for(backend):
+    """Identifies the vectors a backend produces; used in cache keys so
+    results from different backends never mix."""
+    return MODEL_NAME if backend == "torch" else f"{MODEL_NAME}:{backend}"
+
+
+# Id of this process's own backend. Vectors may come from the encoder
+# server instead: cache keys use current_model_id().
+MODEL_ID = model_id_for(ENCODER_BACKEND)
+# Unix socket of the shared encoder server (create_embeddings/encoder_server.py)
+ENCODER_SOCKET = os.environ.get(
+    "ENCODER_SOCKET", os.path.join(tempfile.gettempdir(), "docintel-encoder.sock"))
+ENCODER_AUTHKEY = os.environ.get("ENCODER_AUTHKEY", "docintel-encoder").encode("utf-8")
+# "auto": use the encoder server when its socket exists, else load the model
+# in-process; "remote": always use the server; "local": never use it
+ENCODER_MODE = os.environ.get("ENCODER_MODE", "auto")
+
+
+class LocalEncoder:
+    """SentenceTransformer loaded in this process on first use."""
+
+    def __init__(self, model_name=MODEL_NAME, device=DEVICE):
+        self.model_name = model_name
+        self.model_id = model_id_for("torch")
+        self.device = device
+        self._model = None
+        self._lock = threading.Lock()
+
+    @property
+    def model(self):
+        with self._lock:
+            if self._model is None:
+                from sentence_transformers import SentenceTransformer
+                print(f"🧠 Loading {self.model_name} on {self.device}")
+                self._model = SentenceTransformer(self.model_name, device=self.device)
+        return self._model
+
+    def is_loaded(self):
+        return self._model is not None
+
+    def token_lengths(self, texts):
+        model = self.model
+        input_ids = model.tokenizer(list(texts), truncation=True,
+                                    max_length=model.max_seq_length)["input_ids"]
+        return [len(ids) for ids in input_ids]
+
+    def encode(self, texts, batch_size=256, show_progress_bar=False):
+        """
+        Unit-norm float32 embeddings, one row per text. Texts are grouped
+        into length-sorted, token-budgeted batches of at most batch_size;
+        show_progress_bar is accepted for interface compatibility.
+        """
+        if not texts:
+            return np.zeros((0, EMBEDDING_DIM), dtype=np.float32)
+        texts = list(texts)
+        model = self.model
+
+        def encode_rows(rows):
+            return model.encode(
+                [texts[i] for i in rows.tolist()],
+                convert_to_numpy=True,
+                normalize_embeddings=True,
+                show_progress_bar=False,
+                batch_size=len(rows)
+            )
+
+        return encode_in_token_batches(encode_rows, self.token_lengths(texts),
+                                       EMBEDDING_DIM, max_batch_size=batch_size)
+
+
+class EncoderClient:
+    """
+    Client of the shared encoder server. Each thread keeps its own
+    connection so concurrent requests can be batched together server-side.
+    model_id is the server's (learned in ping()). When the server goes away,
+    the client reconnects once, then hands over to an in-process encoder
+    (unless ENCODER_MODE is "remote").
+    """
+
+    def __init__(self, address=ENCODER_SOCKET, authkey=ENCODER_AUTHKEY):
+        self.address = address
+        self.authkey = authkey
+        self.model_name = MODEL_NAME
+        self.model_id = None
+        self._replaced = False
+        self._local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = Client(self.address, family="AF_UNIX", authkey=self.authkey)
+            self._local.conn = conn
+        return conn
+
+    def encode(self, texts, batch_size=None, show_progress_bar=False):
+        """Same contract as LocalEncoder.encode; batching is up to the server."""
+        if not texts:
+            return np.zeros((0, EMBEDDING_DIM), dtype=np.float32)
+        if self._replaced:
+            raise EncoderSwitched("Encoder server unavailable; use get_encoder()")
+        try:
+            return self._request(texts)
+        except (OSError, EOFError, AuthenticationError):
+            pass
+        try:
+            # The server may have restarted: reconnect once
+            return self._request(texts)
+        except (OSError, EOFError, AuthenticationError) as e:
+            if ENCODER_MODE == "remote":
+                raise
+            local = _replace_encoder(self, e)
+        if local.model_id != self.model_id:
+            # These texts were looked up in the caches under the server's
+            # model id; the caller retries with the new encoder
+            raise EncoderSwitched(f"Encoder server unavailable; switched to {local.model_id}")
+        return local.encode(texts, show_progress_bar=show_progress_bar)
+
+    def _request(self, texts):
+        try:
+            conn = self._connection()
+            conn.send(("encode", list(texts)))
+            status, payload = conn.recv()
+        except (OSError, EOFError, AuthenticationError):
+            # Drop the broken connection; the next call reconnects
+            self._local.conn = None
+            raise
+        if status != "ok":
+            raise RuntimeError(f"Encoder server error: {payload}")
+        return payload
+
+    def is_loaded(self):
+        # The server loads its model before it accepts connections
+        return True
+
+    def ping(self):
+        """Check the server and learn which model's vectors it returns."""
+        conn = self._connection()
+        conn.send(("ping", None))
+        status, info = conn.recv()
+        if status != "ok":
+            raise RuntimeError(f"Encoder server error: {info}")
+        # Servers that predate the handshake send no info
+        self.model_id = (info or {}).get("model_id", MODEL_ID)
+        return True
+
+
+class EncoderSwitched(RuntimeError):
+    """
+    The encoder server went away and get_encoder() now returns an encoder
+    with another model id: vectors (and cache keys) from before the switch
+    must not be mixed with new ones, so the caller starts over.
+    """
+
+
+_encoder = None
+_encoder_lock = threading.Lock()
+
+
+def get_encoder():
+    """
+    Process-wide encoder: a client of the shared encoder server when one
+    is running (see ENCODER_MODE), otherwise an in-process model.
+    """
+    global _encoder
+    with _encoder_lock:
+        if _encoder is None:
+            _encoder = _connect_server() or create_local_encoder()
+        return _encoder
+
+
+def current_model_id():
+    """Model id of the vectors get_encoder() returns (the server's when remote)."""
+    return getattr(get_encoder(), "model_id", None) or MODEL_ID
+
+
+def _replace_encoder(client, error):
+    """Swap a failed server client for an in-process encoder."""
+    global _encoder
+    with _encoder_lock:
+        client._replaced = True
+        if _encoder is client or _encoder is None:
+            print(f"⚠️ Encoder server at {client.address} unavailable ({error}); "
+                  f"loading model in-process")
+            _encoder = create_local_encoder()
+        return _encoder
+
+
+def create_local_encoder(backend=None):
+    """In-process encoder for the configured (or given) backend."""
+    backend = backend or ENCODER_BACKEND
+    if backend == "torch":
+        return LocalEncoder()
+    if backend in ("onnx", "onnx-int8"):
+        from create_embeddings.onnx_backend import OnnxEncoder
+        encoder = OnnxEncoder(MODEL_NAME, EMBEDDING_DIM, quantized=backend == "onnx-int8")
+        encoder.model_id = model_id_for(backend)
+        return encoder
+    raise ValueError(f"Unknown ENCODER_BACKEND: {backend}")
+
+
+def encoder_loaded():
+    """True once this process can encode without loading a model first."""
+    return _encoder is not None and _encoder.is_loaded()
+
+
+def _connect_server():
+    if ENCODER_MODE == "local":
+        return None
+    if ENCODER_MODE == "auto" and not os.path.exists(ENCODER_SOCKET):
+        return None
+    client = EncoderClient()
+    try:
+        client.ping()
+    except (OSError, EOFError, AuthenticationError) as e:
+        if ENCODER_MODE == "remote":
+            raise
+        print(f"⚠️ Encoder server at {ENCODER_SOCKET} unavailable ({e}); loading model in-process")
+        return None
+    print(f"🔌 Using shared encoder server at {ENCODER_SOCKET} ({client.model_id})")
+    return client
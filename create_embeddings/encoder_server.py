@@ -0,0 +1,135 @@
+# encoder_server.py
+# One model per host: run `python -m create_embeddings.encoder_server` (or
+# this file) and every app worker / pipeline stage encodes through it.
+import sys, os
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+import queue
+import threading
+import time
+import numpy as np
+from multiprocessing.connection import Listener
+from create_embeddings.encoder import (ENCODER_AUTHKEY, ENCODER_SOCKET, MODEL_ID,
+                                       create_local_encoder)
+
+# ------------------ CONFIG ------------------
+# Requests arriving within MAX_WAIT_MS of each other are encoded together,
+# up to MAX_BATCH_TEXTS texts per model call
+MAX_BATCH_TEXTS = int(os.environ.get("ENCODER_MAX_BATCH_TEXTS", 256))
+MAX_WAIT_MS = float(os.environ.get("ENCODER_MAX_WAIT_MS", 5))
+ENCODE_BATCH_SIZE = 128
+
+
+class _Request:
+    def __init__(self, texts):
+        self.texts = texts
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class EncoderServer:
+    """
+    Serves encode requests from many processes over a Unix socket and
+    micro-batches them: requests queued while the model is busy (or within
+    MAX_WAIT_MS) are concatenated into one encode call and split back.
+    """
+
+    def __init__(self, address=ENCODER_SOCKET, authkey=ENCODER_AUTHKEY,
+                 encoder=None, max_batch_texts=MAX_BATCH_TEXTS,
+                 max_wait_ms=MAX_WAIT_MS):
+        self.address = address
+        self.authkey = authkey
+        self.encoder = encoder or create_local_encoder()
+        # Sent to clients in the ping handshake; they key their caches on it
+        self.model_id = getattr(self.encoder, "model_id", None) or MODEL_ID
+        self.max_batch_texts = max_batch_texts
+        self.max_wait = max_wait_ms / 1000
+        self._requests = queue.Queue()
+        self.batches = 0
+        self.texts = 0
+
+    def serve_forever(self):
+        # Load the model before accepting connections
+        self.encoder.encode(["warm-up"])
+        if os.path.exists(self.address):
+            os.remove(self.address)
+        listener = Listener(self.address, family="AF_UNIX", authkey=self.authkey)
+        os.chmod(self.address, 0o600)
+        threading.Thread(target=self._batch_loop, daemon=True,
+                         name="encoder-batcher").start()
+        print(f"🚀 Encoder server listening on {self.address}")
+        try:
+            while True:
+                try:
+                    conn = listener.accept()
+                except Exception as e:  # failed handshake, keep serving
+                    print(f"⚠️ Rejected encoder connection: {e}")
+                    continue
+                threading.Thread(target=self._serve_connection, args=(conn,),
+                                 daemon=True).start()
+        finally:
+            listener.close()
+
+    def encode(self, texts):
+        """Queue texts for the next micro-batch and wait for their vectors."""
+        request = _Request(texts)
+        self._requests.put(request)
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    def _serve_connection(self, conn):
+        with conn:
+            while True:
+                try:
+                    command, payload = conn.recv()
+                except (EOFError, OSError):
+                    return
+                if command == "ping":
+                    conn.send(("ok", {"model_id": self.model_id}))
+                    continue
+                try:
+                    conn.send(("ok", self.encode(payload)))
+                except Exception as e:
+                    conn.send(("error", str(e)))
+
+    def _batch_loop(self):
+        while True:
+            batch = [self._requests.get()]
+            size = len(batch[0].texts)
+            deadline = time.monotonic() + self.max_wait
+            while size < self.max_batch_texts:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    request = self._requests.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                batch.append(request)
+                size += len(request.texts)
+            self._run_batch(batch)
+
+    def _run_batch(self, batch):
+        texts = [t for request in batch for t in request.texts]
+        try:
+            vectors = self.encoder.encode(texts, batch_size=ENCODE_BATCH_SIZE)
+        except Exception as e:
+            for request in batch:
+                request.error = e
+                request.done.set()
+            return
+        self.batches += 1
+        self.texts += len(texts)
+        offset = 0
+        for request in batch:
+            request.result = np.ascontiguousarray(
+                vectors[offset:offset + len(request.texts)])
+            offset += len(request.texts)
+            request.done.set()
+
+
+if __name__ == "__main__":
+    EncoderServer().serve_forever()
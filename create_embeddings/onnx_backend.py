@@ -0,0 +1,154 @@
+# onnx_backend.py
+# ONNX Runtime encoder for all-MiniLM-L6-v2 (fp32 or dynamically quantized
+# int8). The ONNX files are exported from the sentence-transformers model on
+# first use, or ahead of time with:
+#   python -m create_embeddings.onnx_backend [--int8]
+import sys, os
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+import threading
+import numpy as np
+from paths import SAVE_PATH
+from create_embeddings.batching import encode_in_token_batches
+
+# ------------------ CONFIG ------------------
+ONNX_DIR = os.path.join(os.path.dirname(SAVE_PATH), "models")
+MAX_SEQ_LENGTH = 256          # same truncation as the SentenceTransformer model
+OPSET = 14
+# Threads per inference call; 0 lets ONNX Runtime use every core
+INTRA_OP_THREADS = int(os.environ.get("ONNX_INTRA_OP_THREADS", 0))
+
+
+def model_dir(model_name):
+    return os.path.join(ONNX_DIR, model_name)
+
+
+def model_path(model_name, quantized):
+    return os.path.join(model_dir(model_name),
+                        "model-int8.onnx" if quantized else "model.onnx")
+
+
+def export_onnx(model_name, quantized=False):
+    """
+    Export the transformer of a sentence-transformers model to ONNX (and its
+    tokenizer next to it); with quantized, also write a dynamically
+    int8-quantized copy. Returns the path of the requested model file.
+    """
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    out_dir = model_dir(model_name)
+    fp32_path = model_path(model_name, quantized=False)
+    os.makedirs(out_dir, exist_ok=True)
+
+    if not os.path.exists(fp32_path):
+        print(f"📦 Exporting {model_name} to ONNX: {fp32_path}")
+        st_model = SentenceTransformer(model_name, device="cpu")
+        transformer = st_model[0]
+        transformer.tokenizer.save_pretrained(out_dir)
+        auto_model = transformer.auto_model.eval()
+
+        dummy = transformer.tokenizer(["export"], return_tensors="pt")
+        dynamic = {0: "batch", 1: "sequence"}
+        tmp_path = fp32_path + ".tmp"
+        with torch.no_grad():
+            torch.onnx.export(
+                auto_model,
+                (dummy["input_ids"], dummy["attention_mask"], dummy["token_type_ids"]),
+                tmp_path,
+                input_names=["input_ids", "attention_mask", "token_type_ids"],
+                output_names=["last_hidden_state"],
+                dynamic_axes={"input_ids": dynamic, "attention_mask": dynamic,
+                              "token_type_ids": dynamic,
+                              "last_hidden_state": dynamic},
+                opset_version=OPSET)
+        os.replace(tmp_path, fp32_path)
+
+    if not quantized:
+        return fp32_path
+
+    int8_path = model_path(model_name, quantized=True)
+    if not os.path.exists(int8_path):
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        print(f"📦 Quantizing {model_name} to int8: {int8_path}")
+        quantize_dynamic(fp32_path, int8_path + ".tmp", weight_type=QuantType.QInt8)
+        os.replace(int8_path + ".tmp", int8_path)
+    return int8_path
+
+
+class OnnxEncoder:
+    """
+    Drop-in replacement for LocalEncoder running on ONNX Runtime: same
+    tokenizer, mean pooling and L2 normalization as the sentence-transformers
+    pipeline for all-MiniLM-L6-v2.
+    """
+
+    def __init__(self, model_name, dim, quantized=False):
+        self.model_name = model_name
+        self.dim = dim
+        self.quantized = quantized
+        self._session = None
+        self._tokenizer = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        with self._lock:
+            if self._session is None:
+                import onnxruntime as ort
+                from transformers import AutoTokenizer
+
+                path = model_path(self.model_name, self.quantized)
+                if not os.path.exists(path):
+                    export_onnx(self.model_name, self.quantized)
+                options = ort.SessionOptions()
+                options.intra_op_num_threads = INTRA_OP_THREADS
+                options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+                print(f"🧠 Loading ONNX model {path}")
+                self._tokenizer = AutoTokenizer.from_pretrained(model_dir(self.model_name))
+                self._session = ort.InferenceSession(
+                    path, options, providers=["CPUExecutionProvider"])
+        return self._session, self._tokenizer
+
+    def is_loaded(self):
+        return self._session is not None
+
+    def encode(self, texts, batch_size=256, show_progress_bar=False):
+        """
+        Unit-norm float32 embeddings, one row per text. Texts are tokenized
+        once, then run in length-sorted, token-budgeted batches padded only
+        to the longest text of each batch.
+        """
+        if not texts:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        session, tokenizer = self._load()
+        tokens = tokenizer(list(texts), truncation=True, max_length=MAX_SEQ_LENGTH)
+        input_ids, token_type_ids = tokens["input_ids"], tokens["token_type_ids"]
+
+        def encode_rows(rows):
+            width = max(len(input_ids[i]) for i in rows.tolist())
+            feed = {name: np.zeros((len(rows), width), dtype=np.int64)
+                    for name in ("input_ids", "attention_mask", "token_type_ids")}
+            for n, i in enumerate(rows.tolist()):
+                length = len(input_ids[i])
+                feed["input_ids"][n, :length] = input_ids[i]
+                feed["token_type_ids"][n, :length] = token_type_ids[i]
+                feed["attention_mask"][n, :length] = 1
+            hidden = session.run(None, feed)[0]
+            return _mean_pool(hidden, feed["attention_mask"])
+
+        return encode_in_token_batches(encode_rows, [len(ids) for ids in input_ids],
+                                       self.dim, max_batch_size=batch_size)
+
+
+def _mean_pool(hidden, attention_mask):
+    """Masked mean over tokens, then L2 normalization."""
+    mask = attention_mask[:, :, None].astype(np.float32)
+    summed = (hidden * mask).sum(axis=1)
+    pooled = summed / np.clip(mask.sum(axis=1), 1e-9, None)
+    norms = np.linalg.norm(pooled, axis=1, keepdims=True)
+    return (pooled / np.clip(norms, 1e-12, None)).astype(np.float32)
+
+
+if __name__ == "__main__":
+    from create_embeddings.encoder import MODEL_NAME
+    print(export_onnx(MODEL_NAME, quantized="--int8" in sys.argv[1:]))
@@ -0,0 +1,206 @@
+import hashlib
+import json
+import os
+import threading
+import time
+import numpy as np
+from paths import KEYWORDS_FILE, KEYWORD_EMBEDDINGS_FILE
+from create_embeddings.encoder import current_model_id
+
+# ---------------- CONFIG ----------------
+# Keyword matrix: float32 .npy (unit-norm rows) + JSON sidecar with
+# term/variant per row, the fingerprint of keywords.json it was built from and
+# the id of the encoder that produced the vectors (see encoder.model_id_for).
+# keyword_embeddings.json is only read once, to migrate existing vectors.
+STORE_BASE = os.path.splitext(KEYWORD_EMBEDDINGS_FILE)[0]
+MATRIX_FILE = STORE_BASE + ".npy"
+META_FILE = STORE_BASE + ".meta.json"
+LEGACY_JSON_FILE = KEYWORD_EMBEDDINGS_FILE
+EMBEDDING_DIM = 384
+# Encoder that built keyword_embeddings.json
+LEGACY_JSON_MODEL = "all-MiniLM-L6-v2"
+
+
+class KeywordStore:
+    """Pre-normalized keyword matrix (read-only mmap) with row metadata."""
+
+    def __init__(self, matrix, terms, variants, fingerprint, model=None):
+        self.matrix = matrix
+        self.terms = terms
+        self.variants = variants
+        self.fingerprint = fingerprint
+        self.model = model
+
+    def __len__(self):
+        return len(self.variants)
+
+
+# ---------------- HELPERS ----------------
+def keywords_fingerprint(keywords_file=KEYWORDS_FILE):
+    with open(keywords_file, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def read_keyword_variants(keywords_file=KEYWORDS_FILE):
+    """Return (terms, variants) rows in keywords.json order."""
+    with open(keywords_file, "r", encoding="utf-8") as f:
+        keywords_data = json.load(f)
+
+    all_variants = []
+    variant_mapping = {}
+    for kw in keywords_data.get("keywords", []):
+        for variant in kw.get("variants", []):
+            all_variants.append(variant)
+            variant_mapping[variant] = kw["term"]
+    return [variant_mapping[v] for v in all_variants], all_variants
+
+
+def _valid_rows(vectors):
+    """Mask of rows with the right dimension that are not all-zero."""
+    if vectors.ndim != 2 or vectors.shape[1] != EMBEDDING_DIM:
+        return np.zeros(vectors.shape[0] if vectors.ndim else 0, dtype=bool)
+    return np.any(vectors != 0, axis=1)
+
+
+def write_keyword_store(terms, variants, vectors, fingerprint, model=None,
+                        matrix_file=MATRIX_FILE, meta_file=META_FILE):
+    """
+    Drop invalid rows, normalize, and atomically write matrix + sidecar.
+    model records which encoder produced the vectors, so later rebuilds
+    know whether they can be reused. Returns the number of rows written.
+    """
+    vectors = np.asarray(vectors, dtype=np.float32).reshape(len(variants), -1)
+    keep = _valid_rows(vectors)
+    vectors = vectors[keep]
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    vectors = vectors / norms
+    meta = {
+        "fingerprint": fingerprint,
+        "model": model,
+        "dim": EMBEDDING_DIM,
+        "rows": int(vectors.shape[0]),
+        "terms": [t for t, k in zip(terms, keep) if k],
+        "variants": [v for v, k in zip(variants, keep) if k],
+    }
+
+    os.makedirs(os.path.dirname(matrix_file), exist_ok=True)
+    # Write to temp files and swap in, so readers never see a partial store.
+    # Temp names are per process: several workers may rebuild at once.
+    tmp_matrix = f"{matrix_file}.{os.getpid()}.tmp.npy"
+    tmp_meta = f"{meta_file}.{os.getpid()}.tmp"
+    np.save(tmp_matrix, np.ascontiguousarray(vectors))
+    with open(tmp_meta, "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False)
+    os.replace(tmp_matrix, matrix_file)
+    os.replace(tmp_meta, meta_file)
+    return len(meta["variants"])
+
+
+def _read_store(matrix_file=MATRIX_FILE, meta_file=META_FILE, attempts=5):
+    """
+    Load matrix + sidecar. Another process may be swapping in a new pair
+    between the two reads; a row-count mismatch means retry.
+    """
+    for attempt in range(attempts):
+        if not (os.path.exists(matrix_file) and os.path.exists(meta_file)):
+            return None
+        with open(meta_file, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        matrix = np.load(matrix_file, mmap_mode="r")
+        if matrix.shape[0] == len(meta["variants"]):
+            return KeywordStore(matrix, meta["terms"], meta["variants"],
+                                meta.get("fingerprint"), meta.get("model"))
+        time.sleep(0.05 * (attempt + 1))
+    return None
+
+
+def read_keyword_store():
+    """The store currently on disk (whatever keywords.json it was built from)."""
+    return _read_store()
+
+
+def _migrate_legacy_json(terms, variants, fingerprint, model):
+    """
+    Reuse vectors from keyword_embeddings.json if it covers keywords.json
+    exactly and was built by model.
+    """
+    if model != LEGACY_JSON_MODEL or not os.path.exists(LEGACY_JSON_FILE):
+        return False
+    with open(LEGACY_JSON_FILE, "r", encoding="utf-8") as f:
+        legacy = json.load(f)
+    if [item.get("variant") for item in legacy] != variants:
+        return False
+    vectors = np.zeros((len(legacy), EMBEDDING_DIM), dtype=np.float32)
+    for i, item in enumerate(legacy):
+        emb = item.get("embedding", [])
+        if isinstance(emb, list) and len(emb) == EMBEDDING_DIM:
+            vectors[i] = emb
+    write_keyword_store(terms, variants, vectors, fingerprint, model=model)
+    print(f"💾 Migrated {LEGACY_JSON_FILE} to {MATRIX_FILE}")
+    return True
+
+
+def rebuild_keyword_store(keywords_file=KEYWORDS_FILE, model=None):
+    fingerprint = keywords_fingerprint(keywords_file)
+    terms, variants = read_keyword_variants(keywords_file)
+    if _read_store() is not None or not _migrate_legacy_json(terms, variants,
+                                                             fingerprint, model):
+        # Imported lazily: the builder loads the sentence-transformer model
+        from create_embeddings.create_embeddings_keywords import create_keyword_embeddings
+        create_keyword_embeddings(keywords_file)
+
+
+# ---------------- PROCESS-LEVEL CACHE ----------------
+_lock = threading.Lock()
+_store = None
+_keywords_stat = None
+_store_model = None
+
+
+def is_loaded():
+    """True once the keyword matrix is resident in this process."""
+    return _store is not None
+
+
+def _stat_key(path):
+    st = os.stat(path)
+    return (st.st_mtime_ns, st.st_size)
+
+
+def get_keyword_store(keywords_file=KEYWORDS_FILE):
+    """
+    Return the process-wide KeywordStore, loading it on first use.
+    keywords.json is only stat()ed per call; the store is rebuilt
+    (incrementally) when its content fingerprint no longer matches the one
+    recorded in the sidecar, and re-encoded when it was built by another
+    encoder than the one sentences are encoded with. While one thread
+    rebuilds, the others keep matching against the previous store; the new
+    one is swapped in whole.
+    """
+    global _store, _keywords_stat, _store_model
+    stat_key = _stat_key(keywords_file)
+    model = current_model_id()
+    if _store is not None and stat_key == _keywords_stat and model == _store_model:
+        return _store
+
+    if not _lock.acquire(blocking=_store is None):
+        return _store
+    try:
+        if _store is not None and stat_key == _keywords_stat and model == _store_model:
+            return _store
+        fingerprint = keywords_fingerprint(keywords_file)
+        store = _read_store()
+        if store is None or store.fingerprint != fingerprint:
+            print("🔄 keywords.json changed or keyword store missing, rebuilding...")
+            rebuild_keyword_store(keywords_file, model)
+            store = _read_store()
+        elif store.model != model:
+            print(f"🔄 Keyword store was built by {store.model}, re-encoding with {model}...")
+            rebuild_keyword_store(keywords_file, model)
+            store = _read_store()
+        _store = store
+        _keywords_stat = stat_key
+        _store_model = model
+        return _store
+    finally:
+        _lock.release()
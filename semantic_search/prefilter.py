@@ -0,0 +1,93 @@
+import os
+import re
+import threading
+import numpy as np
+
+# ---------------- CONFIG ----------------
+# Opt-in: skipped sentences get no embedding, so they are neither matched
+# nor added to the corpus-wide /search index.
+PREFILTER_ENABLED = os.environ.get("PREFILTER", "0") == "1"
+# A sentence is a candidate when at least MIN_HITS of its words share their
+# first STEM_CHARS characters with a word of some keyword variant (at 5,
+# "emission" meets "emissions" and "sustainable" meets "sustainability").
+# Shorter stems / fewer hits = higher recall, fewer sentences skipped.
+STEM_CHARS = int(os.environ.get("PREFILTER_STEM_CHARS", 5))
+MIN_HITS = int(os.environ.get("PREFILTER_MIN_HITS", 1))
+# Sentences with fewer letters than this (page numbers, "%", "(a)") or a
+# larger share of digits among non-space characters are skipped outright
+MIN_LETTERS = int(os.environ.get("PREFILTER_MIN_LETTERS", 3))
+MAX_NUMERIC_RATIO = float(os.environ.get("PREFILTER_MAX_NUMERIC_RATIO", 0.9))
+
+# Words too common to signal a keyword on their own
+STOPWORDS = frozenset("""
+a about after all also an and any are as at be been but by can for from has
+have how if in into is it its may more most not of on or other our out over
+per so such than that the their them there these they this those through to
+up was we were what when which while who will with within would you your
+""".split())
+
+_WORD = re.compile(r"[^\W_]+")
+
+
+def _words(text):
+    return [w for w in _WORD.findall(text.lower())
+            if len(w) >= 2 and w not in STOPWORDS]
+
+
+class Prefilter:
+    """
+    Cheap candidate generation before encoding: hashed word-stem index of
+    the keyword variants plus length / numeric-ratio heuristics.
+    """
+
+    def __init__(self, variants, stem_chars=STEM_CHARS, min_hits=MIN_HITS,
+                 min_letters=MIN_LETTERS, max_numeric_ratio=MAX_NUMERIC_RATIO):
+        self.stem_chars = stem_chars
+        self.min_hits = min_hits
+        self.min_letters = min_letters
+        self.max_numeric_ratio = max_numeric_ratio
+        self.stems = frozenset(w[:stem_chars] for v in variants for w in _words(v))
+
+    def settings(self):
+        """Identifies the filter's behaviour, e.g. for result cache keys."""
+        return (f"stem{self.stem_chars}:hits{self.min_hits}:"
+                f"letters{self.min_letters}:num{self.max_numeric_ratio}")
+
+    def is_candidate(self, text):
+        chars = "".join(text.split())
+        letters = sum(c.isalpha() for c in chars)
+        if letters < self.min_letters:
+            return False
+        if sum(c.isdigit() for c in chars) > self.max_numeric_ratio * len(chars):
+            return False
+        n, stems, hits = self.stem_chars, self.stems, 0
+        for word in _words(text):
+            if word[:n] in stems:
+                hits += 1
+                if hits >= self.min_hits:
+                    return True
+        return False
+
+    def candidate_mask(self, texts):
+        """Boolean array: True for texts worth encoding."""
+        return np.fromiter((self.is_candidate(t) for t in texts), dtype=bool,
+                           count=len(texts))
+
+
+# ---------------- PROCESS-LEVEL CACHE ----------------
+_lock = threading.Lock()
+_prefilters = {}
+
+
+def get_prefilter(keyword_store):
+    """Prefilter for the store's vocabulary, or None when disabled."""
+    if not PREFILTER_ENABLED:
+        return None
+    with _lock:
+        prefilter = _prefilters.get(keyword_store.fingerprint)
+        if prefilter is None:
+            prefilter = Prefilter(keyword_store.variants)
+            # One vocabulary at a time; older ones are not coming back
+            _prefilters.clear()
+            _prefilters[keyword_store.fingerprint] = prefilter
+        return prefilter
@@ -1,19 +1,27 @@
-import json
+import time
 import numpy as np
-import os
-from sentence_transformers import SentenceTransformer
-from paths import KEYWORDS_FILE, SAVE_PATH, KEYWORD_EMBEDDINGS_FILE
+from paths import KEYWORDS_FILE, SAVE_PATH
+from semantic_search.keyword_store import get_keyword_store
+from services import metrics
+from services.persistence import persist_async, write_json
+from services.sentence_batch import SentenceBatch
 
 # ---------------- CONFIG / INPUTS ----------------
 keywords_file = KEYWORDS_FILE
-keyword_embeddings_file = KEYWORD_EMBEDDINGS_FILE
 save_path = SAVE_PATH
 base_threshold = 0.45
 short_sentence_threshold = 0.7
-model_name = "all-MiniLM-L6-v2"
-device = "cpu"
+short_sentence_max_words = 7   # sentences with fewer words use the short threshold
+top_k_per_sentence = None      # optional cap on matches kept per sentence
+tile_size = 2048               # sentences scored per tile; bounds peak memory
 
 # ---------------- HELPERS ----------------
+def search_settings():
+    """Every parameter that changes run_semantic_search output, for cache keys."""
+    return (f"{base_threshold}:{short_sentence_threshold}:"
+            f"{short_sentence_max_words}:{top_k_per_sentence}")
+
+
 def safe_normalize(vectors: np.ndarray) -> np.ndarray:
     if vectors.size == 0:
         return np.zeros((vectors.shape[0], 384), dtype=np.float32)
@@ -21,12 +29,33 @@ def safe_normalize(vectors: np.ndarray) -> np.ndarray:
     norms[norms == 0] = 1.0
     return vectors / norms
 
-def cosine_similarity_matrix(A, B):
+def cosine_similarity_matrix(A, B, a_normalized=False, b_normalized=False):
     if A.size == 0 or B.size == 0:
         return np.zeros((A.shape[0], B.shape[0]))
-    return np.dot(safe_normalize(A), safe_normalize(B).T)
+    A = A if a_normalized else safe_normalize(A)
+    B = B if b_normalized else safe_normalize(B)
+    return np.dot(A, B.T)
+
+def iter_similarity_tiles(A, B, tile_rows=None, a_normalized=False,
+                          b_normalized=False):
+    """
+    Yield (row_offset, similarity tile) for consecutive blocks of A's rows.
+    Only one tile_rows x len(B) block is alive at a time; B is normalized
+    once up front unless flagged as unit-norm.
+    """
+    if tile_rows is None:
+        tile_rows = tile_size
+    if A.shape[0] == 0:
+        return
+    if not b_normalized and B.size:
+        B = safe_normalize(B)
+    for start in range(0, A.shape[0], tile_rows):
+        yield start, cosine_similarity_matrix(A[start:start + tile_rows], B,
+                                              a_normalized=a_normalized,
+                                              b_normalized=True)
 
 def filter_valid_embeddings(items):
+    """Legacy dict path; SentenceBatch.valid_mask() is the vectorized equivalent."""
     valid = []
     for item in items:
         emb = item.get("embedding", [])
@@ -34,77 +63,153 @@ def filter_valid_embeddings(items):
             valid.append(item)
     return valid
 
-# ---------------- MAIN FUNCTION ----------------
-def run_semantic_search(sentences_embeddings):
+# ---------------- KEYWORDS ----------------
+def load_keyword_embeddings():
     """
-    sentences_embeddings: list of dicts like
-        {'text':..., 'page_num':..., 'embedding':[...], 'bbox':[...]}
+    Return the process-wide KeywordStore (pre-normalized, memory-mapped),
+    or a structured error dict.
     """
-
-    valid_sentences = filter_valid_embeddings(sentences_embeddings)
-    if not valid_sentences:
-        # ⚠️ Return structured error for frontend
-        return {"status": "error", "message": "No valid sentence embeddings found (PDF may be scanned or empty)."}
-
     try:
-        with open(keywords_file, "r", encoding="utf-8") as f:
-            keywords_data = json.load(f)
+        store = get_keyword_store(keywords_file)
     except FileNotFoundError:
         return {"status": "error", "message": f"Keywords file not found: {keywords_file}"}
 
-    if os.path.exists(keyword_embeddings_file):
-        with open(keyword_embeddings_file, "r", encoding="utf-8") as f:
-            keyword_embeddings = json.load(f)
-    else:
-        model = SentenceTransformer(model_name, device=device)
-        keyword_embeddings = []
-        all_variants, variant_map = [], {}
-        for kw in keywords_data.get("keywords", []):
-            for variant in kw.get("variants", []):
-                all_variants.append(variant)
-                variant_map[variant] = kw["term"]
-        if all_variants:
-            vectors = model.encode(all_variants, normalize_embeddings=True, convert_to_numpy=True)
-            if vectors.ndim == 1:
-                vectors = vectors.reshape(1, -1)
-            for variant, vec in zip(all_variants, vectors.tolist()):
-                keyword_embeddings.append({"term": variant_map[variant], "variant": variant, "embedding": vec})
-            os.makedirs(os.path.dirname(keyword_embeddings_file), exist_ok=True)
-            with open(keyword_embeddings_file, "w", encoding="utf-8") as f:
-                json.dump(keyword_embeddings, f, indent=2, ensure_ascii=False)
-
-    valid_keywords = filter_valid_embeddings(keyword_embeddings)
-    if not valid_keywords:
+    if store is None or len(store) == 0:
         return {"status": "error", "message": "No valid ESG keywords found. Please update keywords in Settings."}
+    return store
+
+
+# ---------------- MATCHING ----------------
+def sentence_thresholds(texts, dtype=np.float32):
+    """Per-sentence threshold vector (short vs. long sentences)."""
+    word_counts = np.fromiter((len(t.split()) for t in texts), dtype=np.int32,
+                              count=len(texts))
+    is_short = word_counts < short_sentence_max_words
+    return np.where(is_short, short_sentence_threshold, base_threshold).astype(dtype), is_short
+
+
+def match_sentences(batch, keyword_store, top_k=None):
+    """
+    Score a SentenceBatch (with valid embeddings) against the keyword matrix.
+    Returns one result dict per sentence that matched at least one keyword,
+    matches sorted by similarity (ties keep keyword order), optionally capped
+    at top_k per sentence.
+    """
+    return list(iter_matches(batch, keyword_store, top_k=top_k))
+
 
-    sent_array = np.array([s["embedding"] for s in valid_sentences], dtype=np.float32)
-    kw_array = np.array([k["embedding"] for k in valid_keywords], dtype=np.float32)
+def iter_matches(batch, keyword_store, top_k=None, tile_rows=None):
+    """
+    Streaming form of match_sentences: scores the batch tile by tile and
+    yields result dicts as each tile is done, so peak memory depends on the
+    tile size rather than on document size x vocabulary size.
+    """
+    if top_k is None:
+        top_k = top_k_per_sentence
+    if not len(batch):
+        return
 
-    sim_matrix = cosine_similarity_matrix(sent_array, kw_array)
+    thresholds, is_short = sentence_thresholds(batch.texts)
+    matching_ms = 0.0
+    # Similarity + thresholding time, excluding the consumer's time between tiles
+    scoring_s = 0.0
+    matched = 0
+    tile_start = time.perf_counter()
+    # The keyword store is always unit-norm
+    for offset, sim_tile in iter_similarity_tiles(
+            batch.embeddings, keyword_store.matrix, tile_rows,
+            a_normalized=batch.normalized, b_normalized=True):
+        start = time.perf_counter()
+        rows, cols, scores = _tile_matches(
+            sim_tile, thresholds[offset:offset + sim_tile.shape[0]], top_k)
+        tile_results = _assemble_results(batch, keyword_store, rows + offset,
+                                         cols, scores, is_short)
+        matching_ms += (time.perf_counter() - start) * 1000
+        scoring_s += time.perf_counter() - tile_start
+        matched += len(tile_results)
+        yield from tile_results
+        tile_start = time.perf_counter()
+
+    metrics.record("score", scoring_s)
+    metrics.inc("matches_total", matched)
+    print(f"⏱️ Thresholding + match assembly: {matching_ms:.1f} ms "
+          f"({len(batch)} sentences x {len(keyword_store)} keywords)")
+
+
+def _tile_matches(sim_tile, thresholds, top_k):
+    """(row, col, score) arrays for one tile, sorted by row then score."""
+    # Thresholds share the similarity dtype so the comparison matches the
+    # scalar `row >= threshold` test exactly
+    thresholds = thresholds.astype(sim_tile.dtype, copy=False)
+    rows, cols = np.nonzero(sim_tile >= thresholds[:, None])
+    scores = sim_tile[rows, cols]
+
+    # Sort by row, then similarity descending; lexsort is stable, so equal
+    # similarities stay in keyword order
+    order = np.lexsort((-scores, rows))
+    rows, cols, scores = rows[order], cols[order], scores[order]
+
+    if top_k is not None:
+        rank = np.arange(rows.size) - np.searchsorted(rows, rows, side="left")
+        keep = rank < top_k
+        rows, cols, scores = rows[keep], cols[keep], scores[keep]
+    return rows, cols, scores
+
+
+def _assemble_results(batch, keyword_store, rows, cols, scores, is_short):
+    """Build result dicts from row-sorted (row, col, score) match arrays."""
+    if rows.size == 0:
+        return []
+    terms, variants = keyword_store.terms, keyword_store.variants
+    col_list = cols.tolist()
+    score_list = scores.tolist()
+    bounds = [0] + (np.flatnonzero(np.diff(rows)) + 1).tolist() + [rows.size]
+    row_ids = rows[bounds[:-1]]
+    # Only the matched rows are converted to Python objects
+    page_nums = batch.page_nums[row_ids].tolist()
+    bboxes = batch.bboxes[row_ids].tolist()
+    short_rows = is_short[row_ids].tolist()
 
     results = []
-    for i, sent in enumerate(valid_sentences):
-        word_count = len(sent["text"].split())
-        threshold = short_sentence_threshold if word_count < 7 else base_threshold
-        matched_idx = np.where(sim_matrix[i] >= threshold)[0]
-        if matched_idx.size > 0:
-            matches = [{"keyword": valid_keywords[idx]["term"],
-                        "variant": valid_keywords[idx]["variant"],
-                        "similarity": float(sim_matrix[i, idx])} 
-                        for idx in matched_idx]
-            matches.sort(key=lambda x: x["similarity"], reverse=True)
-            results.append({
-                "sentence": sent["text"],
-                "page_num": sent["page_num"],
-                "bbox": sent.get("bbox", [0,0,0,0]),
-                "keywords": matches,
-                "applied_threshold": threshold
-            })
-
-    os.makedirs(os.path.dirname(save_path), exist_ok=True)
-    with open(save_path, "w", encoding="utf-8") as f:
-        json.dump(results, f, indent=2, ensure_ascii=False)
+    for n, (i, lo, hi) in enumerate(zip(row_ids.tolist(), bounds[:-1], bounds[1:])):
+        results.append({
+            "sentence": batch.texts[i],
+            "page_num": page_nums[n],
+            "bbox": bboxes[n],
+            "keywords": [{"keyword": terms[c], "variant": variants[c], "similarity": v}
+                         for c, v in zip(col_list[lo:hi], score_list[lo:hi])],
+            "applied_threshold": short_sentence_threshold if short_rows[n] else base_threshold
+        })
+    return results
+
+
+# ---------------- MAIN FUNCTION ----------------
+def run_semantic_search(sentences_embeddings, persist=True):
+    """
+    sentences_embeddings: SentenceBatch with embeddings, or the legacy list
+    of dicts like
+        {'text':..., 'page_num':..., 'embedding':[...], 'bbox':[...]}
+    Unless persist is False, the results are also saved to save_path in
+    the background.
+    """
+    if isinstance(sentences_embeddings, SentenceBatch):
+        batch = sentences_embeddings
+    else:
+        batch = SentenceBatch.from_records(sentences_embeddings)
+
+    valid_sentences = batch.select(batch.valid_mask())
+    if not len(valid_sentences):
+        # ⚠️ Return structured error for frontend
+        return {"status": "error", "message": "No valid sentence embeddings found (PDF may be scanned or empty)."}
+
+    keyword_store = load_keyword_embeddings()
+    if isinstance(keyword_store, dict):
+        return keyword_store
+
+    results = match_sentences(valid_sentences, keyword_store)
 
     print(f"✅ Semantic search complete! Found {len(results)} sentences with keyword matches.")
-    print(f"💾 Results saved to {save_path}")
+    if persist:
+        persist_async(write_json, save_path, results)
+        print(f"💾 Saving results to {save_path}")
     return results
@@ -0,0 +1,418 @@
+import fcntl
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+import numpy as np
+from paths import SAVE_PATH
+
+faiss = None
+_faiss_checked = False
+
+
+def _import_faiss():
+    """faiss is imported on first index use; None means NumPy exact search."""
+    global faiss, _faiss_checked
+    if not _faiss_checked:
+        try:
+            import faiss as faiss_module
+            faiss = faiss_module
+        except ImportError:
+            faiss = None
+        _faiss_checked = True
+    return faiss
+
+# ---------------- CONFIG ----------------
+INDEX_DIR = os.path.join(os.path.dirname(SAVE_PATH), "index")
+EMBEDDING_DIM = 384
+HNSW_M = 32                    # graph degree of the faiss HNSW index
+HNSW_EF_SEARCH = 64            # search breadth; higher = better recall, slower
+# HNSW cannot delete in place: removed sentences are tombstoned (skipped by
+# an id filter during the graph search) and the graph is rebuilt from the
+# vector shards once this share is dead.
+REBUILD_TOMBSTONE_RATIO = 0.2
+
+
+class IndexModelMismatch(Exception):
+    """Vectors of another model than the index's were added or searched for."""
+
+
+class VectorIndex:
+    """
+    Corpus-wide sentence index persisted under `directory`:
+      meta.sqlite       sentence id -> document, page, text, bbox
+      shards/<doc>.npz  ids + unit-norm float32 vectors, one file per document
+      hnsw.faiss        faiss HNSW graph over all shards (when faiss is installed)
+    Documents are added and removed incrementally; the shards are the source
+    of truth and the faiss graph is rebuilt from them when needed. The id of
+    the model that produced the vectors is kept in the state table; vectors
+    of another model are refused until reindex() re-encodes the corpus.
+    Several processes may share one directory: writes are serialized with a
+    file lock, and every write bumps a generation number so the other
+    processes drop their cached matrix / graph and reload it.
+    """
+
+    def __init__(self, directory=INDEX_DIR, dim=EMBEDDING_DIM, use_faiss=None):
+        self.directory = directory
+        self.dim = dim
+        self.use_faiss = (_import_faiss() is not None) if use_faiss is None else use_faiss
+        self._lock = threading.RLock()
+        self._shard_dir = os.path.join(directory, "shards")
+        self._faiss_path = os.path.join(directory, "hnsw.faiss")
+        os.makedirs(self._shard_dir, exist_ok=True)
+        self._lock_file = open(os.path.join(directory, "write.lock"), "a")
+        self._write_depth = 0
+
+        self._conn = sqlite3.connect(os.path.join(directory, "meta.sqlite"),
+                                     check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS documents ("
+            " doc_id TEXT PRIMARY KEY, name TEXT, sentences INTEGER,"
+            " added REAL)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS sentences ("
+            " id INTEGER PRIMARY KEY, doc_id TEXT NOT NULL,"
+            " page_num INTEGER, text TEXT,"
+            " x0 REAL, y0 REAL, x1 REAL, y1 REAL)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS sentences_doc"
+                           " ON sentences (doc_id)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value)")
+        # Sentence ids removed since the faiss graph was last rebuilt
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS tombstones (id INTEGER PRIMARY KEY)")
+        self._conn.commit()
+
+        # Exact-search matrix, rebuilt lazily from the shards after changes
+        self._ids = None
+        self._matrix = None
+        self._hnsw = None
+        # (faiss position -> sentence id, search params skipping tombstones)
+        self._hnsw_filter = None
+        self._generation = None
+        self._reindexing = threading.Lock()
+
+        if self._get_state("tombstones") is not None:
+            # Older indexes only counted tombstones: rebuild without them
+            with self._writing():
+                if os.path.exists(self._faiss_path):
+                    os.remove(self._faiss_path)
+                self._conn.execute("DELETE FROM state WHERE key = 'tombstones'")
+                self._conn.commit()
+
+    # ---------------- WRITE PATH ----------------
+    def add_document(self, doc_id, batch, name=None, model=None):
+        """
+        Index the valid rows of a SentenceBatch under doc_id, replacing any
+        previous version of the document. model is the id of the model that
+        encoded the batch; IndexModelMismatch is raised when the index holds
+        other documents from another model. Returns the number of sentences.
+        """
+        batch = batch.select(batch.valid_mask(self.dim))
+        vectors = np.asarray(batch.embeddings, dtype=np.float32).reshape(-1, self.dim)
+        if not batch.normalized and len(vectors):
+            vectors = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+        with self._writing():
+            self.remove_document(doc_id)
+            if model is not None:
+                indexed_model = self._get_state("model")
+                if indexed_model not in (None, model) and self._document_count():
+                    raise IndexModelMismatch(
+                        f"Index holds {indexed_model} vectors, not {model}")
+                self._set_state("model", model)
+            # Load (or build) the graph before this document's shard exists
+            hnsw = self._load_hnsw() if self.use_faiss else None
+            # Ids are never reused: tombstoned ids may still be in the graph
+            first_id = int(self._get_state("next_id", 1))
+            ids = np.arange(first_id, first_id + len(batch), dtype=np.int64)
+            self._set_state("next_id", first_id + len(batch))
+            bboxes = batch.bboxes.tolist()
+            self._conn.executemany(
+                "INSERT INTO sentences (id, doc_id, page_num, text, x0, y0, x1, y1)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [(i, doc_id, p, t, *b) for i, p, t, b in zip(
+                    ids.tolist(), batch.page_nums.tolist(), batch.texts, bboxes)])
+            self._conn.execute(
+                "INSERT OR REPLACE INTO documents (doc_id, name, sentences, added)"
+                " VALUES (?, ?, ?, ?)", (doc_id, name, len(batch), time.time()))
+            np.savez(self._shard_path(doc_id), ids=ids, vectors=vectors)
+            self._conn.commit()
+
+            self._ids = self._matrix = None
+            if hnsw is not None and len(ids):
+                hnsw.add_with_ids(vectors, ids)
+                self._write_hnsw(hnsw)
+        return len(batch)
+
+    def remove_document(self, doc_id):
+        """Drop a document from the index. Returns the number of sentences removed."""
+        with self._writing():
+            if self.use_faiss:
+                self._conn.execute("INSERT OR IGNORE INTO tombstones (id)"
+                                   " SELECT id FROM sentences WHERE doc_id = ?", (doc_id,))
+            removed = self._conn.execute(
+                "DELETE FROM sentences WHERE doc_id = ?", (doc_id,)).rowcount
+            self._conn.execute("DELETE FROM documents WHERE doc_id = ?", (doc_id,))
+            shard = self._shard_path(doc_id)
+            if os.path.exists(shard):
+                os.remove(shard)
+            self._conn.commit()
+            if removed:
+                self._ids = self._matrix = None
+                self._check_tombstones()
+        return removed
+
+    def reindex(self, encode_texts, model):
+        """
+        Re-encode every indexed sentence with encode_texts (list of texts ->
+        unit-norm float32 rows) and record model as the index's model.
+        Encoding runs without holding the index, so searches and writes go
+        on meanwhile; documents changed in between keep their new vectors.
+        Returns the number of sentences re-encoded, or None when this
+        process is already reindexing.
+        """
+        if not self._reindexing.acquire(blocking=False):
+            return None
+        try:
+            with self._lock:
+                self._sync()
+                if self._get_state("model") == model:
+                    # Already done (e.g. by an earlier request or process)
+                    return 0
+                snapshot = {}
+                for doc_id, sentence_id, text in self._conn.execute(
+                        "SELECT doc_id, id, text FROM sentences ORDER BY id").fetchall():
+                    ids, texts = snapshot.setdefault(doc_id, ([], []))
+                    ids.append(sentence_id)
+                    texts.append(text)
+            print(f"🔄 Re-encoding {sum(len(t) for _, t in snapshot.values())} indexed "
+                  f"sentences of {len(snapshot)} documents with {model}")
+            encoded = {doc_id: (np.asarray(ids, dtype=np.int64),
+                                np.asarray(encode_texts(texts), dtype=np.float32))
+                       for doc_id, (ids, texts) in snapshot.items()}
+
+            with self._writing():
+                for doc_id, (ids, vectors) in encoded.items():
+                    current = [i for i, in self._conn.execute(
+                        "SELECT id FROM sentences WHERE doc_id = ? ORDER BY id", (doc_id,))]
+                    if current == ids.tolist():
+                        np.savez(self._shard_path(doc_id), ids=ids, vectors=vectors)
+                self._set_state("model", model)
+                self._ids = self._matrix = None
+                if self.use_faiss:
+                    self._rebuild_hnsw()
+            return sum(len(ids) for ids, _ in encoded.values())
+        finally:
+            self._reindexing.release()
+
+    # ---------------- READ PATH ----------------
+    def search(self, query_vector, k=10, model=None):
+        """
+        Top-k sentences across the corpus for one unit-norm query vector.
+        Returns dicts with doc_id, name, page_num, sentence, bbox and score.
+        Raises IndexModelMismatch when model (the query's) is not the index's.
+        """
+        query = np.asarray(query_vector, dtype=np.float32).reshape(1, self.dim)
+        with self._lock:
+            self._sync()
+            indexed_model = self._get_state("model")
+            if model is not None and indexed_model not in (None, model):
+                raise IndexModelMismatch(
+                    f"Index holds {indexed_model} vectors, query is {model}")
+            if self.use_faiss:
+                ids, scores = self._search_hnsw(query, k)
+            else:
+                ids, scores = self._search_exact(query, k)
+            return self._fetch_metadata(ids, scores)[:k]
+
+    def model(self):
+        """Id of the model the indexed vectors come from (None before any add)."""
+        with self._lock:
+            return self._get_state("model")
+
+    def documents(self):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT doc_id, name, sentences, added FROM documents"
+                " ORDER BY added").fetchall()
+        return [{"doc_id": d, "name": n, "sentences": s, "added": a}
+                for d, n, s, a in rows]
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM sentences").fetchone()[0]
+
+    # ---------------- INTERNALS ----------------
+    @contextmanager
+    def _writing(self):
+        """
+        Exclusive write access across threads and processes. The outermost
+        block reloads whatever another process changed first and publishes
+        a new generation once everything, graph included, is on disk.
+        """
+        with self._lock:
+            if self._write_depth == 0:
+                fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+                self._sync()
+            self._write_depth += 1
+            try:
+                yield
+            finally:
+                self._write_depth -= 1
+                if self._write_depth == 0:
+                    self._hnsw_filter = None
+                    self._generation = int(self._get_state("generation", 0)) + 1
+                    self._set_state("generation", self._generation)
+                    fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+    def _sync(self):
+        """Drop cached search structures when another process wrote the index."""
+        generation = int(self._get_state("generation", 0))
+        if generation != self._generation:
+            self._ids = self._matrix = self._hnsw = self._hnsw_filter = None
+            self._generation = generation
+
+    def _document_count(self):
+        return self._conn.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+
+    def _shard_path(self, doc_id):
+        return os.path.join(self._shard_dir, f"{doc_id}.npz")
+
+    def _load_shards(self):
+        if self._matrix is not None:
+            return
+        all_ids, all_vectors = [], []
+        for doc_id, in self._conn.execute("SELECT doc_id FROM documents"):
+            path = self._shard_path(doc_id)
+            if os.path.exists(path):
+                with np.load(path) as shard:
+                    all_ids.append(shard["ids"])
+                    all_vectors.append(shard["vectors"])
+        self._ids = (np.concatenate(all_ids) if all_ids
+                     else np.zeros(0, dtype=np.int64))
+        self._matrix = (np.concatenate(all_vectors) if all_vectors
+                        else np.zeros((0, self.dim), dtype=np.float32))
+
+    def _search_exact(self, query, k):
+        self._load_shards()
+        if not len(self._ids):
+            return [], []
+        scores = self._matrix @ query[0]
+        k = min(k, scores.size)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return self._ids[top].tolist(), scores[top].tolist()
+
+    def _load_hnsw(self):
+        if self._hnsw is None:
+            if os.path.exists(self._faiss_path):
+                self._hnsw = faiss.read_index(self._faiss_path)
+            else:
+                self._rebuild_hnsw()
+            faiss.downcast_index(self._hnsw.index).hnsw.efSearch = HNSW_EF_SEARCH
+        return self._hnsw
+
+    def _rebuild_hnsw(self):
+        self._load_shards()
+        hnsw = faiss.IndexHNSWFlat(self.dim, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+        hnsw.hnsw.efSearch = HNSW_EF_SEARCH
+        index = faiss.IndexIDMap2(hnsw)
+        if len(self._ids):
+            index.add_with_ids(self._matrix, self._ids)
+        self._write_hnsw(index)
+        self._hnsw = index
+        self._hnsw_filter = None
+        self._conn.execute("DELETE FROM tombstones")
+        self._conn.commit()
+
+    def _write_hnsw(self, index):
+        # Replaced atomically: other processes may be reading the file
+        tmp_path = f"{self._faiss_path}.{os.getpid()}.tmp"
+        faiss.write_index(index, tmp_path)
+        os.replace(tmp_path, self._faiss_path)
+
+    def _check_tombstones(self):
+        if not self.use_faiss:
+            return
+        tombstones = self._conn.execute("SELECT COUNT(*) FROM tombstones").fetchone()[0]
+        live = self._conn.execute("SELECT COUNT(*) FROM sentences").fetchone()[0]
+        if tombstones > REBUILD_TOMBSTONE_RATIO * max(live + tombstones, 1):
+            self._rebuild_hnsw()
+
+    def _search_filter(self, index):
+        """
+        (position -> id map, HNSW search params) for the current graph. The
+        IDMap wrapper does not take search params, so the inner graph is
+        searched with a bitmap of live positions and results are mapped back.
+        """
+        if self._hnsw_filter is None:
+            id_map = faiss.vector_to_array(index.id_map)
+            params = faiss.SearchParametersHNSW(efSearch=HNSW_EF_SEARCH)
+            dead = np.array([i for i, in self._conn.execute("SELECT id FROM tombstones")],
+                            dtype=np.int64)
+            selector = bitmap = None
+            if len(dead):
+                bitmap = np.packbits(~np.isin(id_map, dead), bitorder="little")
+                selector = faiss.IDSelectorBitmap(len(id_map), faiss.swig_ptr(bitmap))
+                params.sel = selector
+            # params only points at the selector and bitmap: keep them alive
+            self._hnsw_filter = (id_map, params, (selector, bitmap))
+        return self._hnsw_filter[:2]
+
+    def _search_hnsw(self, query, k):
+        index = self._load_hnsw()
+        if index.ntotal == 0:
+            return [], []
+        id_map, params = self._search_filter(index)
+        graph = faiss.downcast_index(index.index)
+        scores, positions = graph.search(query, min(k, index.ntotal), params=params)
+        positions = positions[0]
+        ids = np.where(positions >= 0, id_map[np.maximum(positions, 0)], -1)
+        return ids.tolist(), scores[0].tolist()
+
+    def _fetch_metadata(self, ids, scores):
+        ids_scores = [(i, s) for i, s in zip(ids, scores) if i >= 0]
+        if not ids_scores:
+            return []
+        placeholders = ",".join("?" * len(ids_scores))
+        rows = self._conn.execute(
+            "SELECT s.id, s.doc_id, d.name, s.page_num, s.text, s.x0, s.y0, s.x1, s.y1"
+            " FROM sentences s JOIN documents d ON d.doc_id = s.doc_id"
+            f" WHERE s.id IN ({placeholders})",
+            [i for i, _ in ids_scores]).fetchall()
+        meta = {row[0]: row[1:] for row in rows}
+        results = []
+        for i, score in ids_scores:
+            if i not in meta:  # tombstoned
+                continue
+            doc_id, name, page_num, text, x0, y0, x1, y1 = meta[i]
+            results.append({"doc_id": doc_id, "name": name, "page_num": page_num,
+                            "sentence": text, "bbox": [x0, y0, x1, y1],
+                            "score": float(score)})
+        return results
+
+    def _get_state(self, key, default=None):
+        row = self._conn.execute("SELECT value FROM state WHERE key = ?",
+                                 (key,)).fetchone()
+        return row[0] if row else default
+
+    def _set_state(self, key, value):
+        self._conn.execute("INSERT OR REPLACE INTO state (key, value) VALUES (?, ?)",
+                           (key, value))
+        self._conn.commit()
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_vector_index():
+    """Process-wide VectorIndex, opened on first use."""
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = VectorIndex()
+        return _index
@@ -0,0 +1,138 @@
+import os
+import sqlite3
+import threading
+import time
+from paths import SAVE_PATH
+from services.result_cache import pdf_hash
+
+# ---------------- CONFIG ----------------
+DOCUMENTS_DIR = os.path.join(os.path.dirname(SAVE_PATH), "documents")
+# Total size of the on-disk store; least recently used PDFs are removed beyond it
+DOCUMENT_STORE_MAX_BYTES = int(os.environ.get("DOCUMENT_STORE_MAX_BYTES",
+                                              2 * 1024 * 1024 * 1024))
+
+
+class DocumentStore:
+    """
+    Uploaded PDFs keyed by document id (sha256 of the bytes).
+    Every document is written once to `directory` so it can be served by
+    path (HTTP Range requests, no per-request copy) and survives restarts.
+    Sessions uploading the same bytes share the document; refs counts the
+    sessions holding it, so one of them deleting it leaves it to the others.
+    """
+
+    def __init__(self, directory=DOCUMENTS_DIR, max_bytes=DOCUMENT_STORE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+        self._conn = sqlite3.connect(os.path.join(directory, "documents.sqlite"),
+                                     timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS documents ("
+            " doc_id TEXT PRIMARY KEY, filename TEXT, size INTEGER NOT NULL,"
+            " last_used REAL NOT NULL, refs INTEGER NOT NULL DEFAULT 1)")
+        # Stores created before references were counted
+        try:
+            self._conn.execute("ALTER TABLE documents ADD COLUMN refs INTEGER NOT NULL DEFAULT 1")
+        except sqlite3.OperationalError:
+            pass
+        self._conn.execute("CREATE INDEX IF NOT EXISTS documents_last_used"
+                           " ON documents (last_used)")
+        self._conn.commit()
+
+    def put(self, pdf_bytes, filename=None, reference=True):
+        """
+        Store a PDF and return its document id. Identical bytes are stored
+        once; reference adds one to the document's reference count.
+        """
+        # Same id the result cache and vector index use for this document
+        doc_id = pdf_hash(pdf_bytes)
+        path = self.path(doc_id)
+        with self._lock:
+            # The row is written first: its write lock keeps other processes
+            # from releasing (and deleting) the file while it is checked
+            self._conn.execute(
+                "INSERT INTO documents (doc_id, filename, size, last_used, refs)"
+                " VALUES (?, ?, ?, ?, ?) ON CONFLICT (doc_id) DO UPDATE SET"
+                " filename = excluded.filename, size = excluded.size,"
+                " last_used = excluded.last_used, refs = refs + excluded.refs",
+                (doc_id, filename, len(pdf_bytes), time.time(), int(reference)))
+            if not os.path.exists(path):
+                tmp_path = f"{path}.{os.getpid()}.tmp"
+                with open(tmp_path, "wb") as f:
+                    f.write(pdf_bytes)
+                os.replace(tmp_path, path)
+            self._evict(keep=doc_id)
+            self._conn.commit()
+        return doc_id
+
+    def open(self, doc_id):
+        """(path, filename) of a stored PDF, or None. Marks the document as used."""
+        with self._lock:
+            row = self._conn.execute("SELECT filename FROM documents WHERE doc_id = ?",
+                                     (doc_id,)).fetchone()
+            if row is None or not os.path.exists(self.path(doc_id)):
+                return None
+            self._conn.execute("UPDATE documents SET last_used = ? WHERE doc_id = ?",
+                               (time.time(), doc_id))
+            self._conn.commit()
+        return self.path(doc_id), row[0]
+
+    def release(self, doc_id, remove_unused=False):
+        """
+        Drop one reference to a document and return how many are left (None
+        for an unknown document). With remove_unused, a document nobody
+        references any more is removed from the store.
+        """
+        with self._lock:
+            self._conn.execute("UPDATE documents SET refs = MAX(refs - 1, 0)"
+                               " WHERE doc_id = ?", (doc_id,))
+            row = self._conn.execute("SELECT refs FROM documents WHERE doc_id = ?",
+                                     (doc_id,)).fetchone()
+            if row is not None and row[0] == 0 and remove_unused:
+                self._conn.execute("DELETE FROM documents WHERE doc_id = ?", (doc_id,))
+                self._remove_file(doc_id)
+            self._conn.commit()
+        return row[0] if row is not None else None
+
+    def path(self, doc_id):
+        return os.path.join(self.directory, f"{doc_id}.pdf")
+
+    # ---------------- INTERNALS ----------------
+    def _remove_file(self, doc_id):
+        try:
+            os.remove(self.path(doc_id))
+        except FileNotFoundError:
+            pass
+
+    def _evict(self, keep):
+        total = self._conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM documents").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        excess = total - self.max_bytes
+        for doc_id, size in self._conn.execute(
+                "SELECT doc_id, size FROM documents ORDER BY last_used").fetchall():
+            if doc_id == keep:
+                continue
+            self._conn.execute("DELETE FROM documents WHERE doc_id = ?", (doc_id,))
+            self._remove_file(doc_id)
+            excess -= size
+            if excess <= 0:
+                break
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_document_store():
+    """Process-wide DocumentStore, opened on first use."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = DocumentStore()
+        return _store
@@ -0,0 +1,364 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import traceback
+import uuid
+import zlib
+from paths import SAVE_PATH
+from services import metrics
+
+# ---------------- CONFIG ----------------
+JOBS_DIR = os.path.join(os.path.dirname(SAVE_PATH), "jobs")
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", 2))
+# Submissions are refused (HTTP 503) while this many jobs are waiting
+MAX_PENDING_JOBS = int(os.environ.get("MAX_PENDING_JOBS", 32))
+# Finished jobs and their results are dropped after this long
+JOB_RETENTION_SECONDS = 24 * 60 * 60
+POLL_INTERVAL = 1.0            # idle workers also poll for jobs queued by other processes
+ORPHAN_CHECK_INTERVAL = 60.0   # idle workers re-queue jobs of dead processes this often
+# A job whose result cannot be stored (e.g. "database is locked") is marked
+# failed, retrying this many times before giving up
+FINISH_ATTEMPTS = 3
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+
+class QueueFull(Exception):
+    """Raised by JobQueue.submit when MAX_PENDING_JOBS jobs are already waiting."""
+
+
+class JobQueue:
+    """
+    SQLite-backed document job queue with a bounded pool of worker threads.
+    Uploaded PDFs are spooled to `directory`; workers claim queued jobs,
+    run handler(pdf_bytes, filename, progress) and store its results.
+    Jobs survive a restart: anything left running by a dead process is
+    queued again. A running job records its worker's pid and a token for
+    that process instance, so a restarted app that gets the same pid back
+    (pid 1 in a container) still recognizes the job as orphaned.
+    """
+
+    def __init__(self, handler, directory=JOBS_DIR, workers=JOB_WORKERS,
+                 max_pending=MAX_PENDING_JOBS):
+        self.handler = handler
+        self.directory = directory
+        self.workers = workers
+        self.max_pending = max_pending
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._threads = []
+        self._orphans_checked = 0.0
+        os.makedirs(directory, exist_ok=True)
+
+        # Autocommit mode; claims use explicit BEGIN IMMEDIATE transactions
+        self._conn = sqlite3.connect(os.path.join(directory, "jobs.sqlite"),
+                                     timeout=30, check_same_thread=False,
+                                     isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id TEXT PRIMARY KEY, filename TEXT, status TEXT NOT NULL,"
+            " stage TEXT, done INTEGER, total INTEGER, pages INTEGER,"
+            " error TEXT, results BLOB, matches INTEGER, pid INTEGER,"
+            " created REAL, started REAL, finished REAL, timings TEXT,"
+            " profile TEXT, owner TEXT)")
+        # Queues created before timings / profiles / owners were recorded
+        for column in ("timings TEXT", "profile TEXT", "owner TEXT"):
+            try:
+                self._conn.execute(f"ALTER TABLE jobs ADD COLUMN {column}")
+            except sqlite3.OperationalError:
+                pass
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_status"
+                           " ON jobs (status, created)")
+
+    # ---------------- CLIENT API ----------------
+    def submit(self, pdf_bytes, filename=None, profile=False):
+        """
+        Spool a PDF and queue it. Returns the job id; raises QueueFull.
+        With profile, the handler runs under the profiler (see profile_report).
+        """
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            if self._count(QUEUED) >= self.max_pending:
+                raise QueueFull(f"{self.max_pending} jobs are already waiting")
+            with open(self._spool_path(job_id), "wb") as f:
+                f.write(pdf_bytes)
+            self._conn.execute(
+                "INSERT INTO jobs (id, filename, status, created, profile)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (job_id, filename, QUEUED, time.time(), "" if profile else None))
+            self._wakeup.notify()
+        self.start()
+        return job_id
+
+    def get(self, job_id):
+        """Job status dict, or None for an unknown job."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, filename, status, stage, done, total, pages, error,"
+                " matches, created, started, finished, timings FROM jobs"
+                " WHERE id = ?",
+                (job_id,)).fetchone()
+            position = None
+            if row is not None and row[2] == QUEUED:
+                position = self._conn.execute(
+                    "SELECT COUNT(*) FROM jobs WHERE status = ? AND created < ?",
+                    (QUEUED, row[9])).fetchone()[0]
+        if row is None:
+            return None
+        (job_id, filename, status, stage, done, total, pages, error, matches,
+         created, started, finished, timings) = row
+        return {"job_id": job_id, "filename": filename, "status": status,
+                "stage": stage, "progress": {"done": done, "total": total},
+                "pages": pages, "queue_position": position, "error": error,
+                "matches": matches, "created": created, "started": started,
+                "finished": finished,
+                "timings": json.loads(timings) if timings else None}
+
+    def results(self, job_id):
+        """Stored handler output of a finished job, or None."""
+        with self._lock:
+            row = self._conn.execute("SELECT results FROM jobs WHERE id = ?",
+                                     (job_id,)).fetchone()
+        if row is None or row[0] is None:
+            return None
+        return json.loads(zlib.decompress(row[0]))
+
+    def profile_report(self, job_id):
+        """Profiler output of a job submitted with profile=True, or None."""
+        with self._lock:
+            row = self._conn.execute("SELECT profile FROM jobs WHERE id = ?",
+                                     (job_id,)).fetchone()
+        return row[0] if row is not None and row[0] else None
+
+    def pending(self):
+        with self._lock:
+            return self._count(QUEUED)
+
+    # ---------------- WORKERS ----------------
+    def start(self):
+        """Re-queue orphaned jobs and start the worker threads (once per process)."""
+        with self._lock:
+            if self._threads:
+                return
+            self._requeue_orphans()
+            self._orphans_checked = time.monotonic()
+            self._prune()
+            for n in range(self.workers):
+                thread = threading.Thread(target=self._worker_loop, daemon=True,
+                                          name=f"job-worker-{n}")
+                thread.start()
+                self._threads.append(thread)
+        print(f"🧵 Started {self.workers} job workers")
+
+    def _worker_loop(self):
+        while True:
+            job = None
+            try:
+                job = self._claim()
+                if job is None:
+                    with self._wakeup:
+                        # Jobs of another app process that died while this one runs
+                        if time.monotonic() - self._orphans_checked > ORPHAN_CHECK_INTERVAL:
+                            self._orphans_checked = time.monotonic()
+                            self._requeue_orphans()
+                        self._wakeup.wait(POLL_INTERVAL)
+                    continue
+                self._run(*job)
+            except Exception as e:
+                # A queue error must not end the worker (or leave its job running)
+                traceback.print_exc()
+                if job is not None:
+                    self._fail(job[0], f"Error processing PDF: {str(e)}")
+                time.sleep(POLL_INTERVAL)
+
+    def _claim(self):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT id, filename, profile IS NOT NULL FROM jobs"
+                    " WHERE status = ? ORDER BY created LIMIT 1",
+                    (QUEUED,)).fetchone()
+                if row is not None:
+                    self._conn.execute(
+                        "UPDATE jobs SET status = ?, pid = ?, owner = ?, started = ?"
+                        " WHERE id = ?", (RUNNING, os.getpid(), _own_token(),
+                                          time.time(), row[0]))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return row
+
+    def _run(self, job_id, filename, profile=False):
+        print(f"📄 Job {job_id[:8]} started: {filename}")
+        started = time.perf_counter()
+        report = None
+        with metrics.collect_timings() as timings:
+            try:
+                with open(self._spool_path(job_id), "rb") as f:
+                    pdf_bytes = f.read()
+                progress = (lambda stage, done=None, total=None:
+                            self._progress(job_id, stage, done, total))
+                if profile:
+                    with metrics.profile() as report:
+                        results = self.handler(pdf_bytes, filename, progress=progress)
+                else:
+                    results = self.handler(pdf_bytes, filename, progress=progress)
+            except Exception as e:
+                traceback.print_exc()
+                results = {"status": "error", "message": f"Error processing PDF: {str(e)}"}
+
+        extra = {"timings": timings,
+                 "profile": report.report if report is not None else None}
+        if isinstance(results, dict) and results.get("status") == "error":
+            self._finish(job_id, FAILED, error=results.get("message", "Unknown error"),
+                         **extra)
+            metrics.inc("documents_total", status=FAILED)
+            print(f"❌ Job {job_id[:8]} failed: {results.get('message')}")
+        else:
+            matches = sum(1 for r in results if r.get("keywords"))
+            self._finish(job_id, DONE, results=results, matches=matches, **extra)
+            metrics.inc("documents_total", status=DONE)
+            print(f"✅ Job {job_id[:8]} done in {time.perf_counter() - started:.1f}s "
+                  f"({matches} matches)")
+
+    def _fail(self, job_id, message):
+        for attempt in range(FINISH_ATTEMPTS):
+            try:
+                self._finish(job_id, FAILED, error=message)
+                break
+            except Exception as e:
+                print(f"⚠️ Could not mark job {job_id[:8]} failed: {e}")
+                time.sleep(POLL_INTERVAL * (attempt + 1))
+        metrics.inc("documents_total", status=FAILED)
+        print(f"❌ Job {job_id[:8]} failed: {message}")
+
+    def _progress(self, job_id, stage, done, total):
+        with self._lock:
+            if stage == "extract" and total is not None:
+                self._conn.execute(
+                    "UPDATE jobs SET stage = ?, done = ?, total = ?, pages = ?"
+                    " WHERE id = ?", (stage, done, total, total, job_id))
+            else:
+                self._conn.execute(
+                    "UPDATE jobs SET stage = ?, done = ?, total = ? WHERE id = ?",
+                    (stage, done, total, job_id))
+
+    def _finish(self, job_id, status, results=None, matches=None, error=None,
+                timings=None, profile=None):
+        blob = None
+        if results is not None:
+            with metrics.span("serialize"):
+                blob = zlib.compress(json.dumps(results, ensure_ascii=False,
+                                                separators=(",", ":")).encode("utf-8"))
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, stage = ?, results = ?, matches = ?,"
+                " error = ?, finished = ?, timings = ?,"
+                " profile = COALESCE(?, profile) WHERE id = ?",
+                (status, status, blob, matches, error, time.time(),
+                 json.dumps(timings) if timings else None, profile, job_id))
+        self._remove_spool(job_id)
+
+    # ---------------- INTERNALS ----------------
+    def _spool_path(self, job_id):
+        return os.path.join(self.directory, f"{job_id}.pdf")
+
+    def _remove_spool(self, job_id):
+        try:
+            os.remove(self._spool_path(job_id))
+        except FileNotFoundError:
+            pass
+
+    def _count(self, status):
+        return self._conn.execute("SELECT COUNT(*) FROM jobs WHERE status = ?",
+                                  (status,)).fetchone()[0]
+
+    def _requeue_orphans(self):
+        """Queue again the jobs whose worker process no longer exists."""
+        for job_id, pid, owner in self._conn.execute(
+                "SELECT id, pid, owner FROM jobs WHERE status = ?", (RUNNING,)).fetchall():
+            if not _owner_alive(pid, owner):
+                self._conn.execute(
+                    "UPDATE jobs SET status = ?, stage = NULL, done = NULL,"
+                    " total = NULL, pid = NULL, owner = NULL, started = NULL"
+                    " WHERE id = ?",
+                    (QUEUED, job_id))
+                print(f"♻️ Re-queued interrupted job {job_id[:8]}")
+
+    def _prune(self):
+        cutoff = time.time() - JOB_RETENTION_SECONDS
+        expired = self._conn.execute(
+            "SELECT id FROM jobs WHERE status IN (?, ?) AND finished < ?",
+            (DONE, FAILED, cutoff)).fetchall()
+        for job_id, in expired:
+            self._remove_spool(job_id)
+        self._conn.executemany("DELETE FROM jobs WHERE id = ?", expired)
+
+
+def _process_token(pid):
+    """Boot id + start time of process pid, or None without /proc."""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            # Field 22 (starttime); the command name in field 2 may contain spaces
+            start_time = f.read().rsplit(")", 1)[1].split()[19]
+        with open("/proc/sys/kernel/random/boot_id") as f:
+            boot_id = f.read().strip()
+    except (OSError, IndexError):
+        return None
+    return f"{boot_id}:{start_time}"
+
+
+_own_tokens = {}
+
+
+def _own_token():
+    """Token of this process instance (recomputed after fork)."""
+    pid = os.getpid()
+    if pid not in _own_tokens:
+        _own_tokens[pid] = _process_token(pid) or uuid.uuid4().hex
+    return _own_tokens[pid]
+
+
+def _owner_alive(pid, owner):
+    """Is the process instance that claimed a job still running?"""
+    if not pid:
+        return False
+    if pid == os.getpid():
+        # Same pid, but possibly a previous run of the app
+        return owner is None or owner == _own_token()
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    token = _process_token(pid)
+    return owner is None or token is None or token == owner
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def _process_document(pdf_bytes, filename=None, progress=None):
+    # Imported on the first job so the web app does not load the pipeline at start-up
+    from services.pipeline import process_document
+    return process_document(pdf_bytes, filename, progress=progress)
+
+
+def get_job_queue():
+    """
+    Process-wide JobQueue running the whole-document pipeline, opened on
+    first use. Its workers start with start() (the app calls it on its
+    first request) or with the first submit.
+    """
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = JobQueue(_process_document)
+        return _queue
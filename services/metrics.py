@@ -0,0 +1,196 @@
+import contextvars
+import io
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# ---------------- CONFIG ----------------
+# Histogram buckets (seconds) for stage and page timings
+BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+           30.0, 60.0, 300.0)
+# Per-request profiling (?profile=1) runs the profiler inside request
+# handling, so it is only allowed when explicitly enabled
+PROFILING_ENABLED = os.environ.get("PROFILING_ENABLED", "0") == "1"
+PREFIX = "docintel_"
+
+HELP = {
+    "stage_seconds": "Time spent per pipeline stage",
+    "page_seconds": "Extraction time per page",
+    "ocr_pages_total": "Pages OCRed in full",
+    "ocr_regions_total": "Image regions OCRed on otherwise digital pages",
+    "cache_hits_total": "Cache hits by cache",
+    "cache_misses_total": "Cache misses by cache",
+    "sentences_encoded_total": "Sentences run through the embedding model",
+    "matches_total": "Sentences matched to at least one keyword",
+    "documents_total": "Documents processed by outcome",
+    "jobs_pending": "Jobs waiting in the queue",
+}
+
+# Metrics live per process: pages extracted in pool workers
+# (EXTRACTION_WORKERS > 1) are not counted in the app process.
+_lock = threading.Lock()
+_counters = {}        # (name, labels) -> value
+_histograms = {}      # (name, labels) -> [bucket counts..., sum, count]
+_gauges = {}          # name -> callable returning a number
+_timings = contextvars.ContextVar("docintel_timings", default=None)
+
+
+def _labels_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+# ---------------- RECORDING ----------------
+def inc(name, value=1, **labels):
+    """Add value to a counter."""
+    if not value:
+        return
+    key = (name, _labels_key(labels))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def observe(name, seconds, **labels):
+    """Record one observation in a histogram."""
+    key = (name, _labels_key(labels))
+    with _lock:
+        hist = _histograms.get(key)
+        if hist is None:
+            hist = _histograms[key] = [0] * len(BUCKETS) + [0.0, 0]
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                hist[i] += 1
+        hist[-2] += seconds
+        hist[-1] += 1
+
+
+def gauge(name, fn):
+    """Register fn() as the current value of a gauge, read at scrape time."""
+    with _lock:
+        _gauges[name] = fn
+
+
+def record(stage, seconds):
+    """
+    Record time spent in `stage`: in docintel_stage_seconds and in the
+    timing breakdown of the surrounding collect_timings(), if any.
+    """
+    observe("stage_seconds", seconds, stage=stage)
+    timings = _timings.get()
+    if timings is not None:
+        entry = timings.setdefault(stage, {"seconds": 0.0, "count": 0})
+        entry["seconds"] += seconds
+        entry["count"] += 1
+
+
+@contextmanager
+def span(stage):
+    """Time a block as `stage` (see record)."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stage, time.perf_counter() - start)
+
+
+@contextmanager
+def collect_timings():
+    """
+    Collect the spans of this thread / context into a breakdown dict
+    {stage: {"seconds", "count"}} for one request or job.
+    """
+    timings = {}
+    token = _timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _timings.reset(token)
+        for entry in timings.values():
+            entry["seconds"] = round(entry["seconds"], 4)
+
+
+# ---------------- PROFILING ----------------
+class Profile:
+    """Result of profile(): .report is the text report once the block exits."""
+    report = None
+
+
+@contextmanager
+def profile():
+    """
+    Profile a block: pyinstrument's sampling profiler when installed,
+    otherwise cProfile (top functions by cumulative time).
+    """
+    result = Profile()
+    try:
+        from pyinstrument import Profiler
+    except ImportError:
+        Profiler = None
+
+    if Profiler is not None:
+        profiler = Profiler()
+        profiler.start()
+        try:
+            yield result
+        finally:
+            profiler.stop()
+            result.report = profiler.output_text(unicode=True)
+        return
+
+    import cProfile
+    import pstats
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield result
+    finally:
+        profiler.disable()
+        out = io.StringIO()
+        pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(40)
+        result.report = out.getvalue()
+
+
+# ---------------- EXPOSITION ----------------
+def _format_labels(labels, extra=()):
+    items = list(labels) + list(extra)
+    if not items:
+        return ""
+    escaped = (k + '="' + str(v).replace("\\", "\\\\").replace('"', '\\"')
+               .replace("\n", "\\n") + '"' for k, v in items)
+    return "{" + ",".join(escaped) + "}"
+
+
+def _header(lines, name, kind, seen):
+    if name in seen:
+        return
+    seen.add(name)
+    lines.append(f"# HELP {PREFIX}{name} {HELP.get(name, name)}")
+    lines.append(f"# TYPE {PREFIX}{name} {kind}")
+
+
+def render_prometheus():
+    """All metrics of this process in the Prometheus text format."""
+    with _lock:
+        counters = sorted(_counters.items())
+        histograms = sorted((k, list(v)) for k, v in _histograms.items())
+        gauges = sorted(_gauges.items())
+
+    lines, seen = [], set()
+    for (name, labels), value in counters:
+        _header(lines, name, "counter", seen)
+        lines.append(f"{PREFIX}{name}{_format_labels(labels)} {value}")
+    for (name, labels), hist in histograms:
+        _header(lines, name, "histogram", seen)
+        for bound, count in zip(BUCKETS, hist):
+            lines.append(f"{PREFIX}{name}_bucket{_format_labels(labels, [('le', bound)])} {count}")
+        lines.append(f"{PREFIX}{name}_bucket{_format_labels(labels, [('le', '+Inf')])} {hist[-1]}")
+        lines.append(f"{PREFIX}{name}_sum{_format_labels(labels)} {hist[-2]}")
+        lines.append(f"{PREFIX}{name}_count{_format_labels(labels)} {hist[-1]}")
+    for name, fn in gauges:
+        try:
+            value = fn()
+        except Exception:
+            continue
+        _header(lines, name, "gauge", seen)
+        lines.append(f"{PREFIX}{name} {value}")
+    return "\n".join(lines) + "\n"
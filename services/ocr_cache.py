@@ -0,0 +1,94 @@
+import hashlib
+import os
+import zlib
+import numpy as np
+from paths import SAVE_PATH
+from services import metrics
+from services.sqlite_cache import SQLiteCache
+
+# ---------------- CONFIG ----------------
+CACHE_FILE = os.path.join(os.path.dirname(SAVE_PATH), "cache", "ocr.sqlite")
+CACHE_MAX_BYTES = int(os.environ.get("OCR_CACHE_MAX_BYTES",
+                                     128 * 1024 * 1024))
+CACHE_ENABLED = os.environ.get("OCR_CACHE", "1") != "0"
+
+# Integer word columns as Tesseract reports them, in pixels of the rendering
+INT_COLUMNS = ("left", "top", "width", "height", "conf",
+               "block_num", "par_num", "line_num")
+
+_cache = None
+
+
+def get_ocr_cache():
+    """Process-wide cache, or None when disabled."""
+    global _cache
+    if not CACHE_ENABLED:
+        return None
+    if _cache is None:
+        _cache = SQLiteCache(CACHE_FILE, CACHE_MAX_BYTES)
+    return _cache
+
+
+def cache_key(pix, dpi, lang, tesseract_version):
+    """Identical renderings OCR identically: hash the pixels, not the PDF."""
+    digest = hashlib.sha256()
+    digest.update(f"{pix.width}x{pix.height}x{pix.n}:{dpi}:{lang}:"
+                  f"{tesseract_version}\0".encode("utf-8"))
+    digest.update(pix.samples_mv if hasattr(pix, "samples_mv") else pix.samples)
+    return digest.hexdigest()
+
+
+def pack_words(words):
+    """
+    Word columns -> compressed blob: one int32 matrix (one row per word,
+    INT_COLUMNS order) followed by the NUL-separated word texts.
+    """
+    matrix = np.stack([np.asarray(words[c], dtype=np.int32) for c in INT_COLUMNS],
+                      axis=1).reshape(-1, len(INT_COLUMNS))
+    header = np.array([len(words["text"])], dtype=np.int32).tobytes()
+    texts = "\0".join(words["text"]).encode("utf-8")
+    return zlib.compress(header + matrix.tobytes() + texts)
+
+
+def unpack_words(blob):
+    raw = zlib.decompress(blob)
+    count = int(np.frombuffer(raw[:4], dtype=np.int32)[0])
+    end = 4 + count * len(INT_COLUMNS) * 4
+    matrix = np.frombuffer(raw[4:end], dtype=np.int32).reshape(count, len(INT_COLUMNS))
+    words = {c: matrix[:, i] for i, c in enumerate(INT_COLUMNS)}
+    words["text"] = raw[end:].decode("utf-8").split("\0") if count else []
+    return words
+
+
+def ocr_with_cache(pix, dpi, lang, tesseract_version, ocr_fn):
+    """
+    Word columns for a rendered pixmap, calling ocr_fn() (which runs
+    Tesseract) only when this exact rendering has not been OCRed before.
+    """
+    cache = get_ocr_cache()
+    if cache is None:
+        return ocr_fn()
+    key = cache_key(pix, dpi, lang, tesseract_version)
+    try:
+        blob = cache.get(key)
+    except Exception as e:
+        print(f"⚠️ OCR cache unavailable: {e}")
+        return ocr_fn()
+    if blob is not None:
+        metrics.inc("cache_hits_total", cache="ocr")
+        return unpack_words(blob)
+
+    metrics.inc("cache_misses_total", cache="ocr")
+    words = ocr_fn()
+    try:
+        cache.put(key, pack_words(words))
+    except Exception as e:
+        print(f"⚠️ Could not write OCR cache: {e}")
+    return words
+
+
+def stats():
+    """Hit/miss counters of this process."""
+    if _cache is None:
+        return {"hits": 0, "misses": 0}
+    return {"hits": _cache.hits, "misses": _cache.misses}
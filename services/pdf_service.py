@@ -1,308 +1,700 @@
+import os
 import fitz
+import numpy as np
 import nltk
 import logging
-import pytesseract
-from PIL import Image
-from bs4 import BeautifulSoup
-from typing import List, Dict, Any, Optional
+import time
+from bisect import bisect_left, bisect_right
+from typing import List, Dict, Any, Optional, Callable
 from nltk.tokenize import sent_tokenize
 from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
 from paths import TESSERACT_CMD
+from services.sentence_batch import SentenceBatch
+from services import metrics, ocr_cache
 
 # Configure logging
 logging.basicConfig(level=logging.WARNING)
 logger = logging.getLogger(__name__)
 
-pytesseract.pytesseract.tesseract_cmd = TESSERACT_CMD
+# ---------------- CONFIG ----------------
+# Number of processes used to extract pages. 1 keeps the serial path.
+EXTRACTION_WORKERS = int(os.environ.get("EXTRACTION_WORKERS", "1"))
+# Page ranges handed out per worker; several per worker keeps OCR-heavy
+# stretches of a document from landing on a single process.
+RANGES_PER_WORKER = 4
+# Bumped whenever extraction output changes, so cached extractions are redone
+EXTRACTION_VERSION = 4
+
+# ---------------- OCR CONFIG ----------------
+# OCR renders at the DPI that makes text about OCR_TARGET_TEXT_PX tall, within
+# [OCR_MIN_DPI, dpi], and never above the scan's own resolution.
+OCR_LANG = "eng"
+OCR_MIN_DPI = 150
+OCR_TARGET_TEXT_PX = 32
+OCR_DEFAULT_TEXT_PT = 10.0     # assumed text height when the page gives no hint
+# Regions whose mean word confidence is below this are retried at full dpi
+# (regions where Tesseract found no words at all are not)
+OCR_MIN_CONFIDENCE = 70.0
+# Image blocks on pages with digital text are OCRed on their own (grayscale
+# clips); smaller images (logos, icons) are skipped
+OCR_IMAGE_REGIONS = True
+OCR_MIN_REGION_PT = 36.0
+# Before OCR, an image region is probed at a low DPI: text (scanned tables,
+# letters) sits on a mostly uniform background, photos and gradients do not
+OCR_PROBE_DPI = 36
+OCR_PROBE_BACKGROUND_SHARE = 0.45   # pixels within OCR_PROBE_TOLERANCE of the median
+OCR_PROBE_MIN_INK_SHARE = 0.002     # pixels far (> 4x tolerance) from it
+OCR_PROBE_TOLERANCE = 24
+# An image already counts as text-covered (searchable scan) only with this
+# much text on top of it; page numbers and Bates stamps do not count
+OCR_COVERED_MIN_CHARS = 40
+
+
+# ---------------- NLTK DEPENDENCIES ----------------
+_nltk_ready = False
+
+
+def tokenizer_ready() -> bool:
+    return _nltk_ready
+
+
+def _ensure_nltk_dependencies() -> None:
+    """Find (or download) the punkt tokenizer data once per process."""
+    global _nltk_ready
+    if _nltk_ready:
+        return
+    _find_or_download_punkt()
+    _nltk_ready = True
+
+
+def _find_or_download_punkt() -> None:
+    try:
+        nltk.data.find('tokenizers/punkt_tab')
+    except LookupError:
+        try:
+            nltk.download('punkt_tab', quiet=True)
+        except Exception:
+            try:
+                nltk.data.find('tokenizers/punkt')
+            except LookupError:
+                nltk.download('punkt', quiet=True)
+
+
+# ---------------- HELPER FUNCS ----------------
+def _merge_bboxes(spans: List[Dict[str, Any]]) -> List[float]:
+    if not spans:
+        return [0.0, 0.0, 0.0, 0.0]
+    bboxes = [span['bbox'] for span in spans]
+    return [
+        min(bbox[0] for bbox in bboxes),
+        min(bbox[1] for bbox in bboxes),
+        max(bbox[2] for bbox in bboxes),
+        max(bbox[3] for bbox in bboxes)
+    ]
+
+
+def _should_merge_spans(current_font: Optional[str],
+                        current_size: Optional[float], new_font: str,
+                        new_size: float, last_bbox: List[float],
+                        new_bbox: List[float], max_vspace: float,
+                        max_hspace: float) -> bool:
+    if current_font is None:
+        return True
+    if new_font != current_font or new_size != current_size:
+        return False
+    vspace = new_bbox[1] - last_bbox[3]
+    hspace = new_bbox[0] - last_bbox[2]
+    return not (vspace > max_vspace and hspace > max_hspace)
+
+
+def _extract_blocks_from_page(page: fitz.Page, max_vspace: float,
+                              max_hspace: float,
+                              page_dict: Optional[Dict] = None) -> List[Dict[str, Any]]:
+    if page_dict is None:
+        page_dict = page.get_text("dict")
+    blocks = []
+    for block_data in page_dict["blocks"]:
+        if block_data["type"] != 0:
+            continue
+        current_text = ""
+        current_font = None
+        current_size = None
+        current_spans = []
+        last_bbox = [0.0, 0.0, 0.0, 0.0]
+        for line in block_data["lines"]:
+            for span_data in line["spans"]:
+                text = span_data["text"]
+                if not text or not text.strip():
+                    continue
+                font = span_data["font"]
+                size = span_data["size"]
+                bbox = [float(c) for c in span_data["bbox"]]
+                if _should_merge_spans(current_font, current_size, font,
+                                       size, last_bbox, bbox, max_vspace,
+                                       max_hspace):
+                    if current_text and not current_text.endswith(
+                            ' ') and not text.startswith(' '):
+                        current_text += " "
+                    current_text += text
+                    current_font = font
+                    current_size = size
+                    current_spans.append({"text": text, "bbox": bbox})
+                    last_bbox = bbox
+                else:
+                    if current_text.strip():
+                        blocks.append({
+                            "text": current_text.strip(),
+                            "spans": current_spans
+                        })
+                    current_text = text
+                    current_font = font
+                    current_size = size
+                    current_spans = [{"text": text, "bbox": bbox}]
+                    last_bbox = bbox
+        if current_text.strip():
+            blocks.append({
+                "text": current_text.strip(),
+                "spans": current_spans
+            })
+    return blocks
+
+
+def _index_spans(block_text: str, spans: List[Dict]) -> tuple:
+    """
+    Locate every span in the block text once, left to right.
+    Returns (starts, ends, located_spans); both offset lists are sorted
+    because each span is searched for after the end of the previous one.
+    """
+    starts, ends, located = [], [], []
+    char_pos = 0
+    for span in spans:
+        span_text = span["text"]
+        span_start_pos = block_text.find(span_text, char_pos)
+        if span_start_pos != -1:
+            span_end_pos = span_start_pos + len(span_text)
+            starts.append(span_start_pos)
+            ends.append(span_end_pos)
+            located.append(span)
+            char_pos = span_end_pos
+    return starts, ends, located
+
+
+def _map_spans_to_sentence(span_index: tuple, sentence_start: int,
+                           sentence_end: int) -> List[Dict]:
+    """Spans overlapping [sentence_start, sentence_end), found by bisection."""
+    starts, ends, located = span_index
+    first = bisect_right(ends, sentence_start)    # first span ending after the start
+    last = bisect_left(starts, sentence_end)      # spans starting before the end
+    return located[first:last]
+
+
+def _split_block_into_sentences(block: Dict[str, Any]) -> List[Dict[str, Any]]:
+    block_text = block["text"]
+    sentences = sent_tokenize(block_text)
+    span_index = _index_spans(block_text, block["spans"])
+    result_sentences = []
+    char_offset = 0
+    for sentence in sentences:
+        sentence_text = sentence.strip()
+        if not sentence_text:
+            continue
+        sentence_start = block_text.find(sentence_text, char_offset)
+        if sentence_start == -1:
+            sentence_start = char_offset
+        sentence_end = sentence_start + len(sentence_text)
+        spans_in_sentence = _map_spans_to_sentence(span_index, sentence_start,
+                                                   sentence_end)
+        if spans_in_sentence:
+            result_sentences.append({
+                "text": sentence_text,
+                "bbox": _merge_bboxes(spans_in_sentence)
+            })
+        char_offset = sentence_end
+    return result_sentences
+
+
+# ---------------- OCR HELPERS ----------------
+def ocr_bbox_pixels_to_pdf_points(x0, y0, x1, y1, dpi, page, pix, clip=None):
+    """
+    Convert OCR bbox (pixels, top-left origin) -> PDF points (bottom-left origin).
+    FIXED: Y-axis flip correction.
+    Works element-wise, so x0..y1 may be NumPy arrays of many boxes. With
+    clip, pix is a rendering of that page rectangle only.
+    """
+
+    scale = 72.0 / dpi
+    px0, py0 = x0 * scale, y0 * scale
+    px1, py1 = x1 * scale, y1 * scale
+
+    rect = page.rect if clip is None else clip
+    page_width, page_height = rect.width, rect.height
+    img_width_pts, img_height_pts = pix.width * scale, pix.height * scale
+
+    px0 = px0 * (page_width / img_width_pts)
+    px1 = px1 * (page_width / img_width_pts)
+    py0 = py0 * (page_height / img_height_pts)
+    py1 = py1 * (page_height / img_height_pts)
+
+    # Flip Y-axis to match PDF coords
+    # py0, py1 = page_height - py1, page_height - py0
+
+    if clip is not None:
+        px0, px1 = px0 + clip.x0, px1 + clip.x0
+        py0, py1 = py0 + clip.y0, py1 + clip.y0
+    return [px0, py0, px1, py1]
+
+
+_tesseract_version = None
+
+
+def _get_tesseract_version() -> str:
+    """Part of the OCR cache key; asked once per process."""
+    global _tesseract_version
+    if _tesseract_version is None:
+        import pytesseract
+        pytesseract.pytesseract.tesseract_cmd = TESSERACT_CMD
+        _tesseract_version = str(pytesseract.get_tesseract_version())
+    return _tesseract_version
+
+
+def _tesseract_words(pix: fitz.Pixmap) -> Dict[str, Any]:
+    """Word rows of Tesseract's TSV output for a grayscale pixmap, in pixels."""
+    # OCR dependencies are only imported once a page actually needs OCR
+    import pytesseract
+    from PIL import Image
+    pytesseract.pytesseract.tesseract_cmd = TESSERACT_CMD
+
+    img = Image.frombytes("L", (pix.width, pix.height), pix.samples)
+    data = pytesseract.image_to_data(img, lang=OCR_LANG,
+                                     output_type=pytesseract.Output.DICT)
+
+    # Level 5 rows are words; empty words carry no text to place
+    texts = [str(t).strip() for t in data["text"]]
+    rows = np.flatnonzero((np.asarray(data["level"]) == 5)
+                          & np.fromiter((bool(t) for t in texts), dtype=bool,
+                                        count=len(texts)))
+    words = {key: np.asarray(data[key], dtype=np.float64)[rows].astype(np.int32)
+             for key in ocr_cache.INT_COLUMNS}
+    words["text"] = [texts[i] for i in rows.tolist()]
+    return words
 
 
+def _ocr_words(page: fitz.Page, dpi: int,
+               clip: Optional[fitz.Rect] = None) -> Dict[str, Any]:
+    """
+    Run Tesseract on a grayscale rendering of the page (or of clip) and
+    return its words as columns: "text" (list), "bbox" (N x 4 float64, PDF
+    points), "conf" (0-100, -1 when unknown), and the "block", "par" and "line"
+    numbers Tesseract assigned to each word. Renderings seen before are
+    served from the OCR cache without running Tesseract.
+    """
+    mat = fitz.Matrix(dpi / 72.0, dpi / 72.0).prerotate(page.rotation)
+    with metrics.span("render"):
+        pix = page.get_pixmap(matrix=mat, clip=clip, colorspace=fitz.csGRAY,
+                              alpha=False)
+    with metrics.span("ocr"):
+        if ocr_cache.CACHE_ENABLED:
+            words = ocr_cache.ocr_with_cache(pix, dpi, OCR_LANG, _get_tesseract_version(),
+                                             lambda: _tesseract_words(pix))
+        else:
+            words = _tesseract_words(pix)
+
+    left, top, width, height = (words[key].astype(np.float64)
+                                for key in ("left", "top", "width", "height"))
+    bbox = np.stack(ocr_bbox_pixels_to_pdf_points(
+        left, top, left + width, top + height, dpi, page, pix, clip), axis=1)
+    return {"text": words["text"],
+            "bbox": bbox.reshape(-1, 4),
+            "conf": words["conf"].astype(np.float64),
+            "block": words["block_num"],
+            "par": words["par_num"],
+            "line": words["line_num"]}
+
+
+def _group_ocr_words(words: Dict[str, Any], level: str = "block") -> List[Dict[str, Any]]:
+    """
+    Join consecutive OCR words of the same block (or, with level="line",
+    the same line) into one {"text", "bbox"} entry; the bbox spans all words.
+    """
+    if not words["text"]:
+        return []
+    keys = [words["block"]]
+    if level == "line":
+        keys += [words["par"], words["line"]]
+    changed = np.zeros(len(words["text"]) - 1, dtype=bool)
+    for key in keys:
+        changed |= np.diff(key) != 0
+    starts = np.concatenate(([0], np.flatnonzero(changed) + 1))
+    bbox = words["bbox"]
+    mins = np.minimum.reduceat(bbox[:, :2], starts, axis=0).tolist()
+    maxs = np.maximum.reduceat(bbox[:, 2:], starts, axis=0).tolist()
+    bounds = starts.tolist() + [len(words["text"])]
+    return [{"text": " ".join(words["text"][lo:hi]), "bbox": lo_xy + hi_xy}
+            for lo, hi, lo_xy, hi_xy in zip(bounds[:-1], bounds[1:], mins, maxs)]
+
+
+# ---------------- ADAPTIVE OCR ----------------
+def _mean_confidence(words: Dict[str, Any]) -> float:
+    conf = words["conf"][words["conf"] >= 0]
+    return float(conf.mean()) if conf.size else 0.0
+
+
+def _choose_ocr_dpi(text_height_pt: Optional[float], native_dpi: Optional[float],
+                    max_dpi: int) -> int:
+    """DPI that renders text about OCR_TARGET_TEXT_PX tall, within bounds."""
+    dpi = OCR_TARGET_TEXT_PX * 72.0 / (text_height_pt or OCR_DEFAULT_TEXT_PT)
+    if native_dpi:
+        # Rendering above the scan's own resolution adds no detail
+        dpi = min(dpi, native_dpi)
+    return int(round(min(max(dpi, OCR_MIN_DPI), max_dpi)))
+
+
+def _ocr_region(page: fitz.Page, clip: Optional[fitz.Rect], max_dpi: int,
+                text_height_pt: Optional[float] = None,
+                native_dpi: Optional[float] = None) -> Dict[str, Any]:
+    """
+    OCR a page region at an estimated DPI; when Tesseract is unsure, retry
+    once at max_dpi and keep the more confident result.
+    """
+    dpi = _choose_ocr_dpi(text_height_pt, native_dpi, max_dpi)
+    words = _ocr_words(page, dpi, clip)
+    if not words["text"]:
+        # Nothing readable (photo, logo, blank scan): more pixels will not help
+        return words
+    confidence = _mean_confidence(words)
+    if confidence < OCR_MIN_CONFIDENCE and dpi < max_dpi:
+        retry = _ocr_words(page, max_dpi, clip)
+        retry_confidence = _mean_confidence(retry)
+        logger.info(f"OCR retry at {max_dpi} DPI: confidence "
+                    f"{confidence:.0f} -> {retry_confidence:.0f}")
+        if retry_confidence > confidence:
+            words = retry
+    return words
+
+
+def _median_font_size(page_dict: Dict) -> Optional[float]:
+    sizes = [span["size"] for block in page_dict["blocks"] if block["type"] == 0
+             for line in block["lines"] for span in line["spans"]
+             if span["text"].strip()]
+    return float(np.median(sizes)) if sizes else None
+
+
+def _looks_like_text(page: fitz.Page, clip: fitz.Rect) -> bool:
+    """
+    Cheap pre-OCR check on a low-DPI grayscale rendering: a dominant
+    background tone plus some strongly contrasting ink.
+    """
+    mat = fitz.Matrix(OCR_PROBE_DPI / 72.0, OCR_PROBE_DPI / 72.0)
+    pix = page.get_pixmap(matrix=mat, clip=clip, colorspace=fitz.csGRAY,
+                          alpha=False)
+    gray = np.frombuffer(pix.samples, dtype=np.uint8).astype(np.int16)
+    if not gray.size:
+        return False
+    distance = np.abs(gray - int(np.median(gray)))
+    background = np.count_nonzero(distance <= OCR_PROBE_TOLERANCE) / gray.size
+    ink = np.count_nonzero(distance > 4 * OCR_PROBE_TOLERANCE) / gray.size
+    return background >= OCR_PROBE_BACKGROUND_SHARE and ink >= OCR_PROBE_MIN_INK_SHARE
+
+
+def _image_regions(page: fitz.Page, page_dict: Dict,
+                   text_sentences: List[Dict[str, Any]]) -> List[tuple]:
+    """
+    (clip, native_dpi) for image blocks worth OCRing: large enough, not
+    already covered by a text layer (e.g. searchable scans), and looking
+    like text rather than a photo.
+    """
+    text_centers = np.array([[(s["bbox"][0] + s["bbox"][2]) / 2,
+                              (s["bbox"][1] + s["bbox"][3]) / 2]
+                             for s in text_sentences]).reshape(-1, 2)
+    text_chars = np.array([len(s["text"]) for s in text_sentences], dtype=np.int64)
+    regions = []
+    for block in page_dict["blocks"]:
+        if block["type"] == 0:
+            continue
+        clip = fitz.Rect(block["bbox"]) & page.rect
+        if clip.width < OCR_MIN_REGION_PT or clip.height < OCR_MIN_REGION_PT:
+            continue
+        inside = ((text_centers[:, 0] >= clip.x0) & (text_centers[:, 0] <= clip.x1)
+                  & (text_centers[:, 1] >= clip.y0) & (text_centers[:, 1] <= clip.y1))
+        if text_chars[inside].sum() >= OCR_COVERED_MIN_CHARS:
+            continue
+        if not _looks_like_text(page, clip):
+            continue
+        native_dpi = None
+        if block.get("width") and block["bbox"][2] > block["bbox"][0]:
+            native_dpi = block["width"] * 72.0 / (block["bbox"][2] - block["bbox"][0])
+        regions.append((clip, native_dpi))
+    return regions
+
+
+def _ocr_image_regions(page: fitz.Page, page_num: int, page_dict: Dict,
+                       text_sentences: List[Dict[str, Any]],
+                       max_dpi: int) -> tuple:
+    """
+    OCR the image blocks of a page. Returns (sentences, regions OCRed).
+    Digital text on the same page gives the expected text size. A region
+    that fails is logged and skipped; the page keeps its other text.
+    """
+    regions = _image_regions(page, page_dict, text_sentences)
+    if not regions:
+        return [], 0
+    print(f"⚠️ Using OCR on {len(regions)} image region(s) of page {page_num}")
+    metrics.inc("ocr_regions_total", len(regions))
+    text_height = _median_font_size(page_dict)
+    sentences = []
+    for clip, native_dpi in regions:
+        try:
+            words = _ocr_region(page, clip, max_dpi, text_height, native_dpi)
+        except Exception as e:
+            logger.warning(f"OCR failed for an image region of page {page_num}: {e}")
+            continue
+        sentences.extend(_group_ocr_words(words, level="block"))
+    return sentences, len(regions)
+
+
+def extract_ocr_lines(page: fitz.Page, dpi: int = 300) -> List[Dict[str, Any]]:
+    """Line-level OCR output: one {"text", "bbox"} per Tesseract text line."""
+    return _group_ocr_words(_ocr_region(page, None, dpi), level="line")
+
+
+def _extract_with_ocr(page: fitz.Page, page_num: int,
+                      dpi: int) -> List[Dict[str, Any]]:
+    print(f"⚠️ Using OCR (word-level, block-scoped) for page {page_num}")
+    metrics.inc("ocr_pages_total")
+    # One "sentence" per OCR block, as before
+    return _group_ocr_words(_ocr_region(page, None, dpi), level="block")
+
+
+# ---------------- FILTER HEADERS/FOOTERS ----------------
+def _filter_headers_and_footers(sentences, page_height, freq_map,
+                                top_thresh=0.12, bottom_thresh=0.08,
+                                min_repeats=3):
+    filtered = []
+    for sent in sentences:
+        y0 = sent["bbox"][1]
+        y1 = sent["bbox"][3]
+        norm_y0 = y0 / page_height
+        norm_y1 = y1 / page_height
+        text = sent["text"].strip()
+        repeats = freq_map.get(text, 0)
+
+        if repeats >= min_repeats and (norm_y1 < top_thresh or norm_y0 > (1 - bottom_thresh)):
+            continue
+
+        if (norm_y1 < top_thresh or norm_y0 > (1 - bottom_thresh)):
+            if (text.isupper() and ("\t" in text or "  " in text or len(text.split()) > 6)):
+                continue
+
+        filtered.append(sent)
+    return filtered
+
+
+# ---------------- PAGE EXTRACTION ----------------
+def _open_document(pdf_path) -> fitz.Document:
+    if isinstance(pdf_path, (bytes, bytearray)):
+        return fitz.open(stream=pdf_path, filetype="pdf")
+    return fitz.open(pdf_path)
+
+
+def _iter_page_range(doc: fitz.Document, start: int, stop: int,
+                     max_vspace: float, max_hspace: float, dpi: int):
+    """
+    Yield raw (unfiltered) sentences for pages [start, stop) of an open
+    document, one page at a time. Pages that fail are logged and left out;
+    an OCR failure on a page with digital text only loses the OCR part.
+    """
+    ocr_before = ocr_cache.stats()
+    for page_number in range(start, stop):
+        page_start = time.perf_counter()
+        try:
+            page = doc.load_page(page_number)
+            page_dict = page.get_text("dict")
+            blocks = _extract_blocks_from_page(page, max_vspace, max_hspace,
+                                               page_dict)
+            page_sentences = []
+            with metrics.span("tokenize"):
+                for block in blocks:
+                    page_sentences.extend(_split_block_into_sentences(block))
+            regions = 0
+            if OCR_IMAGE_REGIONS:
+                # Scanned tables/figures inside otherwise digital pages
+                try:
+                    ocr_sentences, regions = _ocr_image_regions(
+                        page, page_number + 1, page_dict, page_sentences, dpi)
+                    page_sentences.extend(ocr_sentences)
+                except Exception as e:
+                    logger.warning(f"Image region OCR failed on page {page_number + 1}: {e}")
+            if not page_sentences and not regions:
+                try:
+                    page_sentences = _extract_with_ocr(page, page_number + 1, dpi)
+                except Exception as e:
+                    logger.warning(f"OCR failed on page {page_number + 1}: {e}")
+                    continue
+            metrics.observe("page_seconds", time.perf_counter() - page_start)
+            yield {
+                "page_num": page_number + 1,
+                "sentences": page_sentences
+            }
+        except Exception as e:
+            logger.warning(f"Error processing page {page_number + 1}: {e}")
+            continue
+    ocr_after = ocr_cache.stats()
+    hits = ocr_after["hits"] - ocr_before["hits"]
+    misses = ocr_after["misses"] - ocr_before["misses"]
+    if hits or misses:
+        print(f"🗄️ OCR cache (pages {start + 1}-{stop}): {hits} hits, "
+              f"{misses} misses")
+
+
+def _extract_page_range(doc: fitz.Document, start: int, stop: int,
+                        max_vspace: float, max_hspace: float,
+                        dpi: int) -> List[Dict[str, Any]]:
+    return list(_iter_page_range(doc, start, stop, max_vspace, max_hspace,
+                                 dpi))
+
+
+# Per-process state for pool workers: each worker opens its own document
+# once from the shared bytes and then serves page ranges from it.
+_worker_doc = None
+_worker_options = None
+
+
+def _init_extraction_worker(pdf_path, max_vspace: float, max_hspace: float,
+                            dpi: int) -> None:
+    global _worker_doc, _worker_options
+    _ensure_nltk_dependencies()
+    _worker_doc = _open_document(pdf_path)
+    _worker_options = (max_vspace, max_hspace, dpi)
+
+
+def _extract_page_range_in_worker(start: int, stop: int) -> List[Dict[str, Any]]:
+    return _extract_page_range(_worker_doc, start, stop, *_worker_options)
+
+
+def _split_page_ranges(page_count: int, workers: int) -> List[tuple]:
+    chunk = max(1, -(-page_count // (workers * RANGES_PER_WORKER)))
+    return [(start, min(start + chunk, page_count))
+            for start in range(0, page_count, chunk)]
+
+
+def _iter_pages_parallel(pdf_path, page_count: int, workers: int,
+                         max_vspace: float, max_hspace: float, dpi: int):
+    ranges = _split_page_ranges(page_count, workers)
+    with ProcessPoolExecutor(max_workers=min(workers, len(ranges)),
+                             initializer=_init_extraction_worker,
+                             initargs=(pdf_path, max_vspace, max_hspace,
+                                       dpi)) as pool:
+        futures = [pool.submit(_extract_page_range_in_worker, start, stop)
+                   for start, stop in ranges]
+        # Futures are collected in submission order, so pages come back
+        # in document order regardless of which worker finished first.
+        for future in futures:
+            yield from future.result()
+
+
+def _iter_raw_pages(doc: fitz.Document, pdf_path, workers: int,
+                    max_vspace: float, max_hspace: float, dpi: int):
+    page_count = len(doc)
+    if workers > 1 and page_count > 1:
+        return _iter_pages_parallel(pdf_path, page_count, workers,
+                                    max_vspace, max_hspace, dpi)
+    return _iter_page_range(doc, 0, page_count, max_vspace, max_hspace, dpi)
+
+
+# ---------------- MAIN ----------------
 def extract_pdf_sentences_with_ocr_fallback(
         pdf_path: str,
         max_vspace: float = 10.0,
         max_hspace: float = 20.0,
-        dpi: int = 300) -> List[Dict[str, Any]]:
+        dpi: int = 300,
+        workers: Optional[int] = None,
+        as_batch: bool = False,
+        on_page: Optional[Callable[[int, int], None]] = None):
     """
     Extract text from PDF into sentences with bounding boxes.
     Uses OCR fallback when no text is found.
     Removes repeated headers/footers and structural headers.
+    With workers > 1, page ranges are extracted in a process pool and merged
+    back in page order; the output is identical to the serial path.
+    Returns a list of {"page_num", "sentences"} pages, or a SentenceBatch
+    when as_batch is set. on_page(pages_done, page_count) is called as each
+    page finishes extraction.
     """
+    if workers is None:
+        workers = EXTRACTION_WORKERS
 
-    # ---------------- NLTK DEPENDENCIES ----------------
-    def _ensure_nltk_dependencies() -> None:
-        try:
-            nltk.data.find('tokenizers/punkt_tab')
-        except LookupError:
-            try:
-                nltk.download('punkt_tab', quiet=True)
-            except Exception:
-                try:
-                    nltk.data.find('tokenizers/punkt')
-                except LookupError:
-                    nltk.download('punkt', quiet=True)
-
-    # ---------------- HELPER FUNCS ----------------
-    def _merge_bboxes(spans: List[Dict[str, Any]]) -> List[float]:
-        if not spans:
-            return [0.0, 0.0, 0.0, 0.0]
-        bboxes = [span['bbox'] for span in spans]
-        return [
-            min(bbox[0] for bbox in bboxes),
-            min(bbox[1] for bbox in bboxes),
-            max(bbox[2] for bbox in bboxes),
-            max(bbox[3] for bbox in bboxes)
-        ]
-
-    def _should_merge_spans(current_font: Optional[str],
-                            current_size: Optional[float], new_font: str,
-                            new_size: float, last_bbox: List[float],
-                            new_bbox: List[float]) -> bool:
-        if current_font is None:
-            return True
-        if new_font != current_font or new_size != current_size:
-            return False
-        vspace = new_bbox[1] - last_bbox[3]
-        hspace = new_bbox[0] - last_bbox[2]
-        return not (vspace > max_vspace and hspace > max_hspace)
-
-    def _extract_blocks_from_page(page: fitz.Page) -> List[Dict[str, Any]]:
-        page_dict = page.get_text("dict")
-        blocks = []
-        for block_data in page_dict["blocks"]:
-            if block_data["type"] != 0:
-                continue
-            current_text = ""
-            current_font = None
-            current_size = None
-            current_spans = []
-            last_bbox = [0.0, 0.0, 0.0, 0.0]
-            for line in block_data["lines"]:
-                for span_data in line["spans"]:
-                    text = span_data["text"]
-                    if not text or not text.strip():
-                        continue
-                    font = span_data["font"]
-                    size = span_data["size"]
-                    bbox = [float(c) for c in span_data["bbox"]]
-                    if _should_merge_spans(current_font, current_size, font,
-                                           size, last_bbox, bbox):
-                        if current_text and not current_text.endswith(
-                                ' ') and not text.startswith(' '):
-                            current_text += " "
-                        current_text += text
-                        current_font = font
-                        current_size = size
-                        current_spans.append({"text": text, "bbox": bbox})
-                        last_bbox = bbox
-                    else:
-                        if current_text.strip():
-                            blocks.append({
-                                "text": current_text.strip(),
-                                "spans": current_spans
-                            })
-                        current_text = text
-                        current_font = font
-                        current_size = size
-                        current_spans = [{"text": text, "bbox": bbox}]
-                        last_bbox = bbox
-            if current_text.strip():
-                blocks.append({
-                    "text": current_text.strip(),
-                    "spans": current_spans
-                })
-        return blocks
-
-    def _map_spans_to_sentence(block_text: str, sentence_text: str,
-                               sentence_start: int,
-                               spans: List[Dict]) -> List[Dict]:
-        sentence_end = sentence_start + len(sentence_text)
-        overlapping_spans = []
-        char_pos = 0
-        span_positions = []
-        for span in spans:
-            span_text = span["text"]
-            span_start_pos = block_text.find(span_text, char_pos)
-            if span_start_pos != -1:
-                span_end_pos = span_start_pos + len(span_text)
-                span_positions.append({
-                    "span": span,
-                    "start": span_start_pos,
-                    "end": span_end_pos
-                })
-                char_pos = span_end_pos
-        for span_info in span_positions:
-            if (span_info["end"] > sentence_start
-                    and span_info["start"] < sentence_end):
-                overlapping_spans.append(span_info["span"])
-        return overlapping_spans
-
-    def _split_block_into_sentences(block: Dict[str, Any]) -> List[Dict[str, Any]]:
-        block_text = block["text"]
-        sentences = sent_tokenize(block_text)
-        result_sentences = []
-        char_offset = 0
-        for sentence in sentences:
-            sentence_text = sentence.strip()
-            if not sentence_text:
-                continue
-            sentence_start = block_text.find(sentence_text, char_offset)
-            if sentence_start == -1:
-                sentence_start = char_offset
-            spans_in_sentence = _map_spans_to_sentence(block_text,
-                                                       sentence_text,
-                                                       sentence_start,
-                                                       block["spans"])
-            if spans_in_sentence:
-                result_sentences.append({
-                    "text": sentence_text,
-                    "bbox": _merge_bboxes(spans_in_sentence)
-                })
-            char_offset = sentence_start + len(sentence_text)
-        return result_sentences
-
-    # ---------------- OCR HELPERS ----------------
-    def parse_bbox_number(s):
-        return int(''.join(filter(str.isdigit, s)))
-
-    def ocr_bbox_pixels_to_pdf_points(x0, y0, x1, y1, dpi, page, pix):
-        """
-        Convert OCR bbox (pixels, top-left origin) -> PDF points (bottom-left origin).
-        FIXED: Y-axis flip correction.
-        """
-      
-        scale = 72.0 / dpi
-        px0, py0 = x0 * scale, y0 * scale
-        px1, py1 = x1 * scale, y1 * scale
-
-       
-        page_width, page_height = page.rect.width, page.rect.height
-        img_width_pts, img_height_pts = pix.width * scale, pix.height * scale
-
-        px0 = px0 * (page_width / img_width_pts)
-        px1 = px1 * (page_width / img_width_pts)
-        py0 = py0 * (page_height / img_height_pts)
-        py1 = py1 * (page_height / img_height_pts)
-
-        # Flip Y-axis to match PDF coords
-        # py0, py1 = page_height - py1, page_height - py0
-
-        return [px0, py0, px1, py1]
-
-    def words_to_sentences_inside_block(block_words):
-        if not block_words:
-            return []
-        text = " ".join(word["text"] for word in block_words)
-        min_x0 = min(word["bbox"][0] for word in block_words)
-        min_y0 = min(word["bbox"][1] for word in block_words)
-        max_x1 = max(word["bbox"][2] for word in block_words)
-        max_y1 = max(word["bbox"][3] for word in block_words)
-        return [{"text": text, "bbox": [min_x0, min_y0, max_x1, max_y1]}]
-
-    def _extract_with_ocr(page: fitz.Page, page_num: int) -> List[Dict[str, Any]]:
-        page_sentences = []
-        print(f"⚠️ Using OCR (word-level, block-scoped) for page {page_num}")
-        mat = fitz.Matrix(dpi / 72.0, dpi / 72.0).prerotate(page.rotation)
-        pix = page.get_pixmap(matrix=mat, alpha=False)
-        img = Image.frombytes("RGB", (pix.width, pix.height), pix.samples)
-
-        hocr_bytes = pytesseract.image_to_pdf_or_hocr(img,
-                                                      extension="hocr",
-                                                      lang="eng")
-        soup = BeautifulSoup(hocr_bytes, "html.parser")
-
-        ocr_blocks = soup.find_all("div", class_="ocr_carea")
-        if not ocr_blocks:
-            ocr_blocks = soup.find_all("p", class_="ocr_par")
-
-        for blk in ocr_blocks:
-            title = blk.get("title", "")
-            if "bbox" not in title:
-                continue
-            bbox_part = title.split(";")[0]
-            _, x0s, y0s, x1s, y1s = bbox_part.split()
-            bx0, by0, bx1, by1 = map(parse_bbox_number,
-                                     (x0s, y0s, x1s, y1s))
-
-            block_words = []
-            for wspan in blk.find_all("span", class_="ocrx_word"):
-                wtxt = wspan.get_text(strip=True)
-                if not wtxt:
-                    continue
-                wtitle = wspan.get("title", "")
-                if "bbox" not in wtitle:
-                    continue
-                _, wx0s, wy0s, wx1s, wy1s, *_ = wtitle.split()
-                wx0, wy0, wx1, wy1 = map(parse_bbox_number,
-                                         (wx0s, wy0s, wx1s, wy1s))
-                fx0, fy0, fx1, fy1 = ocr_bbox_pixels_to_pdf_points(
-                    wx0, wy0, wx1, wy1, dpi, page, pix)
-                block_words.append({
-                    "text": wtxt,
-                    "bbox": [fx0, fy0, fx1, fy1]
-                })
-
-            if block_words:
-                page_sentences.extend(
-                    words_to_sentences_inside_block(block_words))
-        return page_sentences
-
-    # ---------------- FILTER HEADERS/FOOTERS ----------------
-    def _filter_headers_and_footers(sentences, page_height, freq_map,
-                                    top_thresh=0.12, bottom_thresh=0.08,
-                                    min_repeats=3):
-        filtered = []
-        for sent in sentences:
-            y0 = sent["bbox"][1]
-            y1 = sent["bbox"][3]
-            norm_y0 = y0 / page_height
-            norm_y1 = y1 / page_height
-            text = sent["text"].strip()
-            repeats = freq_map.get(text, 0)
-
-            if repeats >= min_repeats and (norm_y1 < top_thresh or norm_y0 > (1 - bottom_thresh)):
-                continue
-
-            if (norm_y1 < top_thresh or norm_y0 > (1 - bottom_thresh)):
-                if (text.isupper() and ("\t" in text or "  " in text or len(text.split()) > 6)):
-                    continue
-
-            filtered.append(sent)
-        return filtered
-
-    # ---------------- MAIN ----------------
     try:
         _ensure_nltk_dependencies()
-        doc = fitz.open(stream=pdf_path, filetype="pdf") if isinstance(pdf_path, (bytes, bytearray)) else fitz.open(pdf_path)
+        doc = _open_document(pdf_path)
+        page_count = len(doc)
         raw_output = []
-        for page_number in range(len(doc)):
-            try:
-                page = doc.load_page(page_number)
-                blocks = _extract_blocks_from_page(page)
-                page_sentences = []
-                for block in blocks:
-                    page_sentences.extend(_split_block_into_sentences(block))
-                if not page_sentences:
-                    page_sentences = _extract_with_ocr(page, page_number + 1)
-                raw_output.append({
-                    "page_num": page_number + 1,
-                    "sentences": page_sentences
-                })
-            except Exception as e:
-                logger.warning(f"Error processing page {page_number + 1}: {e}")
-                continue
+        for page in _iter_raw_pages(doc, pdf_path, workers, max_vspace,
+                                    max_hspace, dpi):
+            raw_output.append((page, doc[page["page_num"] - 1].rect.height))
+            if on_page is not None:
+                on_page(len(raw_output), page_count)
+
+        output = clean_pages(raw_output)
+
+        doc.close()
+        return SentenceBatch.from_pages(output) if as_batch else output
+    except Exception as e:
+        logger.error(f"Failed to process PDF: {e}")
+        return SentenceBatch.empty() if as_batch else []
+
+
+def clean_pages(raw_pages, min_repeats: int = 3):
+    """
+    Whole-document header/footer removal over (page, page_height) pairs of
+    raw extracted pages. Returns the extract_pdf_sentences_with_ocr_fallback
+    page list.
+    """
+    freq_map = Counter(s["text"] for page, _ in raw_pages for s in page["sentences"])
+    output = []
+    for page, page_height in raw_pages:
+        cleaned = _filter_headers_and_footers(page["sentences"], page_height, freq_map,
+                                              min_repeats=min_repeats)
+        if cleaned:
+            output.append({"page_num": page["page_num"], "sentences": cleaned})
+    return output
 
-        all_texts = [s["text"] for page in raw_output for s in page["sentences"]]
-        freq_map = Counter(all_texts)
 
+def iter_pdf_pages(
+        pdf_path: str,
+        max_vspace: float = 10.0,
+        max_hspace: float = 20.0,
+        dpi: int = 300,
+        workers: Optional[int] = None,
+        min_repeats: int = 3,
+        raw_pages: Optional[list] = None):
+    """
+    Streaming variant of extract_pdf_sentences_with_ocr_fallback.
+    Yields {"page_num", "sentences"} as soon as each page is extracted.
+    Repeated headers/footers are detected with a running count, so the
+    first (min_repeats - 1) occurrences of a repeated header can still be
+    emitted before it is recognised; structural headers are always removed.
+    When raw_pages is a list, (page, page_height) is appended to it for
+    every raw page, so clean_pages(raw_pages) gives the whole-document
+    extraction once the stream is consumed.
+    """
+    if workers is None:
+        workers = EXTRACTION_WORKERS
 
-        output = []
-        for page in raw_output:
+    _ensure_nltk_dependencies()
+    doc = _open_document(pdf_path)
+    try:
+        freq_map = Counter()
+        for page in _iter_raw_pages(doc, pdf_path, workers, max_vspace,
+                                    max_hspace, dpi):
+            freq_map.update(s["text"] for s in page["sentences"])
             page_height = doc[page["page_num"] - 1].rect.height
-            cleaned = _filter_headers_and_footers(page["sentences"], page_height, freq_map)
+            if raw_pages is not None:
+                raw_pages.append((page, page_height))
+            cleaned = _filter_headers_and_footers(page["sentences"],
+                                                  page_height, freq_map,
+                                                  min_repeats=min_repeats)
             if cleaned:
-                output.append({"page_num": page["page_num"], "sentences": cleaned})
-
+                yield {"page_num": page["page_num"], "sentences": cleaned}
+    finally:
         doc.close()
-        return output
-    except Exception as e:
-        logger.error(f"Failed to process PDF: {e}")
-        return []
@@ -0,0 +1,83 @@
+import gzip
+import json
+import logging
+import os
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# A single writer thread keeps artifact writes ordered and off the request
+# thread; pending writes are flushed at interpreter exit.
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="persist")
+
+
+def _log_failure(future):
+    exc = future.exception()
+    if exc is not None:
+        logger.error(f"Background write failed: {exc}")
+
+
+def persist_async(fn, *args, **kwargs):
+    """Run a write function on the background writer thread."""
+    future = _executor.submit(fn, *args, **kwargs)
+    future.add_done_callback(_log_failure)
+    return future
+
+
+def _replace_atomically(path, write):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        write(f)
+    os.replace(tmp_path, path)
+
+
+# ---------------- JSON ----------------
+def write_json(path, data, indent=None):
+    def _write(f):
+        f.write(json.dumps(data, ensure_ascii=False, indent=indent,
+                           separators=None if indent else (",", ":")).encode("utf-8"))
+    _replace_atomically(path, _write)
+
+
+def write_json_gz(path, data):
+    """Compact JSON, gzip-compressed; for bulk per-document outputs."""
+    def _write(f):
+        with gzip.GzipFile(fileobj=f, mode="wb", mtime=0) as gz:
+            gz.write(json.dumps(data, ensure_ascii=False,
+                                separators=(",", ":")).encode("utf-8"))
+    _replace_atomically(path, _write)
+
+
+# ---------------- SENTENCE ARTIFACT ----------------
+def save_sentence_artifact(path, texts, page_nums, bboxes, embeddings):
+    """
+    Columnar .npz: float32 embedding matrix (N x D), int32 page numbers,
+    float64 N x 4 bboxes, and texts as one UTF-8 buffer plus N+1 offsets.
+    """
+    encoded = [t.encode("utf-8") for t in texts]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    if encoded:
+        offsets[1:] = np.cumsum([len(b) for b in encoded])
+    text_data = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+
+    def _write(f):
+        np.savez(f,
+                 embeddings=np.asarray(embeddings, dtype=np.float32),
+                 page_nums=np.asarray(page_nums, dtype=np.int32),
+                 bboxes=np.asarray(bboxes, dtype=np.float64).reshape(-1, 4),
+                 text_data=text_data,
+                 text_offsets=offsets)
+    _replace_atomically(path, _write)
+
+
+def load_sentence_artifact(path):
+    """Inverse of save_sentence_artifact: returns a dict of arrays plus "texts"."""
+    with np.load(path) as data:
+        arrays = {name: data[name] for name in data.files}
+    raw = arrays.pop("text_data").tobytes()
+    offsets = arrays.pop("text_offsets")
+    arrays["texts"] = [raw[offsets[i]:offsets[i + 1]].decode("utf-8")
+                       for i in range(len(offsets) - 1)]
+    return arrays
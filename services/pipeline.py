@@ -0,0 +1,244 @@
+import numpy as np
+from services import metrics, result_cache
+from services.pdf_service import (EXTRACTION_VERSION, clean_pages, iter_pdf_pages,
+                                  extract_pdf_sentences_with_ocr_fallback)
+from create_embeddings.create_embeddings_sentences import (create_embeddings,
+                                                           encode_texts,
+                                                           iter_embeddings)
+from create_embeddings.encoder import current_model_id
+from services.sentence_batch import SentenceBatch
+from services.persistence import persist_async
+from semantic_search.vector_index import get_vector_index
+from semantic_search.prefilter import get_prefilter
+from semantic_search.semantic_search import (load_keyword_embeddings,
+                                             match_sentences,
+                                             run_semantic_search,
+                                             search_settings)
+
+# Extraction parameters are part of the extraction cache key
+EXTRACTION_OPTIONS = {"max_vspace": 10.0, "max_hspace": 20.0, "dpi": 300}
+# Add every processed document to the corpus-wide vector index
+INDEX_DOCUMENTS = True
+# Write the last run's embeddings/results files under SAVE_PATH
+WRITE_ARTIFACTS = True
+
+
+def _index_document(doc_hash, batch, name):
+    """Queue a document's sentence embeddings for the corpus index."""
+    if INDEX_DOCUMENTS and len(batch):
+        persist_async(_add_to_index, doc_hash, batch, name, current_model_id())
+
+
+def _add_to_index(doc_hash, batch, name, model):
+    index = get_vector_index()
+    if index.model() not in (None, model):
+        # The encoder changed since the corpus was indexed
+        index.reindex(encode_texts, model)
+    index.add_document(doc_hash, batch, name, model=model)
+
+
+def reindex_search_index(model):
+    """Re-encode the corpus index for model on the background writer thread."""
+    return persist_async(get_vector_index().reindex, encode_texts, model)
+
+
+def _search_cache_key(doc_hash, keyword_store):
+    prefilter = get_prefilter(keyword_store)
+    return result_cache.search_key(doc_hash, keyword_store.fingerprint,
+                                   current_model_id(), search_settings(),
+                                   prefilter.settings() if prefilter else None)
+
+
+def _prefilter_batch(batch, keyword_store):
+    """Drop sentences that cannot match the vocabulary before encoding."""
+    prefilter = get_prefilter(keyword_store)
+    if prefilter is None or not len(batch):
+        return batch
+    keep = prefilter.candidate_mask(batch.texts)
+    print(f"🧹 Prefilter: encoding {int(keep.sum())} of {len(batch)} sentences")
+    return batch.select(keep)
+
+
+def _prefilter_pages(pages, keyword_store, counts):
+    """
+    Streaming form of _prefilter_batch, page by page. counts["extracted"]
+    tracks sentences seen before filtering.
+    """
+    prefilter = get_prefilter(keyword_store)
+    for page in pages:
+        sentences = page.get("sentences", []) or []
+        counts["extracted"] += len(sentences)
+        if prefilter is not None:
+            keep = prefilter.candidate_mask([s.get("text", "") or "" for s in sentences])
+            page = dict(page, sentences=[s for s, k in zip(sentences, keep.tolist()) if k])
+        yield page
+
+
+def _no_progress(stage, done=None, total=None):
+    pass
+
+
+def process_document(pdf_bytes, filename=None, progress=None):
+    """
+    Whole-document extraction -> embedding -> search.
+    Identical PDF bytes reuse cached search results; when only the
+    vocabulary or thresholds changed, the cached extraction is reused and
+    just embedding + search run again.
+    progress(stage, done, total) is called when a stage starts and, during
+    extraction, after every page.
+    Returns the run_semantic_search output (results list or error dict).
+    """
+    progress = progress or _no_progress
+    keyword_store = load_keyword_embeddings()
+    if isinstance(keyword_store, dict):
+        return keyword_store
+
+    doc_hash = result_cache.pdf_hash(pdf_bytes)
+    search_key = _search_cache_key(doc_hash, keyword_store)
+    cached_results = result_cache.get(search_key)
+    if cached_results is not None:
+        print(f"⚡ Result cache hit for {doc_hash[:12]}")
+        return cached_results
+
+    progress("extract")
+    extraction_key = result_cache.extraction_key(
+        doc_hash, version=EXTRACTION_VERSION, **EXTRACTION_OPTIONS)
+    extracted_sentences = result_cache.get(extraction_key)
+    if extracted_sentences is not None:
+        print(f"⚡ Extraction cache hit for {doc_hash[:12]}")
+    else:
+        with metrics.span("extract"):
+            extracted_sentences = extract_pdf_sentences_with_ocr_fallback(
+                pdf_bytes, on_page=lambda done, total: progress("extract", done, total),
+                **EXTRACTION_OPTIONS)
+        if extracted_sentences:
+            result_cache.put(extraction_key, extracted_sentences)
+
+    if not extracted_sentences:
+        print("⚠️ No sentences extracted from PDF")
+        return {"status": "error", "message": "No text could be extracted from the PDF"}
+
+    print(f"✅ Extracted {len(extracted_sentences)} pages")
+    total_sentences = sum(len(page.get('sentences', [])) for page in extracted_sentences)
+    print(f"✅ Total sentences: {total_sentences}")
+
+    batch = _prefilter_batch(SentenceBatch.from_pages(extracted_sentences),
+                             keyword_store)
+    if total_sentences and not len(batch):
+        # Text was extracted, none of it can match
+        result_cache.put(search_key, [])
+        return []
+    print("🔄 Creating embeddings...")
+    progress("embed", 0, len(batch))
+    with metrics.span("embed"):
+        embeddings_result = create_embeddings(batch, persist=WRITE_ARTIFACTS)
+
+    if not embeddings_result:
+        print("⚠️ No embeddings created")
+        return {"status": "error", "message": "Failed to create embeddings"}
+
+    print(f"✅ Created {len(embeddings_result)} embeddings")
+    _index_document(doc_hash, embeddings_result, filename)
+
+    print("🔍 Running semantic search...")
+    progress("search")
+    with metrics.span("search"):
+        search_results = run_semantic_search(embeddings_result,
+                                             persist=WRITE_ARTIFACTS)
+    if not (isinstance(search_results, dict) and search_results.get("status") == "error"):
+        result_cache.put(search_key, search_results)
+    return search_results
+
+
+def stream_pipeline(pdf_bytes, filename=None):
+    """
+    Page-at-a-time extraction -> embedding -> search.
+    Yields event dicts as results become available:
+        {"event": "page", "page_num": ..., "sentences": n, "results": [...]}
+        {"event": "error", "message": ...}
+        {"event": "done", "pages": ..., "sentences": ..., "matches": ...}
+    """
+    keyword_store = load_keyword_embeddings()
+    if isinstance(keyword_store, dict):
+        yield {"event": "error", "message": keyword_store.get("message", "Unknown error during semantic search")}
+        return
+
+    doc_hash = result_cache.pdf_hash(pdf_bytes)
+    search_key = _search_cache_key(doc_hash, keyword_store)
+    cached_results = result_cache.get(search_key)
+    if cached_results is not None:
+        yield from _replay_cached_results(cached_results)
+        return
+
+    total_pages = 0
+    total_sentences = 0
+    total_matches = 0
+    indexed_batches = []
+    all_results = []
+    complete = True
+    counts = {"extracted": 0}
+    raw_pages = []
+    pages = _prefilter_pages(iter_pdf_pages(pdf_bytes, raw_pages=raw_pages,
+                                            **EXTRACTION_OPTIONS),
+                             keyword_store, counts)
+    for page_num, batch in iter_embeddings(pages):
+        valid = batch.valid_mask()
+        complete = complete and bool(valid.all())
+        valid_batch = batch.select(valid)
+        indexed_batches.append(valid_batch)
+        results = match_sentences(valid_batch, keyword_store)
+        all_results.extend(results)
+        total_pages += 1
+        total_sentences += len(batch)
+        total_matches += len(results)
+        yield {"event": "page", "page_num": page_num,
+               "sentences": len(batch), "results": results}
+
+    if not counts["extracted"]:
+        yield {"event": "error", "message": "No text could be extracted from the PDF"}
+        return
+
+    # Cache and index what process_document would produce: the whole-document
+    # header/footer pass can drop a few sentences the running one kept
+    extracted_sentences = clean_pages(raw_pages)
+    kept = _sentence_keys(extracted_sentences)
+    indexed = SentenceBatch.concat(indexed_batches)
+    indexed = indexed.select(np.fromiter(
+        ((page_num, text, tuple(bbox)) in kept for text, page_num, bbox in
+         zip(indexed.texts, indexed.page_nums.tolist(), indexed.bboxes.tolist())),
+        dtype=bool, count=len(indexed)))
+    if extracted_sentences:
+        result_cache.put(result_cache.extraction_key(
+            doc_hash, version=EXTRACTION_VERSION, **EXTRACTION_OPTIONS), extracted_sentences)
+        if complete:
+            # Sentences that failed to encode would be missing from the results
+            result_cache.put(search_key, [
+                r for r in all_results
+                if (r["page_num"], r["sentence"], tuple(r["bbox"])) in kept])
+
+    _index_document(doc_hash, indexed, filename)
+    yield {"event": "done", "pages": total_pages,
+           "sentences": total_sentences, "matches": total_matches}
+
+
+def _sentence_keys(pages):
+    """(page_num, text, bbox) of every sentence in pdf_service page output."""
+    return {(page["page_num"], s["text"], tuple(s["bbox"]))
+            for page in pages for s in page.get("sentences", [])}
+
+
+def _replay_cached_results(results):
+    """
+    Emit cached whole-document results as per-page events. Only matched
+    sentences are cached, so sentence counts cover those alone.
+    """
+    by_page = {}
+    for r in results:
+        if r.get("keywords"):
+            by_page.setdefault(r["page_num"], []).append(r)
+    for page_num in sorted(by_page):
+        yield {"event": "page", "page_num": page_num,
+               "sentences": len(by_page[page_num]), "results": by_page[page_num]}
+    yield {"event": "done", "pages": len(by_page),
+           "sentences": len(results), "matches": sum(len(v) for v in by_page.values()),
+           "cached": True}
@@ -0,0 +1,75 @@
+import hashlib
+import json
+import os
+import zlib
+from paths import SAVE_PATH
+from services import metrics
+from services.sqlite_cache import SQLiteCache
+
+# ---------------- CONFIG ----------------
+CACHE_FILE = os.path.join(os.path.dirname(SAVE_PATH), "cache", "results.sqlite")
+CACHE_MAX_BYTES = int(os.environ.get("RESULT_CACHE_MAX_BYTES",
+                                     256 * 1024 * 1024))
+CACHE_ENABLED = os.environ.get("RESULT_CACHE", "1") != "0"
+# Part of every search key: bump when the format of stored results changes
+# (2: bboxes no longer rounded through float32)
+RESULTS_VERSION = 2
+
+_cache = None
+
+
+def _get_cache():
+    global _cache
+    if _cache is None:
+        _cache = SQLiteCache(CACHE_FILE, CACHE_MAX_BYTES)
+    return _cache
+
+
+def pdf_hash(pdf_bytes):
+    return hashlib.sha256(pdf_bytes).hexdigest()
+
+
+def extraction_key(doc_hash, **params):
+    """Extraction output depends only on the PDF bytes and extraction params."""
+    options = ",".join(f"{k}={params[k]}" for k in sorted(params))
+    return f"extract:{doc_hash}:{options}"
+
+
+def search_key(doc_hash, keywords_fingerprint, model_name, search_settings,
+               prefilter=None):
+    """
+    Search output additionally depends on the vocabulary, the model and the
+    search parameters (semantic_search.search_settings()).
+    """
+    key = (f"search:{doc_hash}:{keywords_fingerprint}:{model_name}:"
+           f"{search_settings}:v{RESULTS_VERSION}")
+    return key if prefilter is None else f"{key}:{prefilter}"
+
+
+def get(key):
+    if not CACHE_ENABLED:
+        return None
+    try:
+        blob = _get_cache().get(key)
+    except Exception as e:
+        print(f"⚠️ Result cache unavailable: {e}")
+        return None
+    # Keys start with the cache kind: "search:..." or "extract:..."
+    kind = key.split(":", 1)[0]
+    if blob is None:
+        metrics.inc("cache_misses_total", cache=kind)
+        return None
+    metrics.inc("cache_hits_total", cache=kind)
+    return json.loads(zlib.decompress(blob))
+
+
+def put(key, value):
+    if not CACHE_ENABLED:
+        return
+    with metrics.span("serialize"):
+        blob = zlib.compress(json.dumps(value, ensure_ascii=False,
+                                        separators=(",", ":")).encode("utf-8"))
+    try:
+        _get_cache().put(key, blob)
+    except Exception as e:
+        print(f"⚠️ Could not write result cache: {e}")
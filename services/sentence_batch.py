@@ -0,0 +1,128 @@
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+import numpy as np
+
+EMBEDDING_DIM = 384
+
+
+@dataclass
+class SentenceBatch:
+    """
+    Columnar sentence data passed between extraction, embedding and search.
+    texts:      N sentence strings
+    page_nums:  (N,) int32, 1-based page numbers
+    bboxes:     (N, 4) float64, x0, y0, x1, y1 in PDF points (float64 so the
+                values printed in results match the extracted ones exactly)
+    embeddings: (N, D) float32, or None before encoding
+    normalized: True when every non-zero embedding row is unit-norm, so
+                scoring can skip re-normalization
+    """
+    texts: List[str]
+    page_nums: np.ndarray
+    bboxes: np.ndarray
+    embeddings: Optional[np.ndarray] = None
+    normalized: bool = False
+
+    def __len__(self) -> int:
+        return len(self.texts)
+
+    @classmethod
+    def empty(cls) -> "SentenceBatch":
+        return cls([], np.zeros(0, dtype=np.int32),
+                   np.zeros((0, 4), dtype=np.float64))
+
+    @classmethod
+    def concat(cls, batches: List["SentenceBatch"]) -> "SentenceBatch":
+        batches = [b for b in batches if len(b)]
+        if not batches:
+            return cls.empty()
+        embeddings = None
+        if all(b.embeddings is not None for b in batches):
+            embeddings = np.concatenate([b.embeddings for b in batches])
+        return cls([t for b in batches for t in b.texts],
+                   np.concatenate([b.page_nums for b in batches]),
+                   np.concatenate([b.bboxes for b in batches]),
+                   embeddings,
+                   all(b.normalized for b in batches))
+
+    # ---------------- ADAPTERS ----------------
+    @classmethod
+    def from_pages(cls, pages: List[Dict[str, Any]]) -> "SentenceBatch":
+        """From pdf_service output: [{"page_num", "sentences": [{"text", "bbox"}]}]."""
+        texts, page_nums, bboxes = [], [], []
+        for page in pages or []:
+            page_num = page.get("page_num", -1)
+            for sentence in page.get("sentences", []) or []:
+                text = sentence.get("text", "")
+                if not isinstance(text, str):
+                    text = str(text) if text is not None else ""
+                bbox = sentence.get("bbox")
+                texts.append(text)
+                page_nums.append(page_num)
+                bboxes.append(bbox if bbox is not None and len(bbox) == 4
+                              else (0.0, 0.0, 0.0, 0.0))
+        return cls(texts, np.asarray(page_nums, dtype=np.int32),
+                   np.asarray(bboxes, dtype=np.float64).reshape(-1, 4))
+
+    def to_pages(self) -> List[Dict[str, Any]]:
+        pages = []
+        for text, page_num, bbox in zip(self.texts, self.page_nums.tolist(),
+                                        self.bboxes.tolist()):
+            if not pages or pages[-1]["page_num"] != page_num:
+                pages.append({"page_num": page_num, "sentences": []})
+            pages[-1]["sentences"].append({"text": text, "bbox": bbox})
+        return pages
+
+    @classmethod
+    def from_records(cls, records: List[Dict[str, Any]],
+                     dim: int = EMBEDDING_DIM) -> "SentenceBatch":
+        """
+        From the legacy embedding dicts {"text", "page_num", "bbox", "embedding"}.
+        Embeddings of the wrong length are stored as zero rows, so they fail
+        valid_mask() just like they failed filter_valid_embeddings().
+        """
+        batch = cls.from_pages([{"page_num": r.get("page_num", -1),
+                                 "sentences": [r]} for r in records or []])
+        embeddings = np.zeros((len(batch), dim), dtype=np.float32)
+        for i, record in enumerate(records or []):
+            emb = record.get("embedding", [])
+            if isinstance(emb, (list, np.ndarray)) and len(emb) == dim:
+                embeddings[i] = emb
+        batch.embeddings = embeddings
+        return batch
+
+    def to_records(self) -> List[Dict[str, Any]]:
+        embeddings = (self.embeddings.tolist() if self.embeddings is not None
+                      else [[]] * len(self))
+        return [{"page_num": page_num, "text": text, "bbox": bbox,
+                 "embedding": embedding}
+                for text, page_num, bbox, embedding in zip(
+                    self.texts, self.page_nums.tolist(), self.bboxes.tolist(),
+                    embeddings)]
+
+    # ---------------- MASKS / SELECTION ----------------
+    def nonempty_mask(self) -> np.ndarray:
+        return np.fromiter((bool(t.strip()) for t in self.texts), dtype=bool,
+                           count=len(self.texts))
+
+    def valid_mask(self, dim: int = EMBEDDING_DIM) -> np.ndarray:
+        """Rows whose embedding has the expected dimension and is not all zeros."""
+        if (self.embeddings is None or self.embeddings.ndim != 2
+                or self.embeddings.shape[1] != dim):
+            return np.zeros(len(self), dtype=bool)
+        return np.any(self.embeddings != 0, axis=1)
+
+    def select(self, rows) -> "SentenceBatch":
+        """Subset by boolean mask or index array."""
+        idx = np.flatnonzero(rows) if np.asarray(rows).dtype == bool else np.asarray(rows)
+        return SentenceBatch(
+            [self.texts[i] for i in idx.tolist()],
+            self.page_nums[idx],
+            self.bboxes[idx],
+            self.embeddings[idx] if self.embeddings is not None else None,
+            self.normalized)
+
+    def with_embeddings(self, embeddings: np.ndarray,
+                        normalized: bool = False) -> "SentenceBatch":
+        return SentenceBatch(self.texts, self.page_nums, self.bboxes,
+                             embeddings, normalized)
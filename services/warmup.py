@@ -0,0 +1,98 @@
+import os
+import sys
+import threading
+import time
+
+# ---------------- CONFIG ----------------
+# "background": warm up on a thread when the app gets its first request
+#               (including /ready probes); the server is reachable at once
+# "eager":      warm up while app.py is imported (e.g. gunicorn --preload,
+#               so forked workers share the loaded model)
+# "lazy":       no warm-up; each component loads on first real use
+STARTUP_MODE = os.environ.get("STARTUP_MODE", "background")
+
+_lock = threading.Lock()
+_thread = None
+_timings = {}
+_error = None
+
+
+def warm_up():
+    """
+    Load everything the first upload would otherwise pay for: the punkt
+    tokenizer, the keyword matrix and the embedding model (or a connection
+    to the encoder server). Safe to call more than once.
+    """
+    global _error
+    start = time.perf_counter()
+    try:
+        _step("tokenizer", _warm_tokenizer)
+        _step("keywords", _warm_keywords)
+        _step("model", _warm_model)
+    except Exception as e:
+        _error = str(e)
+        print(f"❌ Warm-up failed: {e}")
+        raise
+    print(f"🔥 Warm-up complete in {time.perf_counter() - start:.1f}s")
+
+
+def start_background_warmup():
+    """Run warm_up() on a daemon thread, once per process."""
+    global _thread
+    with _lock:
+        if _thread is not None:
+            return
+        _thread = threading.Thread(target=_warm_up_quietly, daemon=True,
+                                   name="warm-up")
+        _thread.start()
+
+
+def readiness():
+    """
+    Which components are resident in this process. Never imports or loads
+    anything itself, so it is cheap enough for a readiness probe.
+    """
+    components = {
+        "tokenizer": _module_flag("services.pdf_service", "tokenizer_ready"),
+        "keywords": _module_flag("semantic_search.keyword_store", "is_loaded"),
+        "model": _module_flag("create_embeddings.encoder", "encoder_loaded"),
+    }
+    return {"ready": all(components.values()), "components": components,
+            "startup_mode": STARTUP_MODE, "warmup_seconds": dict(_timings),
+            "error": _error}
+
+
+# ---------------- STEPS ----------------
+def _warm_tokenizer():
+    from services.pdf_service import _ensure_nltk_dependencies
+    _ensure_nltk_dependencies()
+
+
+def _warm_keywords():
+    from semantic_search.keyword_store import get_keyword_store
+    get_keyword_store()
+
+
+def _warm_model():
+    from create_embeddings.encoder import get_encoder
+    # One encode call also initializes the tokenizer and inference kernels
+    get_encoder().encode(["warm-up"])
+
+
+def _step(name, fn):
+    start = time.perf_counter()
+    fn()
+    _timings[name] = round(time.perf_counter() - start, 3)
+    print(f"🔥 Warmed up {name} in {_timings[name]:.2f}s")
+
+
+def _warm_up_quietly():
+    try:
+        warm_up()
+    except Exception:
+        pass  # reported through readiness()
+
+
+def _module_flag(module_name, predicate):
+    module = sys.modules.get(module_name)
+    return module is not None and getattr(module, predicate)()
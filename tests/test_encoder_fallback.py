@@ -0,0 +1,110 @@
+# test_encoder_fallback.py
+# The encoder server dies halfway through a document and the in-process
+# fallback has another model id: the rest of the document must still be
+# encoded (by the fallback), not left as zero rows.
+import sys, os
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+import subprocess
+import time
+import zlib
+import numpy as np
+import pytest
+from create_embeddings import embedding_cache, encoder
+from create_embeddings.create_embeddings_sentences import iter_embeddings
+
+DIM = encoder.EMBEDDING_DIM
+
+# Runs in the server subprocess: argv[1] is the socket address
+SERVER_SCRIPT = """
+import sys, zlib, numpy as np
+from create_embeddings.encoder_server import EncoderServer
+
+class StubEncoder:
+    model_id = "server-stub"
+    def encode(self, texts, batch_size=None, show_progress_bar=False):
+        vectors = np.stack([np.random.default_rng(zlib.crc32(t.encode())).standard_normal({dim})
+                            for t in texts]).astype(np.float32)
+        return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+EncoderServer(address=sys.argv[1], encoder=StubEncoder()).serve_forever()
+""".format(dim=DIM)
+
+
+class LocalStubEncoder:
+    """Fallback encoder whose vectors belong to another model id."""
+    model_id = "local-stub"
+
+    def encode(self, texts, batch_size=None, show_progress_bar=False):
+        vectors = np.stack([np.random.default_rng(zlib.crc32(t.encode()) + 1).standard_normal(DIM)
+                            for t in texts]).astype(np.float32)
+        return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+    def is_loaded(self):
+        return True
+
+
+@pytest.fixture
+def server(tmp_path):
+    address = str(tmp_path / "encoder.sock")
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+    process = subprocess.Popen([sys.executable, "-c", SERVER_SCRIPT, address], env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 30
+    while not os.path.exists(address):
+        assert process.poll() is None and time.monotonic() < deadline, "server did not start"
+        time.sleep(0.05)
+    yield address, process
+    process.kill()
+    process.wait()
+
+
+@pytest.fixture
+def client(server, monkeypatch):
+    address, _ = server
+    monkeypatch.setattr(embedding_cache, "CACHE_ENABLED", False)
+    monkeypatch.setattr(encoder, "ENCODER_MODE", "auto")
+    monkeypatch.setattr(encoder, "create_local_encoder", lambda backend=None: LocalStubEncoder())
+    client = encoder.EncoderClient(address=address)
+    client.ping()
+    monkeypatch.setattr(encoder, "_encoder", client)
+    return client
+
+
+def _pages(count, sentences_per_page=4):
+    return [{"page_num": p,
+             "sentences": [{"text": f"Sentence {i} on page {p} about emissions.",
+                            "bbox": [0.0, 0.0, 1.0, 1.0]}
+                           for i in range(sentences_per_page)]}
+            for p in range(1, count + 1)]
+
+
+def test_server_death_midway_switches_to_local_encoder(server, client):
+    _, process = server
+    assert encoder.current_model_id() == "server-stub"
+
+    batches = []
+    for page_num, batch in iter_embeddings(_pages(6), micro_batch_size=8):
+        batches.append(batch)
+        if len(batches) == 2:
+            process.kill()
+            process.wait()
+
+    assert len(batches) == 6
+    for batch in batches:
+        assert np.all(np.linalg.norm(batch.embeddings, axis=1) > 0.99)
+    assert isinstance(encoder.get_encoder(), LocalStubEncoder)
+    assert encoder.current_model_id() == "local-stub"
+    # Rows after the switch are the fallback model's vectors
+    expected = LocalStubEncoder().encode(batches[-1].texts)
+    assert np.allclose(batches[-1].embeddings, expected, atol=1e-6)
+
+
+def test_replaced_client_raises_encoder_switched(server, client):
+    _, process = server
+    process.kill()
+    process.wait()
+    with pytest.raises(encoder.EncoderSwitched):
+        client.encode(["first"])
+    with pytest.raises(encoder.EncoderSwitched):
+        client.encode(["stale client"])